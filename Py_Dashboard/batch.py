@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import math
+import time
+import wave
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from buffer import RegBlock, reg_value
+from fpga_model import FpgaModel, load_sin_rom, SAMPLE_RATE
+
+READ_CHUNK = 5 * SAMPLE_RATE  # samples streamed through the model per step
+SPECTRUM_POINTS = 4096
+OCTAVE_BANDS = [31.5, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000]
+FULL_SCALE = 2 ** 23
+
+# Worker process state, set once by the pool initializer
+_sin_rom = None
+
+
+def preset_regs(preset: dict) -> list:
+    # Register list from a preset in the GUI's units (see reg_value). Strings are raw register values ("0x1d7b9a90")
+    regs = RegBlock()
+    for name, value in preset.items():
+        regs.set(name, int(value, 0) if isinstance(value, str) else reg_value(name, value))
+    return regs.dump()
+
+
+def read_wav(path: str, chunk: int = READ_CHUNK) -> iter:
+    # (n, 2) 24-bit int32 blocks from a 16, 24 or 32 bit PCM WAV, mono duplicated to both channels
+    with wave.open(path, "rb") as w:
+        width, channels = w.getsampwidth(), w.getnchannels()
+        if w.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path}: {w.getframerate()} Hz, the modulator runs at {SAMPLE_RATE} Hz")
+        if width not in (2, 3, 4) or channels not in (1, 2):
+            raise ValueError(f"{path}: expected 16, 24 or 32 bit mono or stereo")
+
+        while True:
+            data = np.frombuffer(w.readframes(chunk), dtype=np.uint8)
+            if not len(data):
+                return
+            if width == 3:
+                b = data.reshape(-1, 3).astype(np.int32)
+                v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+                v = (v ^ (1 << 23)) - (1 << 23)
+            else:
+                v = data.view("<i2" if width == 2 else "<i4").astype(np.int32)
+                v = v << 8 if width == 2 else v >> 8
+            v = v.reshape(-1, channels)
+            yield np.repeat(v, 2, axis=1) if channels == 1 else v
+
+
+class Analyzer:
+    # Running peak, RMS and averaged power spectrum of a streamed (n, 2) signal
+    def __init__(self):
+        self.peak = np.zeros(2, dtype=np.int64)
+        self.energy = np.zeros(2)
+        self.samples = 0
+        self.power = np.zeros((SPECTRUM_POINTS // 2 + 1, 2))
+        self.segments = 0
+        self._window = np.hanning(SPECTRUM_POINTS)[:, None]
+        self._rest = np.zeros((0, 2), dtype=np.int32)
+
+    def add(self, x: np.ndarray):
+        self.peak = np.maximum(self.peak, np.abs(x).max(axis=0, initial=0))
+        self.energy += np.square(x, dtype=np.float64).sum(axis=0)
+        self.samples += len(x)
+
+        # Non-overlapping segments, the remainder carried into the next block
+        x = np.concatenate((self._rest, x))
+        n = len(x) // SPECTRUM_POINTS
+        if n:
+            segments = x[:n * SPECTRUM_POINTS].reshape(n, SPECTRUM_POINTS, 2) / FULL_SCALE
+            self.power += (np.abs(np.fft.rfft(segments * self._window, axis=1)) ** 2).sum(axis=0)
+            self.segments += n
+        self._rest = x[n * SPECTRUM_POINTS:]
+
+    def summary(self) -> dict:
+        def db(v):
+            return [round(10 * math.log10(max(float(c), 1e-30)), 2) for c in v]
+
+        rms = self.energy / max(self.samples, 1) / FULL_SCALE ** 2
+        result = {"peak_dbfs": db((self.peak / FULL_SCALE) ** 2), "rms_dbfs": db(rms)}
+
+        # Octave band levels relative to full scale, from the averaged spectrum
+        freqs = np.fft.rfftfreq(SPECTRUM_POINTS, d=1.0 / SAMPLE_RATE)
+        power = self.power / max(self.segments, 1) / np.square(self._window).sum() * 2 / SPECTRUM_POINTS
+        bands = {}
+        for fc in OCTAVE_BANDS:
+            sel = (freqs >= fc / math.sqrt(2)) & (freqs < fc * math.sqrt(2))
+            bands[str(fc)] = db(power[sel].sum(axis=0))
+        result["octave_dbfs"] = bands
+        return result
+
+
+def _init_worker():
+    global _sin_rom
+    _sin_rom = load_sin_rom()
+
+
+def render(in_path: str, preset_name: str, regs: list, out_path: str, tail: float = 0) -> dict:
+    # One input through one preset, streamed chunk by chunk so memory stays flat for any file length
+    start = time.perf_counter()
+    model = FpgaModel(regs, _sin_rom)
+    src, dst = Analyzer(), Analyzer()
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with wave.open(out_path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(3)
+        w.setframerate(SAMPLE_RATE)
+
+        def emit(x):
+            y = model.process(x)
+            dst.add(y)
+            w.writeframesraw(np.ascontiguousarray(y.view(np.uint8).reshape(-1, 2, 4)[:, :, :3]))
+
+        for x in read_wav(in_path):
+            src.add(x)
+            emit(x)
+        # Lets the delays and filter tails ring out
+        remaining = int(tail * SAMPLE_RATE)
+        while remaining > 0:
+            n = min(remaining, READ_CHUNK)
+            emit(np.zeros((n, 2), dtype=np.int32))
+            remaining -= n
+
+    return {"input": in_path, "preset": preset_name, "output": out_path, "seconds": src.samples / SAMPLE_RATE,
+            "render_seconds": round(time.perf_counter() - start, 3), "in": src.summary(), "out": dst.summary()}
+
+
+def collect_inputs(paths: list) -> list:
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(os.path.join(root, f) for root, _, names in os.walk(p) for f in names
+                            if f.lower().endswith(".wav"))
+        else:
+            files.append(p)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render WAV files through register presets with the FPGA model")
+    parser.add_argument("presets", help='JSON file of {"name": {"mixer": 1, "lpf": 800, ...}, ...}')
+    parser.add_argument("inputs", nargs="+", help="WAV files or directories of them")
+    parser.add_argument("-o", "--out-dir", default="renders", help="outputs go to OUT_DIR/<preset>/<file>.wav")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--tail", type=float, default=0, help="seconds of silence appended to every render")
+    args = parser.parse_args()
+
+    with open(args.presets) as f:
+        presets = {name: preset_regs(p) for name, p in json.load(f).items()}
+    inputs = collect_inputs(args.inputs)
+
+    # Longest files first, so the last jobs to finish are short ones and no core idles at the end
+    jobs = [(path, name) for path in inputs for name in presets]
+    jobs.sort(key=lambda j: os.path.getsize(j[0]), reverse=True)
+
+    start = time.perf_counter()
+    results, failed = [], 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+        futures = {}
+        for path, name in jobs:
+            out_path = os.path.join(args.out_dir, name, os.path.splitext(os.path.basename(path))[0] + ".wav")
+            futures[pool.submit(render, path, name, presets[name], out_path, args.tail)] = (path, name)
+
+        for i, future in enumerate(as_completed(futures), 1):
+            path, name = futures[future]
+            try:
+                r = future.result()
+            except (OSError, ValueError, EOFError, wave.Error) as e:
+                failed += 1
+                print(f"[{i}/{len(jobs)}] {name} {path}: {e}", file=sys.stderr, flush=True)
+                continue
+            results.append(r)
+            print(f"[{i}/{len(jobs)}] {name} {path}: {r['seconds']:.1f} s in {r['render_seconds']:.1f} s, "
+                  f"out peak {max(r['out']['peak_dbfs']):.1f} dBFS", flush=True)
+    elapsed = time.perf_counter() - start
+
+    results.sort(key=lambda r: (r["preset"], r["input"]))
+    os.makedirs(args.out_dir, exist_ok=True)
+    with open(os.path.join(args.out_dir, "summary.json"), "w") as f:
+        json.dump({"presets": {name: [f"0x{r:08x}" for r in regs] for name, regs in presets.items()},
+                   "renders": results}, f, indent=2)
+    with open(os.path.join(args.out_dir, "summary.csv"), "w") as f:
+        f.write("preset,input,seconds,in_peak_l,in_peak_r,in_rms_l,in_rms_r,"
+                "out_peak_l,out_peak_r,out_rms_l,out_rms_r\n")
+        for r in results:
+            levels = r["in"]["peak_dbfs"] + r["in"]["rms_dbfs"] + r["out"]["peak_dbfs"] + r["out"]["rms_dbfs"]
+            f.write(f"{r['preset']},{r['input']},{r['seconds']:.3f}," + ",".join(str(v) for v in levels) + "\n")
+
+    audio = sum(r["seconds"] for r in results)
+    print(f"{len(results)} renders, {audio:.0f} s of audio in {elapsed:.1f} s with {args.workers} workers "
+          f"({audio / elapsed:.1f}x real time), {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
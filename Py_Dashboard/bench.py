@@ -0,0 +1,315 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import numpy as np
+
+from buffer import StereoRingBuffer, RegBlock
+from network import FrameDecoder, StreamStats, ETH_HEADER_LEN, RAW_BATCH, RAW_FRAME_SIZE
+from spectrum import StftEngine, WelchEstimator, Waterfall
+from pipeline import PlotWorker
+from trigger import EdgeTrigger
+from measure import MeasurementEngine
+from devices import DeviceRegistry, dispatch_batch
+
+# Sized like the dashboard: 5 s stereo ring, 16384 point FFT, full 250-slot frames
+SAMPLE_RATE = 48000
+BUFFER_SAMPLES = 5 * SAMPLE_RATE
+ENVELOPE_LEVELS = 5
+FFT_POINTS = 16384
+FRAME_SLOTS = 250
+PLOT_WIDTH = 1280
+
+TARGET_SECONDS = 0.02  # calls per round are calibrated to take about this long
+ROUNDS = 7
+
+BENCHMARKS = []
+
+
+def benchmark(name: str, **params):
+    # Registers setup(**case) -> callable, once per combination of parameter values
+    def register(setup):
+        cases = [{}]
+        for key, values in params.items():
+            cases = [dict(c, **{key: v}) for c in cases for v in values]
+        for case in cases:
+            BENCHMARKS.append((name, case, setup))
+        return setup
+    return register
+
+
+def filled_buffer(envelope_levels: int = ENVELOPE_LEVELS, extra: int = 0) -> StereoRingBuffer:
+    # A full ring, then `extra` more samples so the write position sits inside it
+    buf = StereoRingBuffer(BUFFER_SAMPLES, spsc=True, envelope_levels=envelope_levels)
+    rng = np.random.default_rng(0)
+    data = rng.integers(-2 ** 23, 2 ** 23, size=(BUFFER_SAMPLES, 2), dtype=np.int32)
+    buf.write(data)
+    if extra:
+        buf.write(data[:extra])
+    return buf
+
+
+def synthetic_frames(count: int) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(1)
+    frames = np.zeros((count, RAW_FRAME_SIZE), dtype=np.uint8)
+    length = ETH_HEADER_LEN + FRAME_SLOTS * 6
+    frames[:, :length] = rng.integers(0, 256, size=(count, length), dtype=np.uint8)
+    return frames, np.full(count, length, dtype=np.int64)
+
+
+@benchmark("decode", frames=[1, 16, RAW_BATCH])
+def bench_decode(frames):
+    buf = filled_buffer(0)
+    data, lengths = synthetic_frames(frames)
+    decoder = FrameDecoder(frames)
+    return lambda: decoder.decode(data, lengths, frames, ETH_HEADER_LEN, buf)
+
+
+@benchmark("stats_record", frames=[1, RAW_BATCH])
+def bench_stats_record(frames):
+    data, lengths = synthetic_frames(frames)
+    arrivals = np.arange(frames) * (FRAME_SLOTS / SAMPLE_RATE)
+    stats = StreamStats()
+
+    def run():
+        arrivals[:] += frames * FRAME_SLOTS / SAMPLE_RATE
+        stats.record(data, lengths, frames, ETH_HEADER_LEN, arrivals, 1e-5, frames * (FRAME_SLOTS - 1))
+    return run
+
+
+@benchmark("demux", boards=[1, 4], frames=[4, RAW_BATCH])
+def bench_demux(boards, frames):
+    # Interleaved frames of several boards, split and decoded into one ring per board
+    data, lengths = synthetic_frames(frames)
+    registry = DeviceRegistry()
+    for b in range(boards):
+        registry.add(f"80:1F:12:CA:83:{b:02X}", StereoRingBuffer(BUFFER_SAMPLES, spsc=True,
+                                                                 envelope_levels=ENVELOPE_LEVELS), RegBlock())
+    keys = [d.key for d in registry]
+    for i in range(frames):
+        data[i, 6:12] = np.frombuffer(keys[i % boards], dtype=np.uint8)
+    devices = {d.key: d for d in registry}
+    arrivals = np.arange(frames) // boards * (FRAME_SLOTS / SAMPLE_RATE)
+    decoder = FrameDecoder(frames)
+
+    def run():
+        arrivals[:] += frames // boards * FRAME_SLOTS / SAMPLE_RATE
+        dispatch_batch(decoder, data, lengths, arrivals, frames, devices)
+    return run
+
+
+@benchmark("ring_write", samples=[FRAME_SLOTS, 4096, SAMPLE_RATE], envelope=[0, ENVELOPE_LEVELS],
+           wrap=[False, True])
+def bench_ring_write(samples, envelope, wrap):
+    buf = filled_buffer(envelope)
+    block = np.ones((samples, 2), dtype=np.int32)
+
+    # Every write either fits before the end of the ring or straddles it
+    start = BUFFER_SAMPLES - samples // 2 if wrap else 0
+
+    def run():
+        buf.write_ptr = start
+        buf.write(block)
+    return run
+
+
+@benchmark("ring_read", samples=[4800, SAMPLE_RATE, BUFFER_SAMPLES], wrap=[False, True])
+def bench_ring_read(samples, wrap):
+    out = np.empty((samples, 2), dtype=np.int32)
+    if not wrap:
+        # Newest samples of a ring written exactly once: one contiguous copy
+        buf = filled_buffer()
+        return lambda: buf.read_into(out, samples)
+
+    # Window split half and half around the end of the ring
+    buf = filled_buffer(extra=BUFFER_SAMPLES // 2)
+    end = buf.seq - buf.write_ptr + samples // 2
+    return lambda: buf.read_into(out, samples, end=end)
+
+
+@benchmark("ring_envelope", seconds=[0.5, 5.0])
+def bench_ring_envelope(seconds):
+    buf = filled_buffer()
+    return lambda: buf.read_envelope(int(seconds * SAMPLE_RATE), PLOT_WIDTH)
+
+
+@benchmark("get_fft", window=["hann", "hamming", "blackman"], cached=[False, True])
+def bench_get_fft(window, cached):
+    buf = filled_buffer(0)
+    buf.get_fft(FFT_POINTS, window)
+    if cached:
+        return lambda: buf.get_fft(FFT_POINTS, window)
+
+    def run():
+        buf._fft_cache.clear()
+        buf.get_fft(FFT_POINTS, window)
+    return run
+
+
+@benchmark("stft_update", hops=[1, 8])
+def bench_stft_update(hops):
+    buf = filled_buffer(0)
+    stft = StftEngine(buf, FFT_POINTS)
+    stft.update()
+
+    def run():
+        # Rewinds the engine so every call computes the same number of new spectra
+        stft._next_end = buf.seq - (hops - 1) * stft.hop
+        stft.update()
+    return run
+
+
+@benchmark("welch", average=[1, 10, 100], max_hold=[False, True])
+def bench_welch(average, max_hold):
+    buf = filled_buffer(0)
+    stft = StftEngine(buf, FFT_POINTS)
+    welch = WelchEstimator(stft, average)
+    for _ in range(average):
+        stft._next_end = buf.seq
+        welch.update()
+
+    def run():
+        # One new segment per call, then the averaged spectrum as the plot reads it
+        stft._next_end = buf.seq
+        welch.update()
+        return welch.max() if max_hold else welch.mean()
+    return run
+
+
+@benchmark("waterfall_update", frames=[1, 8])
+def bench_waterfall_update(frames):
+    buf = filled_buffer(0)
+    stft = StftEngine(buf, FFT_POINTS)
+    stft.update()
+    waterfall = Waterfall(stft, 256, 256, scale=1.0 / (2 ** 23 * FFT_POINTS) ** 2)
+
+    def run():
+        # Replays the last `frames` STFT frames as new columns
+        waterfall._consumed = stft.count - frames
+        waterfall.update()
+        return waterfall.view()
+    return run
+
+
+@benchmark("trigger", new_samples=[SAMPLE_RATE // 30, SAMPLE_RATE])
+def bench_trigger(new_samples):
+    buf = filled_buffer(0)
+    trigger = EdgeTrigger(buf)
+    trigger.configure(mode="normal", level=1.0)
+    trigger.window_end(BUFFER_SAMPLES // 2, 0.5)
+
+    def run():
+        # Rescans the newest samples as if they had just been written
+        trigger._pos = buf.seq - new_samples
+        return trigger.window_end(BUFFER_SAMPLES // 2, 0.5)
+    return run
+
+
+@benchmark("measure")
+def bench_measure():
+    buf = filled_buffer(0)
+    stft = StftEngine(buf, FFT_POINTS)
+    stft.update()
+    measure = MeasurementEngine(buf, stft)
+
+    def run():
+        # Bypasses the rate limit, every call computes a full result
+        measure._next = 0.0
+        measure._frames_seen = -1
+        return measure.update()
+    return run
+
+
+@benchmark("plot_compute", time_step=[0.01, 0.5, 5.0], freq_scale=["linear", "log"])
+def bench_plot_compute(time_step, freq_scale):
+    buf = filled_buffer()
+    stft = StftEngine(buf, FFT_POINTS)
+    welch = WelchEstimator(stft, 2, scale=1.0 / (2 ** 23 * FFT_POINTS) ** 2)
+    worker = PlotWorker(buf, stft, welch, 30)
+    worker.configure(time_step=time_step, width=PLOT_WIDTH, freq_scale=freq_scale)
+
+    def run():
+        stft._next_end = buf.seq
+        return worker.compute()
+    return run
+
+
+def measure(fn) -> dict:
+    # timeit style: calibrate the calls per round, then keep per-call times of every round
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= TARGET_SECONDS or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(TARGET_SECONDS / elapsed) + 1))
+
+    times = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+
+    return {"number": number, "rounds": ROUNDS, "min": min(times), "median": float(np.median(times)),
+            "mean": float(np.mean(times)), "stddev": float(np.std(times))}
+
+
+def case_id(name: str, case: dict) -> str:
+    return name + "".join(f"[{k}={v}]" for k, v in case.items())
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the decode, buffer, FFT and plot hot paths")
+    parser.add_argument("-k", dest="select", default="", help="only run benchmarks whose id contains this")
+    parser.add_argument("-o", "--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {b["id"]: b for b in json.load(f)["benchmarks"]}
+
+    results = []
+    for name, case, setup in BENCHMARKS:
+        bid = case_id(name, case)
+        if args.select not in bid:
+            continue
+
+        stats = measure(setup(**case))
+        results.append({"id": bid, "name": name, "params": case, **stats})
+
+        line = f"{bid:<60} {stats['median'] * 1e6:12.2f} us"
+        if bid in baseline:
+            line += f"  {stats['median'] / baseline[bid]['median']:6.2f}x"
+        print(line, flush=True)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "numpy": np.__version__,
+                    "platform": platform.platform(), "processor": platform.processor()},
+        "benchmarks": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
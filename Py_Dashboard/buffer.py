@@ -1,8 +1,24 @@
+import os
+import math
+import shutil
+import tempfile
 import threading
+import contextlib
+import multiprocessing
 import numpy as np
+from multiprocessing import shared_memory
+
+SPSC_READ_RETRIES = 4
+
+# Min/max envelope pyramid: level k holds one min/max pair per ENVELOPE_BASE * ENVELOPE_RATIO**k samples
+ENVELOPE_BASE = 16
+ENVELOPE_RATIO = 4
 
 
 class RegBlock:
+    # Bumped on every register change, senders wait on `changed` for it to move
+    generation = 0
+
     def __init__(self):
         self.regs = [
             0x00000000,  # Mixer select
@@ -19,6 +35,7 @@ class RegBlock:
             0  # Delay right
         ]
         self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
 
         # Optional: map names → indices
         self.names = {
@@ -42,7 +59,12 @@ class RegBlock:
                 idx = self.names[key]
             else:
                 idx = key
-            self.regs[idx] = value & 0xFFFFFFFF
+
+            value &= 0xFFFFFFFF
+            if self.regs[idx] != value:
+                self.regs[idx] = value
+                self.generation += 1
+                self.changed.notify_all()
 
     def get(self, key):
         with self.lock:
@@ -54,20 +76,83 @@ class RegBlock:
 
     def dump(self):
         with self.lock:
-            return self.regs.copy()
+            return self.dump_unlocked()
+
+    def dump_unlocked(self):
+        return self.regs.copy()
+
+    def snapshot(self) -> tuple[int, list]:
+        with self.lock:
+            return self.generation, self.dump_unlocked()
+
+    def wait_changed(self, generation: int, timeout: float = None) -> int:
+        # Blocks until the generation differs from the given one (or timeout), returns the current one
+        with self.changed:
+            self.changed.wait_for(lambda: self.generation != generation, timeout)
+            return self.generation
+
+
+def reg_value(name: str, value) -> int:
+    # Register value from a control in the GUI's units: filter corners and tremolo rate in Hz, volumes
+    # in %, distortion as a 0..1 threshold of full scale, the rest (mixer, delays in samples) as is
+    if name in ("lpf", "bpf_low"):
+        return math.floor((1 - math.e ** (-2 * math.pi * (value / 48000))) * (2 ** 31))
+    if name in ("hpf", "bpf_high"):
+        k = math.tan(math.pi * (value / 48000))
+        return math.floor(((1 - k) / (1 + k)) * (2 ** 31))
+    if name == "bsf":
+        return math.floor((2 * math.cos(2 * math.pi * (value / 48000))) * (2 ** 30))
+    if name == "tremolo":
+        return math.floor((1024 * int(value) / 48000) * (2 ** 16))
+    if name in ("vol_left", "vol_right"):
+        return math.floor((value / 200) * (2 ** 31)) - 1
+    if name == "distortion":
+        return int(value * (2 ** 23 - 1))
+    return int(value)
 
 
 class RingBuffer:
-    def __init__(self, size):
+    def __init__(self, size, channels: int = 1, spsc: bool = False, envelope_levels: int = 0):
         self.size = int(size)
-        self.lock = threading.Lock()
-        self.buf = np.zeros(self.size, dtype=np.int32)
-        self.write_ptr = 0
+        self.channels = channels
+        shape = (self.size,) if channels == 1 else (self.size, channels)
+        self.buf = self._alloc(shape, np.int32)
+
+        # Envelope pyramid, updated incrementally on every write
+        self._env_factors = []
+        self._env_min = []
+        self._env_max = []
+        self._env_offsets = []
+        for k in range(envelope_levels):
+            factor = ENVELOPE_BASE * ENVELOPE_RATIO ** k
+            if factor > self.size:
+                break
+            blocks = -(-self.size // factor)
+            step = ENVELOPE_BASE if k == 0 else ENVELOPE_RATIO
+            self._env_factors.append(factor)
+            self._env_min.append(self._alloc((blocks,) + shape[1:], np.int32))
+            self._env_max.append(self._alloc((blocks,) + shape[1:], np.int32))
+            self._env_offsets.append(np.arange(0, blocks * step, step))
+
+        # seq: total samples published, claim: total samples the producer has started writing.
+        # In SPSC mode there is no lock, readers re-check claim to detect torn reads instead
+        self.spsc = spsc
+        self.lock = contextlib.nullcontext() if spsc else threading.Lock()
+        self._init_counters()
 
-        # FFT cache: key -> (write_ptr, result)
+        # FFT cache: key -> (seq, result)
         # Window cache: length -> window ndarray
         self._fft_cache = {}
         self._window_cache = {}
+        self._freq_axis_cache = {}
+
+    def _alloc(self, shape: tuple, dtype) -> np.ndarray:
+        return np.zeros(shape, dtype=dtype)
+
+    def _init_counters(self):
+        self.write_ptr = 0
+        self.seq = 0
+        self._claim = 0
 
     def write(self, data: np.ndarray):
         length = data.shape[0]
@@ -75,32 +160,170 @@ class RingBuffer:
         if length == 0:
             return
 
+        # Longer than the ring: only the newest samples are stored, but seq still counts all of them
+        skip = max(length - self.size, 0)
+        data = data[skip:]
+
         with self.lock:
-            end = self.write_ptr + length
+            self._claim = self.seq + length
+            start = (self.write_ptr + skip) % self.size
+            end = start + length - skip
 
             if end <= self.size:
-                self.buf[self.write_ptr:end] = data
+                self.buf[start:end] = data
             else:
-                first = self.size - self.write_ptr
-                self.buf[self.write_ptr:] = data[:first]
+                first = self.size - start
+                self.buf[start:] = data[:first]
                 self.buf[: end % self.size] = data[first:]
 
+            self._update_envelope(start, length - skip)
             self.write_ptr = end % self.size
+            self.seq = self._claim
 
-        # Invalidate FFT cache after any write
-        self._fft_cache.clear()
+    def write_with(self, length: int, fill):
+        # fill(dst, offset) writes samples [offset, offset + len(dst)) straight into ring storage
+        if length <= 0:
+            return
 
-    def read(self, nr_samples: int) -> np.ndarray:
-        corrected_nr_samples = self.size if nr_samples > self.size else nr_samples
+        skip = max(length - self.size, 0)
 
         with self.lock:
-            end = self.write_ptr
-            start = (end - corrected_nr_samples) % self.size
+            self._claim = self.seq + length
+            start = (self.write_ptr + skip) % self.size
+            end = start + length - skip
 
-            if start < end:
-                return self.buf[start:end].copy()
+            if end <= self.size:
+                fill(self.buf[start:end], skip)
             else:
-                return np.concatenate((self.buf[start:], self.buf[:end])).copy()
+                first = self.size - start
+                fill(self.buf[start:], skip)
+                fill(self.buf[: end % self.size], skip + first)
+
+            self._update_envelope(start, length - skip)
+            self.write_ptr = end % self.size
+            self.seq = self._claim
+
+    def read(self, nr_samples: int, end: int = None) -> np.ndarray:
+        # Copy of the nr_samples ending at end, empty if that range has already been overwritten
+        corrected_nr_samples = self.size if nr_samples > self.size else nr_samples
+
+        out = np.empty((corrected_nr_samples,) + self.buf.shape[1:], dtype=self.buf.dtype)
+        return out[:self.read_into(out, corrected_nr_samples, end)]
+
+    def read_into(self, out: np.ndarray, nr_samples: int, end: int = None) -> int:
+        # Copies the nr_samples ending at absolute position end (default: newest) into out.
+        # Returns the number of samples copied, 0 if that range has already been overwritten
+        n = min(int(nr_samples), self.size, out.shape[0])
+        if end is not None and end > self.seq:
+            raise ValueError(f"end {end} is past the newest sample {self.seq}")
+
+        if not self.spsc:
+            with self.lock:
+                stop = self.seq if end is None else end
+                if self._claim - self.size > stop - n:
+                    return 0
+                self._copy_out(out, n, stop)
+            return n
+
+        for _ in range(SPSC_READ_RETRIES):
+            stop = self.seq if end is None else end
+            self._copy_out(out, n, stop)
+
+            # The window is intact if the producer has not started overwriting its oldest sample
+            if self._claim - self.size <= stop - n:
+                return n
+            if end is not None:
+                return 0
+        # Lapped on every retry, what was copied is torn
+        return 0
+
+    def view(self, nr_samples: int, end: int = None) -> np.ndarray:
+        # Zero-copy view of the nr_samples ending at end, None if the window wraps around the ring.
+        # Only valid until the producer laps it, callers check with `oldest` if that matters
+        n = min(int(nr_samples), self.size)
+        stop = (self.seq if end is None else end) % self.size
+        if stop == 0 and n > 0:
+            stop = self.size
+        if stop - n < 0:
+            return None
+        return np.asarray(self.buf[stop - n:stop])
+
+    @property
+    def oldest(self) -> int:
+        # Absolute position of the oldest sample still held
+        return max(self.seq - self.size, 0)
+
+    def _copy_out(self, out: np.ndarray, n: int, end: int):
+        stop = end % self.size
+        start = stop - n
+
+        if start >= 0:
+            out[:n] = self.buf[start:stop]
+        else:
+            out[:-start] = self.buf[start:]
+            out[-start:n] = self.buf[:stop]
+
+    # Envelope methods
+    def _update_envelope(self, start: int, length: int):
+        if not self._env_factors:
+            return
+
+        end = start + length
+        spans = [(start, end)] if end <= self.size else [(start, self.size), (0, end - self.size)]
+
+        for lo, hi in spans:
+            # Block range touched at the current level, refined level by level
+            b0, b1 = lo, hi
+            src_min, src_max, src_len = self.buf, self.buf, self.size
+            for k, factor in enumerate(self._env_factors):
+                step = ENVELOPE_BASE if k == 0 else ENVELOPE_RATIO
+                b0, b1 = b0 // step, -(-b1 // step)
+                seg = slice(b0 * step, min(b1 * step, src_len))
+                idx = self._env_offsets[k][:b1 - b0]
+
+                np.minimum.reduceat(src_min[seg], idx, axis=0, out=self._env_min[k][b0:b1])
+                np.maximum.reduceat(src_max[seg], idx, axis=0, out=self._env_max[k][b0:b1])
+                src_min, src_max, src_len = self._env_min[k], self._env_max[k], len(self._env_min[k])
+
+    def read_envelope(self, nr_samples: int, points: int, end: int = None):
+        # Returns (min, max, factor) with at least `points` min/max pairs covering the window,
+        # or None if the window is short enough to plot raw samples. The pairs are empty if the
+        # window has already been overwritten, same as read()
+        n = min(int(nr_samples), self.size)
+
+        level = -1
+        for k, factor in enumerate(self._env_factors):
+            if n // factor >= points:
+                level = k
+        if level < 0:
+            return None
+
+        factor = self._env_factors[level]
+        env_min, env_max = self._env_min[level], self._env_max[level]
+        for _ in range(SPSC_READ_RETRIES):
+            with self.lock:
+                stop = self.seq if end is None else end
+                p_start = (stop - n) % self.size
+                p_stop = stop % self.size
+
+                # Only whole blocks, the partial blocks at either edge are left out
+                b0 = -(-p_start // factor)
+                b1 = p_stop // factor
+                if p_start < p_stop:
+                    lo = env_min[b0:b1].copy()
+                    hi = env_max[b0:b1].copy()
+                else:
+                    lo = np.concatenate((env_min[b0:], env_min[:b1]))
+                    hi = np.concatenate((env_max[b0:], env_max[:b1]))
+
+                # Same check as read_into(): the blocks are intact if the producer has not started
+                # overwriting the oldest sample, which in SPSC mode may have happened during the copy
+                if self._claim - self.size <= stop - n:
+                    return lo, hi, factor
+            if end is not None or not self.spsc:
+                break
+        # Lapped on every retry, what was copied is torn
+        return lo[:0], hi[:0], factor
 
     # FFT methods
     def get_fft(self, n_fft: int, window: str = "hann") -> np.ndarray:
@@ -108,41 +331,43 @@ class RingBuffer:
 
         # Use cache if nothing changed for this configuration
         cache_key = (n_fft, window)
-        with self.lock:
-            wp = self.write_ptr
+        seq = self.seq
         cached = self._fft_cache.get(cache_key)
         if cached is not None:
-            cached_wp, cached_fft = cached
-            if cached_wp == wp:
+            cached_seq, cached_fft = cached
+            if cached_seq == seq:
                 return cached_fft.copy()
 
-        # Snapshot most recent n_fft samples (outside further lock use)
-        x = self.read(n_fft).astype(np.float64, copy=False)
+        # Snapshot the n_fft samples ending at seq
+        x = self.read(n_fft, end=seq).astype(np.float64, copy=False)
 
         # Scale-compensate window to preserve overall energy roughly
         w = self._get_window(len(x), window)
         if w is not None:
-            x = x * w
+            x = x * (w if x.ndim == 1 else w[:, None])
 
         # Zero-pad if needed
         if padded_len > len(x):
-            xz = np.zeros(padded_len, dtype=x.dtype)
+            xz = np.zeros((padded_len,) + x.shape[1:], dtype=x.dtype)
             xz[: len(x)] = x
             x = xz
         elif padded_len < len(x):
             x = x[-padded_len:]
 
-        # Compute FFT
-        X = np.fft.rfft(x)
+        # Compute FFT (all channels in one call)
+        X = np.fft.rfft(x, axis=0)
 
-        # Cache using the write_ptr at snapshot time
-        self._fft_cache[cache_key] = (wp, X.copy())
+        # Cache using the seq at snapshot time
+        self._fft_cache[cache_key] = (seq, X.copy())
         return X
 
     def get_freq_axis(self, n_fft: int):
         padded_len = (1 << (int(n_fft - 1).bit_length()))
-
-        return np.fft.rfftfreq(padded_len, d=1.0 / 48000)
+        if padded_len not in self._freq_axis_cache:
+            axis = np.fft.rfftfreq(padded_len, d=1.0 / 48000)
+            axis.flags.writeable = False
+            self._freq_axis_cache[padded_len] = axis
+        return self._freq_axis_cache[padded_len]
 
     def _get_window(self, length: int, kind: str):
         key = (length, kind)
@@ -158,3 +383,141 @@ class RingBuffer:
 
         self._window_cache[key] = w
         return w
+
+
+class StereoRingBuffer(RingBuffer):
+    # Interleaved (N x 2) storage: one lock and one write pointer for both channels,
+    # so every read returns left and right for the same sample range
+    def __init__(self, size, spsc: bool = False, envelope_levels: int = 0):
+        super().__init__(size, channels=2, spsc=spsc, envelope_levels=envelope_levels)
+
+
+class MemmapRingBuffer(RingBuffer):
+    # Hours of history in files mapped into memory: the page cache keeps the recent tail resident
+    # and older samples are only paged in when scrolled back to. Opening the same path again with the
+    # same layout resumes its history, the temporary default directory does not outlive the buffer
+    seq = property(lambda self: int(self._counters[0]), lambda self, v: self._counters.__setitem__(0, v))
+    _claim = property(lambda self: int(self._counters[1]), lambda self, v: self._counters.__setitem__(1, v))
+    write_ptr = property(lambda self: int(self._counters[2]), lambda self, v: self._counters.__setitem__(2, v))
+
+    def __init__(self, size, channels: int = 1, spsc: bool = False, envelope_levels: int = 0, path: str = None):
+        self.owns_path = path is None
+        self.path = tempfile.mkdtemp(prefix="ringbuf_") if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+        self._maps = []
+        self.resumed = True
+        super().__init__(size, channels=channels, spsc=spsc, envelope_levels=envelope_levels)
+
+    def _alloc(self, shape: tuple, dtype) -> np.ndarray:
+        # Existing files of the right size are mapped as they are, anything else starts from zeros
+        path = os.path.join(self.path, f"{len(self._maps)}.dat")
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        keep = os.path.exists(path) and os.path.getsize(path) == nbytes
+        self.resumed &= keep
+        m = np.memmap(path, dtype=dtype, mode="r+" if keep else "w+", shape=shape)
+        self._maps.append(m)
+        return m
+
+    def _init_counters(self):
+        # [seq, claim, write_ptr] in the last file, only trusted if every other file was kept too
+        self._counters = self._alloc((3,), np.int64)
+        if not self.resumed:
+            self._counters[:] = 0
+        # A write cut short by the restart is published as it stands: the gap is at that point anyway,
+        # and the slots it overwrote must not be read as the older samples they held
+        if self._claim > self.seq:
+            self.seq = self._claim
+            self.write_ptr = self._claim % self.size
+
+    def close(self, remove: bool = True):
+        # The mappings stay valid after their files are removed, so a late write cannot fault
+        if remove and self.owns_path:
+            shutil.rmtree(self.path, ignore_errors=True)
+        else:
+            for m in self._maps:
+                m.flush()
+
+
+class SharedRegBlock(RegBlock):
+    # Register values and generation in shared memory, guarded by a multiprocessing lock/condition
+    generation = property(lambda self: int(self._generation[0]),
+                          lambda self, v: self._generation.__setitem__(0, v))
+
+    def __init__(self, lock=None, changed=None, name: str = None, create: bool = True):
+        super().__init__()
+        defaults = self.regs
+
+        # [regs (uint32) ... | generation (int64)]
+        self._shm = open_shared_memory(name, 4 * len(defaults) + 8, create)
+        self.name = self._shm.name
+        self.regs = np.ndarray(len(defaults), dtype=np.uint32, buffer=self._shm.buf)
+        self._generation = np.ndarray(1, dtype=np.int64, buffer=self._shm.buf, offset=4 * len(defaults))
+        if create:
+            self.regs[:] = defaults
+        self.lock = lock if lock is not None else multiprocessing.Lock()
+        self.changed = changed if changed is not None else multiprocessing.Condition(self.lock)
+
+    def spec(self) -> dict:
+        # Arguments that attach another process to this block
+        return {"lock": self.lock, "changed": self.changed, "name": self.name, "create": False}
+
+    def get(self, key):
+        return int(super().get(key))
+
+    def dump_unlocked(self):
+        return [int(x) for x in self.regs]
+
+    def close(self, unlink: bool = False):
+        self.regs = self._generation = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class SharedRingBuffer(RingBuffer):
+    # Storage, envelope pyramid and counters live in shared memory so another process can write
+    # them. Always lock-free: the seq/claim protocol works across processes, a threading.Lock does not
+    seq = property(lambda self: int(self._counters[0]), lambda self, v: self._counters.__setitem__(0, v))
+    _claim = property(lambda self: int(self._counters[1]), lambda self, v: self._counters.__setitem__(1, v))
+    write_ptr = property(lambda self: int(self._counters[2]), lambda self, v: self._counters.__setitem__(2, v))
+
+    def __init__(self, size, channels: int = 1, envelope_levels: int = 0, name: str = None, create: bool = True):
+        self.name = name if name is not None else f"ringbuf_{os.getpid()}_{id(self):x}"
+        self.create = create
+        self._shms = []
+        super().__init__(size, channels=channels, spsc=True, envelope_levels=envelope_levels)
+
+    def spec(self) -> dict:
+        # Arguments that attach another process to this buffer
+        return {"size": self.size, "channels": self.channels, "envelope_levels": len(self._env_factors),
+                "name": self.name, "create": False}
+
+    def _alloc(self, shape: tuple, dtype) -> np.ndarray:
+        # Both sides allocate in the same order, so segment i has the same name in every process
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = open_shared_memory(f"{self.name}_{len(self._shms)}", nbytes, self.create)
+        self._shms.append(shm)
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    def _init_counters(self):
+        # [seq, claim, write_ptr], zeroed by the creator only
+        self._counters = self._alloc((3,), np.int64)
+
+    def close(self, unlink: bool = False):
+        self.buf = self._counters = None
+        self._env_min = self._env_max = []
+        for shm in self._shms:
+            shm.close()
+            if unlink:
+                shm.unlink()
+
+
+def open_shared_memory(name: str, size: int, create: bool) -> shared_memory.SharedMemory:
+    if create:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        # Attaching processes must not unlink the segment on exit (Python 3.13+)
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
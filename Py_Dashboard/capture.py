@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import wave
+import argparse
+import threading
+import numpy as np
+
+from buffer import StereoRingBuffer, RegBlock
+from network import producer_thread, StreamStats
+
+SAMPLE_RATE = 48000
+CAPTURE_BUFFER_SECONDS = 5.0
+CHUNK_SAMPLES = SAMPLE_RATE // 2  # samples per write, ~380 kB of stereo int32
+WRITE_BUFFER = 1 << 20
+STATUS_SECONDS = 10.0
+
+
+class CaptureWriter(threading.Thread):
+    # Follows the ring buffer by sample position and streams it to rotating WAV / raw files
+    def __init__(self, buf: StereoRingBuffer, out_dir: str, fmt: str = "wav", rotate_mb: float = 0,
+                 rotate_seconds: float = 0, chunk: int = CHUNK_SAMPLES):
+        super().__init__(daemon=True)
+        self.buf = buf
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.channels = buf.buf.shape[1]
+        self.chunk = min(chunk, buf.size // 2)
+
+        # 24 bit packed for WAV, native int32 for raw
+        self.sample_bytes = 3 if fmt == "wav" else 4
+        frame_bytes = self.sample_bytes * self.channels
+        limits = []
+        if rotate_mb > 0:
+            limits.append(int(rotate_mb * (1 << 20)) // frame_bytes)
+        if rotate_seconds > 0:
+            limits.append(int(rotate_seconds * SAMPLE_RATE))
+        self.rotate_samples = max(min(limits), 1) if limits else 0
+
+        # The only sample memory used: one chunk, plus its packed copy
+        self._chunk = np.zeros((self.chunk, self.channels), dtype=np.int32)
+        self._packed = np.zeros((self.chunk, self.channels, 3), dtype=np.uint8)
+
+        self._file = None
+        self._wav = None
+        self._file_samples = 0
+        self.files = []
+        self.written = 0
+        self.overruns = 0
+        self.lost_samples = 0
+        self.pos = 0
+
+        self._shutdown = threading.Event()
+
+    def stop(self):
+        self._shutdown.set()
+
+    def run(self):
+        self.pos = self.buf.seq
+        try:
+            while True:
+                stopping = self._shutdown.is_set()
+                seq = self.buf.seq
+
+                # Fell a whole ring behind: skip ahead and account for the gap
+                if seq - self.pos > self.buf.size - self.chunk:
+                    new_pos = seq - self.chunk
+                    self.overruns += 1
+                    self.lost_samples += new_pos - self.pos
+                    self.pos = new_pos
+
+                n = min(seq - self.pos, self.chunk)
+                if n < self.chunk and not stopping:
+                    time.sleep(self.chunk / SAMPLE_RATE / 4)
+                    continue
+                if n == 0:
+                    break
+
+                if self.buf.read_into(self._chunk[:n], n, end=self.pos + n) != n:
+                    # Overwritten during the copy, retried from the new position
+                    continue
+                self.pos += n
+                self._write(self._chunk[:n])
+        finally:
+            self._close_file()
+
+    def _write(self, data: np.ndarray):
+        # Splits at rotation boundaries so every file holds exactly rotate_samples
+        while len(data):
+            if self._file is None:
+                self._open_file(self.pos - len(data))
+            n = len(data)
+            if self.rotate_samples:
+                n = min(n, self.rotate_samples - self._file_samples)
+
+            if self.fmt == "wav":
+                packed = self._packed[:n]
+                np.copyto(packed, data[:n].view(np.uint8).reshape(n, self.channels, 4)[:, :, :3])
+                self._wav.writeframesraw(packed)
+            else:
+                self._file.write(np.ascontiguousarray(data[:n]))
+
+            self._file_samples += n
+            self.written += n
+            data = data[n:]
+            if self.rotate_samples and self._file_samples >= self.rotate_samples:
+                self._close_file()
+
+    def _open_file(self, start: int):
+        # File names carry the ring position of their first sample, same clock as the register log
+        name = f"capture_{time.strftime('%Y%m%d_%H%M%S')}_{start:012d}.{self.fmt}"
+        path = os.path.join(self.out_dir, name)
+        self._file = open(path, "wb", buffering=WRITE_BUFFER)
+        if self.fmt == "wav":
+            self._wav = wave.open(self._file, "wb")
+            self._wav.setnchannels(self.channels)
+            self._wav.setsampwidth(self.sample_bytes)
+            self._wav.setframerate(SAMPLE_RATE)
+        self._file_samples = 0
+        self.files.append(path)
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        if self._wav is not None:
+            # Patches the header with the final frame count
+            self._wav.close()
+            self._wav = None
+        self._file.close()
+        self._file = None
+
+
+class RegLogger(threading.Thread):
+    # Logs every register change, stamped with the ring buffer position it happened at
+    def __init__(self, buf: StereoRingBuffer, reg_block: RegBlock, path: str):
+        super().__init__(daemon=True)
+        self.buf = buf
+        self.reg_block = reg_block
+        self.path = path
+        self._shutdown = threading.Event()
+
+    def stop(self):
+        self._shutdown.set()
+
+    def run(self):
+        names = sorted(self.reg_block.names, key=self.reg_block.names.get)
+        with open(self.path, "w") as f:
+            f.write("sample,time," + ",".join(names) + "\n")
+            gen = None
+            while not self._shutdown.is_set():
+                if self.reg_block.wait_changed(gen, timeout=0.25) == gen:
+                    continue
+                seq = self.buf.seq
+                gen, regs = self.reg_block.snapshot()
+                f.write(f"{seq},{time.time():.6f}," + ",".join(f"0x{r:08x}" for r in regs) + "\n")
+                f.flush()
+
+
+def parse_reg(text: str) -> tuple[str, int]:
+    name, _, value = text.partition("=")
+    return name, int(value, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless capture of the FPGA audio stream to disk")
+    parser.add_argument("out_dir", help="directory for the capture files")
+    parser.add_argument("--format", choices=("wav", "raw"), default="wav",
+                        help="24 bit WAV, or interleaved little-endian int32 raw")
+    parser.add_argument("--rotate-mb", type=float, default=0, help="start a new file after this many MB")
+    parser.add_argument("--rotate-seconds", type=float, default=0, help="start a new file after this much audio")
+    parser.add_argument("--duration", type=float, default=0, help="stop after this many seconds, 0 runs forever")
+    parser.add_argument("--reg-log", action="store_true", help="log register changes to regs.csv")
+    parser.add_argument("--reg", type=parse_reg, action="append", default=[], metavar="NAME=VALUE",
+                        help="register to set before capturing, may be repeated")
+    parser.add_argument("--backend", choices=("raw", "scapy"), default="raw")
+    parser.add_argument("--debug", action="store_true", help="capture the generated test sine instead")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    buf = StereoRingBuffer(int(CAPTURE_BUFFER_SECONDS * SAMPLE_RATE), spsc=True)
+    reg_block = RegBlock()
+    stats = StreamStats()
+    for name, value in args.reg:
+        reg_block.set(name, value)
+
+    writer = CaptureWriter(buf, args.out_dir, args.format, args.rotate_mb, args.rotate_seconds)
+    logger = RegLogger(buf, reg_block, os.path.join(args.out_dir, "regs.csv")) if args.reg_log else None
+
+    shutdown_evt = threading.Event()
+    eth_th = threading.Thread(target=producer_thread,
+                              args=(buf, reg_block, args.debug, shutdown_evt, args.backend, stats),
+                              daemon=True)
+    eth_th.start()
+    writer.start()
+    if logger is not None:
+        logger.start()
+
+    start = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - start < args.duration:
+            time.sleep(min(STATUS_SECONDS, args.duration or STATUS_SECONDS))
+            s = stats.snapshot()
+            print(f"{writer.written / SAMPLE_RATE:.0f} s written, {len(writer.files)} files, "
+                  f"{s['fps']:.0f} frames/s, lost {s['lost_frames']}, overruns {writer.overruns}", flush=True)
+    except KeyboardInterrupt:
+        pass
+
+    # Stop the ingest first so the writer drains everything that arrived
+    shutdown_evt.set()
+    eth_th.join(timeout=1.0)
+    writer.stop()
+    writer.join()
+    if logger is not None:
+        logger.stop()
+        logger.join()
+    print(f"Captured {writer.written / SAMPLE_RATE:.1f} s into {len(writer.files)} files, "
+          f"{writer.lost_samples} samples lost to overruns")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import sys
+import time
+import threading
+import numpy as np
+
+from buffer import StereoRingBuffer, RegBlock, SharedRingBuffer, SharedRegBlock
+from network import FrameDecoder, RawReceiver, RegSender, StreamStats, SharedStreamStats, producer_thread, \
+    register_sender_loop, scapy_handler, ETH_HEADER_LEN, ETHERTYPE, IFACE, DST_MAC
+
+MAC_WEIGHTS = 256 ** np.arange(5, -1, -1, dtype=np.uint64)  # 6 MAC bytes -> one integer per frame
+
+
+def mac_bytes(mac: str) -> bytes:
+    return bytes.fromhex(mac.replace(":", "").replace("-", ""))
+
+
+class Device:
+    # One board: its own ring, registers and stream stats, found by source MAC on an interface
+    def __init__(self, mac: str, buf: StereoRingBuffer, reg_block: RegBlock, stats: StreamStats = None,
+                 iface: str = IFACE, name: str = None):
+        self.key = mac_bytes(mac)
+        self.mac = ":".join(f"{b:02X}" for b in self.key)
+        self.iface = iface
+        self.name = name or self.mac
+        self.buf = buf
+        self.reg_block = reg_block
+        self.stats = stats if stats is not None else StreamStats()
+
+
+class DeviceRegistry:
+    # Boards keyed by (interface, source MAC), in the order they were added
+    def __init__(self):
+        self.devices = {}
+
+    def add(self, mac: str, buf: StereoRingBuffer, reg_block: RegBlock, stats: StreamStats = None,
+            iface: str = IFACE, name: str = None) -> Device:
+        device = Device(mac, buf, reg_block, stats, iface, name)
+        if (iface, device.key) in self.devices:
+            raise ValueError(f"{device.mac} on {iface} is already registered")
+        self.devices[(iface, device.key)] = device
+        return device
+
+    def get(self, mac: str, iface: str = IFACE) -> Device:
+        return self.devices.get((iface, mac_bytes(mac)))
+
+    def by_iface(self) -> dict:
+        # {iface: {MAC bytes: device}}, the dispatch tables of the ingest loops
+        tables = {}
+        for (iface, key), device in self.devices.items():
+            tables.setdefault(iface, {})[key] = device
+        return tables
+
+    def kernel_drops(self, iface: str) -> int:
+        # Drops of the interface's socket, kept on its first board's stats only
+        for device in self:
+            if device.iface == iface:
+                return int(device.stats.c["kernel_drops"])
+        return 0
+
+    def __iter__(self):
+        return iter(self.devices.values())
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __getitem__(self, index: int) -> Device:
+        return list(self.devices.values())[index]
+
+    def spec(self) -> list:
+        # Shared memory devices only, for attaching from the ingest process
+        return [{"mac": d.mac, "iface": d.iface, "name": d.name, "buf": d.buf.spec(), "reg_block": d.reg_block.spec(),
+                 "stats": d.stats.spec()} for d in self]
+
+    @classmethod
+    def attach(cls, specs: list) -> "DeviceRegistry":
+        registry = cls()
+        for s in specs:
+            registry.add(s["mac"], SharedRingBuffer(**s["buf"]), SharedRegBlock(**s["reg_block"]),
+                         SharedStreamStats(**s["stats"]), s["iface"], s["name"])
+        return registry
+
+    def close(self, unlink: bool = False):
+        for d in self:
+            d.buf.close(unlink)
+            d.reg_block.close(unlink)
+            d.stats.close(unlink)
+
+
+def dispatch_batch(decoder: FrameDecoder, frames: np.ndarray, lengths: np.ndarray, arrivals: np.ndarray, count: int,
+                   devices: dict):
+    # Splits a received batch by source MAC, each part goes through the shared decoder into its
+    # board's ring and stats. Frames from boards not in `devices` are dropped
+    src = frames[:count, 6:12]
+    if (src == src[0]).all():
+        # All from one board: decoded in place, no copy
+        groups = [(src[0].tobytes(), None)]
+    else:
+        keys = src @ MAC_WEIGHTS
+        uniq, first = np.unique(keys, return_index=True)
+        groups = [(src[i].tobytes(), np.flatnonzero(keys == k)) for k, i in zip(uniq, first)]
+
+    for key, rows in groups:
+        device = devices.get(key)
+        if device is None:
+            continue
+        start = time.perf_counter()
+        if rows is None:
+            f, n, l, a = frames, count, lengths, arrivals
+        else:
+            f, n = frames[rows, :int(lengths[rows].max())], len(rows)
+            l, a = lengths[rows], arrivals[rows]
+        samples = decoder.decode(f, l, n, ETH_HEADER_LEN, device.buf)
+        device.stats.record(f, l, n, ETH_HEADER_LEN, a, time.perf_counter() - start, samples)
+
+
+def demux_ingest_thread(receiver: RawReceiver, devices: dict, shutdown_evt: threading.Event):
+    # One socket and one decoder for all the boards of an interface
+    decoder = FrameDecoder(len(receiver.lengths), receiver.frames.shape[1])
+    drops_stats = next(iter(devices.values())).stats
+    last_drops_check = time.monotonic()
+    try:
+        while not shutdown_evt.is_set():
+            count = receiver.recv_batch()
+            if count:
+                dispatch_batch(decoder, receiver.frames, receiver.lengths, receiver.arrivals, count, devices)
+
+            if time.monotonic() - last_drops_check > 0.5:
+                # The socket's drops cannot be told apart by board: counted once, see DeviceRegistry.kernel_drops
+                drops_stats.add_kernel_drops(receiver.kernel_drops())
+                last_drops_check = time.monotonic()
+    finally:
+        receiver.close()
+
+
+def devices_thread(registry: DeviceRegistry, en_debug: bool, shutdown_evt: threading.Event, backend: str = "raw",
+                   replay: dict = None):
+    # Ingest and register senders of every board: one receive loop per interface, one sender per board
+    threads = []
+    sniffers = []
+    if en_debug:
+        for device in registry:
+            threads.append(threading.Thread(target=producer_thread,
+                                            args=(device.buf, device.reg_block, True, shutdown_evt), daemon=True))
+    else:
+        for iface, devices in registry.by_iface().items():
+            macs = [d.mac for d in devices.values()]
+            receiver = None
+            if backend == "replay":
+                from replay import ReplayReceiver
+                receiver = ReplayReceiver(**dict(replay, src_mac=macs))
+            elif backend == "raw":
+                try:
+                    receiver = RawReceiver(iface, macs)
+                except (AttributeError, OSError) as e:
+                    print(f"Raw socket ingest unavailable on {iface} ({e}), falling back to scapy",
+                          file=sys.stderr)
+
+            if receiver is not None:
+                threads.append(threading.Thread(target=demux_ingest_thread, args=(receiver, devices, shutdown_evt),
+                                                daemon=True))
+            else:
+                from scapy.layers.l2 import Ether
+                from scapy.sendrecv import AsyncSniffer
+                targets = {key: (d.buf, d.stats) for key, d in devices.items()}
+                sniffers.append(AsyncSniffer(iface=iface, prn=scapy_handler(targets), store=False,
+                                             lfilter=lambda p: p.haslayer(Ether) and p[Ether].type == ETHERTYPE))
+
+        # No boards to send registers to when replaying
+        if backend != "replay":
+            for device in registry:
+                sender = RegSender(device.iface, device.mac, DST_MAC, backend)
+                threads.append(threading.Thread(target=register_sender_loop,
+                                                args=(sender, device.reg_block, shutdown_evt), daemon=True))
+
+    for th in threads:
+        th.start()
+    for sniffer in sniffers:
+        sniffer.start()
+    shutdown_evt.wait()
+    for sniffer in sniffers:
+        sniffer.stop()
+    for th in threads:
+        th.join(timeout=1.0)
+
+
+def devices_process(specs: list, en_debug: bool, shutdown_evt, backend: str = "raw", replay: dict = None):
+    # Entry point of the separate ingest process: attach to every board's shared buffers and run as usual
+    registry = DeviceRegistry.attach(specs)
+    try:
+        devices_thread(registry, en_debug, shutdown_evt, backend, replay)
+    finally:
+        registry.close()
@@ -0,0 +1,248 @@
+import os
+import re
+import numpy as np
+
+from buffer import RegBlock
+
+# Software model of the audio_i2s.v processing chain, bit-exact on the 24-bit samples the board streams
+SAMPLE_RATE = 48000
+DELAY_DEPTH = 1 << 17  # audio_buffer BRAM depth, ADDR_WIDTH = 17
+PIPELINE_LATENCY = 2  # samples from read_data to the ethernet shift register, with a 1-cycle BRAM read
+NOTCH_R = 0x3000_0000  # notch_filter.v pole radius, Q30
+SIN_ROM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AudioModulator", "Audio_V0.srcs",
+                            "sources_1", "sin_1024_rom.coe")
+
+# Recurrence solver: chunks are solved in lock-step, each warmed up from a zero state before its start
+RECURRENCE_CHUNK = 512
+RECURRENCE_MERGE = 32  # warm-up time constants, enough for a 2**31 state error to decay to zero
+RECURRENCE_MAX_WARMUP = 16 * RECURRENCE_CHUNK
+MODEL_BLOCK = 10 * SAMPLE_RATE  # samples per internal pass, bounds the int64 working set
+
+
+def load_sin_rom(path: str = SIN_ROM_PATH) -> np.ndarray:
+    with open(path) as f:
+        text = f.read()
+    vector = text.split("memory_initialization_vector=", 1)[1]
+    values = np.array([int(v, 16) for v in re.findall(r"[0-9A-Fa-f]+", vector)], dtype=np.int64)
+    return to_signed(values, 32)
+
+
+def to_signed(v, bits: int = 32):
+    # Two's complement wrap to `bits`, for arrays and plain ints
+    half = 1 << (bits - 1)
+    return ((v + half) & ((1 << bits) - 1)) - half
+
+
+def wrap32(v: np.ndarray) -> np.ndarray:
+    return v.astype(np.int32).astype(np.int64)
+
+
+def solve_recurrence(u: np.ndarray, coefs: list, shift: int, state: np.ndarray) -> np.ndarray:
+    # y[n] = wrap32(u[n] + sum_k sign_k * ((c_k * y[n-1-k]) >> shift)), one row of u per channel,
+    # state holds (channels, order) previous outputs, most recent first, and is updated in place.
+    #
+    # The floor after every product makes this nonlinear, so there is no closed form. Instead every
+    # chunk is run in lock-step with all others from a zero state some time constants before its
+    # start. For a stable filter that trajectory has merged with the true one by the chunk start;
+    # chunk starts where it has not (very low cutoffs, quantization dead bands) are re-run
+    # sequentially until they merge, so the result is exact either way
+    channels, n = u.shape
+    order = len(coefs)
+    L = RECURRENCE_CHUNK
+    chunks = -(-n // L)
+    if n == 0:
+        return np.zeros((channels, 0), dtype=np.int64)
+
+    # Warm-up from the slowest pole: |c| for one pole, sqrt(|c2|) for a pole pair
+    rho = (abs(coefs[-1][0]) / 2 ** shift) ** (1 / order)
+    warmup = L if rho >= 1 else int(min(max(RECURRENCE_MERGE / (1 - rho), L), RECURRENCE_MAX_WARMUP))
+
+    # Row (channel, chunk) covers [chunk * L - warmup, chunk * L + L), time-major for contiguous steps
+    padded = np.zeros((channels, warmup + chunks * L), dtype=np.int64)
+    padded[:, warmup:warmup + n] = u
+    windows = np.lib.stride_tricks.sliding_window_view(padded, warmup + L, axis=1)[:, ::L][:, :chunks]
+    steps = np.ascontiguousarray(windows.reshape(channels * chunks, warmup + L).T)
+
+    rows = channels * chunks
+    first = np.arange(channels) * chunks
+    hist = np.zeros((order, rows), dtype=np.int64)
+    spec_start = np.zeros((rows, order), dtype=np.int64)
+    out = np.empty((L, rows), dtype=np.int64)
+    acc = np.empty(rows, dtype=np.int64)
+    term = np.empty(rows, dtype=np.int64)
+    for t in range(warmup + L):
+        if t == warmup:
+            # The first chunk of every channel starts from the real state, not a warm-up
+            hist[:, first] = state.T
+            spec_start[:] = hist.T
+        acc[:] = steps[t]
+        for k, (c, sign) in enumerate(coefs):
+            np.multiply(hist[k], c, out=term)
+            np.right_shift(term, shift, out=term)
+            if sign > 0:
+                acc += term
+            else:
+                acc -= term
+        if order > 1:
+            hist[1:] = hist[:-1]
+        hist[0] = wrap32(acc)
+        if t >= warmup:
+            out[t - warmup] = hist[0]
+
+    y = out.T.reshape(channels, chunks * L)
+    spec_start = spec_start.reshape(channels, chunks, order)
+
+    for ch in range(channels):
+        _fix_chunk_starts(y[ch], u[ch], spec_start[ch], coefs, shift, n)
+
+    # New state: the last `order` outputs, most recent first, falling back on the old state
+    full = np.concatenate((state[:, ::-1], y[:, :n]), axis=1)
+    state[:] = full[:, :-order - 1:-1]
+    return y[:, :n]
+
+
+def _fix_chunk_starts(y: np.ndarray, u: np.ndarray, spec_start: np.ndarray, coefs: list, shift: int, n: int):
+    L = RECURRENCE_CHUNK
+    order = len(coefs)
+    chunks = len(spec_start)
+
+    # Chunk c is exact when the last outputs of chunk c - 1 equal the state its warm-up reached
+    tails = np.stack([y[L - 1 - k:chunks * L - 1 - k:L] for k in range(order)], axis=1)
+    bad = np.flatnonzero((tails != spec_start[1:]).any(axis=1)) + 1
+
+    c_next = 0
+    for c in bad.tolist():
+        if c < c_next:
+            continue
+        while c < chunks:
+            start = c * L
+            true_state = [int(y[start - 1 - k]) for k in range(order)]
+            if true_state == spec_start[c].tolist():
+                break
+            merged = _rerun(y, u, start, min(start + L, n), true_state, coefs, shift)
+            c += 1
+            if merged:
+                break
+        c_next = c
+
+
+def _rerun(y: np.ndarray, u: np.ndarray, start: int, stop: int, hist: list, coefs: list, shift: int) -> bool:
+    # Plain integer recurrence from the true state until it meets the speculative trajectory again
+    order = len(coefs)
+    u_list = u[start:stop].tolist()
+    old = y[start:stop].tolist()
+    new = []
+    same = 0
+    for i, acc in enumerate(u_list):
+        for k, (c, sign) in enumerate(coefs):
+            acc += sign * ((c * hist[k]) >> shift)
+        v = ((acc + 0x8000_0000) & 0xFFFF_FFFF) - 0x8000_0000
+        hist = [v] + hist[:order - 1]
+        new.append(v)
+        same = same + 1 if v == old[i] else 0
+        if same == order:
+            y[start:start + len(new)] = new
+            return True
+    y[start:stop] = new
+    return False
+
+
+class FpgaModel:
+    # Whole-array model of audio_i2s.v: every filter runs all the time like in hardware, the mixer
+    # picks one, then volume and the delay FIFO. State is kept between process() calls, so a long
+    # signal can be fed in chunks and register changes take effect at chunk boundaries
+    def __init__(self, regs: list = None, sin_rom: np.ndarray = None):
+        self.regs = list(regs) if regs is not None else RegBlock().dump()
+        self.sin_rom = sin_rom if sin_rom is not None else load_sin_rom()
+        self.reset()
+
+    def reset(self):
+        # Filter output histories (channels, order) and input histories, as after the FPGA reset
+        self.lpf1 = np.zeros((2, 1), dtype=np.int64)
+        self.lpf2 = np.zeros((2, 1), dtype=np.int64)
+        self.hpf1 = np.zeros((2, 1), dtype=np.int64)
+        self.hpf2 = np.zeros((2, 1), dtype=np.int64)
+        self.bpf_lp = np.zeros((2, 1), dtype=np.int64)
+        self.bpf_hp = np.zeros((2, 1), dtype=np.int64)
+        self.notch = np.zeros((2, 2), dtype=np.int64)
+        self.x_prev = np.zeros((2, 2), dtype=np.int64)  # notch input, last two samples, most recent first
+        self.hpf1_in = np.zeros(2, dtype=np.int64)  # last input of each high-pass stage
+        self.hpf2_in = np.zeros(2, dtype=np.int64)
+        self.bpf_hp_in = np.zeros(2, dtype=np.int64)
+        self.tremolo_phase = 0
+        self.fifo = np.zeros((2, DELAY_DEPTH + PIPELINE_LATENCY), dtype=np.int64)
+
+    def set_regs(self, regs: list):
+        self.regs = list(regs)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        # (n, 2) 24-bit input samples -> (n, 2) 24-bit samples as the board would stream them
+        out = np.empty(samples.shape, dtype=np.int32)
+        for i in range(0, len(samples), MODEL_BLOCK):
+            out[i:i + MODEL_BLOCK] = self._process_block(samples[i:i + MODEL_BLOCK])
+        return out
+
+    def _process_block(self, samples: np.ndarray) -> np.ndarray:
+        r = [to_signed(v) for v in self.regs]
+        x24 = samples.T.astype(np.int64)
+        x = x24 << 8  # {read_data, 8'b0}
+
+        lpf = self._lpf(self._lpf(x, r[3], self.lpf1), r[3], self.lpf2)
+        hpf = self._hpf(self._hpf(x, r[4], self.hpf1, self.hpf1_in), r[4], self.hpf2, self.hpf2_in)
+        bpf = self._hpf(self._lpf(x, r[5], self.bpf_lp), r[6], self.bpf_hp, self.bpf_hp_in)
+        bsf = self._notch(x, r[7])
+        tremolo = self._tremolo(x, self.regs[9])
+        self.x_prev[:] = np.concatenate((self.x_prev[:, ::-1], x), axis=1)[:, :-3:-1]
+
+        # Mixer, on bits [31:8] of the 32-bit filter outputs
+        paths = {0: x24, 1: lpf >> 8, 2: hpf >> 8, 3: bpf >> 8, 4: bsf >> 8, 5: self._distortion(x24, r[8]),
+                 6: tremolo >> 8}
+        mixed = paths.get(self.regs[0], x24)
+
+        # Volume: {mixer, 8'b0} * volume >>> 30, truncated to 32 bits, bits [31:8] into the FIFO
+        volume = np.array([[r[1]], [r[2]]], dtype=np.int64)
+        attenuated = wrap32(((mixed << 8) * volume) >> 30) >> 8
+
+        return self._delay(attenuated, [self.regs[10], self.regs[11]]).T.astype(np.int32)
+
+    def _lpf(self, x: np.ndarray, a: int, state: np.ndarray) -> np.ndarray:
+        # y = a * x >>> 31 + (0x7FFFFFFF - a) * y_prev >>> 31
+        return solve_recurrence((a * x) >> 31, [(0x7FFF_FFFF - a, 1)], 31, state)
+
+    def _hpf(self, x: np.ndarray, a: int, state: np.ndarray, x_last: np.ndarray) -> np.ndarray:
+        # y = ((0x7FFFFFFF + a) >>> 1) * (x - x_prev) >>> 31 + a * y_prev >>> 31
+        diff = np.diff(x, axis=1, prepend=x_last[:, None])
+        x_last[:] = x[:, -1]
+        return solve_recurrence((((0x7FFF_FFFF + a) >> 1) * diff) >> 31, [(a, 1)], 31, state)
+
+    def _notch(self, x: np.ndarray, a: int) -> np.ndarray:
+        # y = x + x2 - a * x1 >>> 30 + (a * R >>> 30) * y1 >>> 30 - (R * R >>> 30) * y2 >>> 30
+        hist = np.concatenate((self.x_prev[:, ::-1], x), axis=1)
+        u = hist[:, 2:] + hist[:, :-2] - ((a * hist[:, 1:-1]) >> 30)
+        coefs = [((a * NOTCH_R) >> 30, 1), ((NOTCH_R * NOTCH_R) >> 30, -1)]
+        return solve_recurrence(u, coefs, 30, self.notch)
+
+    def _tremolo(self, x: np.ndarray, a: int) -> np.ndarray:
+        # Phase accumulator advanced by a every sample, ROM address = phase[25:16]
+        n = x.shape[1]
+        phase = (self.tremolo_phase + a * np.arange(1, n + 1, dtype=np.int64)) & 0xFFFF_FFFF
+        if n:
+            self.tremolo_phase = int(phase[-1])
+        return wrap32((x * self.sin_rom[(phase >> 16) & 0x3FF]) >> 31)
+
+    def _distortion(self, x24: np.ndarray, reg: int) -> np.ndarray:
+        # Hard clip at +/- the low 24 bits of the register, compared as 24-bit signed values
+        threshold = to_signed(reg & 0xFF_FFFF, 24)
+        negative = to_signed(-threshold, 24)
+        return np.where(x24 > threshold, threshold, np.where(x24 < negative, negative, x24))
+
+    def _delay(self, samples: np.ndarray, delays: list) -> np.ndarray:
+        # Read pointer = write pointer - delay on 17 bits, plus the fixed pipeline latency
+        n = samples.shape[1]
+        history = np.concatenate((self.fifo, samples), axis=1)
+        out = np.empty_like(samples)
+        for ch in range(2):
+            start = self.fifo.shape[1] - (delays[ch] % DELAY_DEPTH) - PIPELINE_LATENCY
+            out[ch] = history[ch, start:start + n]
+        self.fifo[:] = history[:, -self.fifo.shape[1]:]
+        return out
@@ -2,37 +2,60 @@ import math
 
 import numpy as np
 import pyqtgraph as pg
-from PyQt6 import QtWidgets, QtCore
+from PyQt6 import QtWidgets, QtCore, QtGui
 
-from buffer import RingBuffer, RegBlock
+from buffer import StereoRingBuffer, RegBlock, reg_value
+from spectrum import StftEngine, WelchEstimator, Waterfall
+from pipeline import PlotWorker, LOG_F_MIN
+from network import StreamStats
+from trigger import EdgeTrigger
+from measure import MeasurementEngine
+from devices import DeviceRegistry
 
 PLOT_FPS = 30
 BUFFER_SECONDS = 5.0
 FFT_POINTS = 4096 * 4
 FFT_WINDOW = "hann"  # hann, hamming, blackman
+FFT_OVERLAP = 0.75
+STATS_EVERY = 15  # plot ticks between stream stats refreshes
+WATERFALL_COLUMNS = 256  # STFT frames kept on screen, ~22 s at 16k points and 75 % overlap
+WATERFALL_BANDS = 256  # log-spaced frequency rows
+WATERFALL_COLORMAP = "viridis"
+FREQ_SCALES = {"Linear": ("linear", 0), "Log": ("log", 0), "1/3 octave": ("octave", 3),
+               "1/6 octave": ("octave", 6), "1/12 octave": ("octave", 12)}
+OVERVIEW_COLUMNS = 2  # boards per row of the overview grid
+OVERVIEW_SECONDS = 0.5
+OVERVIEW_POINTS = 200  # min/max pairs per overview trace
+OVERVIEW_EVERY = 6  # plot ticks between overview refreshes
 
 
 class Oscilloscope(QtWidgets.QMainWindow):
-    def __init__(self, buf_left: RingBuffer, buf_right: RingBuffer, reg_block: RegBlock):
+    def __init__(self, buf: StereoRingBuffer, reg_block: RegBlock, stats: StreamStats = None,
+                 devices: DeviceRegistry = None):
         super().__init__()
-        self.buf_left = buf_left
-        self.buf_right = buf_right
+        self.buf = buf
         self.reg_block = reg_block
+        self.stats = stats
+        self.stats_tick = 0
+        self.connected = False
+
+        # Several boards: one of them is shown and controlled, the others only in the overview grid
+        self.devices = devices if devices is not None and len(devices) > 1 else None
+        self.device_index = 0
+        self.device_controls = {}  # board index -> control values, saved when switching away
+
+        self.init_analysis()
 
         self.setWindowTitle("Audio Modulator Control Panel")
         self.resize(1280, 720)
         # self.showMaximized()
 
         self.time_step = 0
+        self.history_end = None  # absolute sample position of the window end, None follows live
+        self.freq_scale, self.octave_fraction = FREQ_SCALES["Linear"]
         self.amplitude_offset = 0
         self.amplitude = 0
 
-        # FFT average helpers
-        self._avg_buf_left = None
-        self._avg_buf_right = None
-        self._avg_idx = 0
-        self._avg_count = 0
-
         # Central widget
         cw = QtWidgets.QWidget()
         self.setCentralWidget(cw)
@@ -53,6 +76,8 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.fft_radio1 = QtWidgets.QRadioButton("Avg")
         self.fft_radio2 = QtWidgets.QRadioButton("MaxHold")
         self.fft_spinbox = QtWidgets.QSpinBox()
+        self.waterfall_checkbox = QtWidgets.QCheckBox("Waterfall")
+        self.freq_scale_combo = QtWidgets.QComboBox()
 
         self.volume_left_slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)
         self.volume_right_slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)
@@ -83,6 +108,15 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.distortion_label = QtWidgets.QLabel("")
         self.tremolo_label = QtWidgets.QLabel("")
 
+        self.stats_label = QtWidgets.QLabel("No stream statistics")
+
+        self.measure_checkbox = QtWidgets.QCheckBox("Measure")
+        self.measure_rate_spinbox = QtWidgets.QDoubleSpinBox()
+        self.measure_label = QtWidgets.QLabel("")
+
+        self.device_combo = QtWidgets.QComboBox()
+        self.overview_checkbox = QtWidgets.QCheckBox("Overview")
+
         controls_layout = self.init_controls()
 
         main_layout.addLayout(plots_layout, stretch=3)
@@ -100,11 +134,36 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.curve_fft_left = self.fft_item_left.plot(self.x, self.y, pen=pg.mkPen(width=1))
         self.curve_fft_right = self.fft_item_right.plot(self.x, self.y, pen=pg.mkPen(width=1))
 
+        self.start_worker()
+
+        # Shown until the first samples arrive from the ingest side
+        self.statusBar().showMessage("Connecting to the FPGA...")
+
         # Timer for updates
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_plot)
         self.timer.start(int(1000 / PLOT_FPS))
 
+    def init_analysis(self):
+        # Spectra are computed once per hop of new samples, not once per frame
+        self.stft = StftEngine(self.buf, FFT_POINTS, overlap=FFT_OVERLAP, window=FFT_WINDOW)
+        self.trigger = EdgeTrigger(self.buf)
+        self.measure = MeasurementEngine(self.buf, self.stft)
+        self.measure_shown = None
+        self.waterfall = Waterfall(self.stft, WATERFALL_COLUMNS, WATERFALL_BANDS,
+                                   scale=1.0 / (2 ** 23 * FFT_POINTS) ** 2)
+
+    def start_worker(self):
+        # Welch average / max hold over the last K STFT segments
+        self.welch = WelchEstimator(self.stft, self.fft_spinbox.value(), scale=1.0 / (2 ** 23 * FFT_POINTS) ** 2)
+
+        # Decimation, FFT and averaging run on a worker thread, the timer only swaps in its frames
+        self.worker = PlotWorker(self.buf, self.stft, self.welch, PLOT_FPS, self.trigger, self.measure,
+                                 self.waterfall)
+        self.push_plot_settings()
+        self.on_trigger_changed()
+        self.worker.start()
+
     def update_plot(self):
         # Y axis
         self.plot_item_left.setYRange(-100 * self.amplitude + self.amplitude_offset,
@@ -112,36 +171,107 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.plot_item_right.setYRange(-100 * self.amplitude + self.amplitude_offset,
                                        100 * self.amplitude + self.amplitude_offset)
 
-        # X axis
-        window_samples = int(self.time_step * 48000)
-        t_axis = np.linspace(-self.time_step, 0.0, window_samples, dtype=np.float32)
+        self.push_plot_settings()
 
-        max_val = 2 ** 23  # max absolute value
+        if not self.connected and self.buf.seq > 0:
+            self.connected = True
+            self.statusBar().showMessage("Connected", 3000)
 
-        latest_left = (self.buf_left.read(window_samples) / max_val) * 100
-        latest_right = (self.buf_right.read(window_samples) / max_val) * 100
+        self.stats_tick += 1
+        if self.stats is not None and self.stats_tick % STATS_EVERY == 0:
+            self.update_stats()
 
-        self.curve_left.setData(t_axis, latest_left)
-        self.curve_right.setData(t_axis, latest_right)
+        if self.devices is not None and self.stats_tick % OVERVIEW_EVERY == 0 and self.overview_group.isVisible():
+            self.update_overview()
 
-        # FFT
-        f_axis = self.buf_left.get_freq_axis(FFT_POINTS)
+        result = self.measure.snapshot()
+        if self.measure_checkbox.isChecked() and result is not self.measure_shown:
+            self.measure_shown = result
+            self.update_measurements(result)
+
+        # Latest ready frame from the worker, None if nothing new or too old
+        frame = self.worker.take()
+        if frame is None:
+            return
 
-        # Compute FFTs (complex) of most recent samples
-        Xl = self.buf_left.get_fft(FFT_POINTS, window=FFT_WINDOW)
-        Xr = self.buf_right.get_fft(FFT_POINTS, window=FFT_WINDOW)
+        if self.trigger.mode != "off":
+            state = "Trig'd" if frame.triggered else "Auto" if self.trigger.mode == "auto" else "Ready"
+            self.trigger_label.setText(state)
 
-        # Convert to magnitude dBFS
-        Pl = (np.abs(Xl) / (2 ** 23 * FFT_POINTS)) ** 2 + 1e-30
-        Pr = (np.abs(Xr) / (2 ** 23 * FFT_POINTS)) ** 2 + 1e-30
+        # Colormapped by the worker, uploaded only when it has new columns
+        if frame.waterfall is not None:
+            self.waterfall_left.setImage(frame.waterfall[0], autoLevels=False)
+            self.waterfall_right.setImage(frame.waterfall[1], autoLevels=False)
 
-        # Average hold over the last K frames
-        self._avg_hold_push(Pl, Pr)
-        Pl_avg, Pr_avg = self._avg_hold_get()
+        self.curve_left.setData(frame.t_axis, frame.trace[:, 0])
+        self.curve_right.setData(frame.t_axis, frame.trace[:, 1])
 
         # Update FFT plots
-        self.curve_fft_left.setData(f_axis, 10.0 * np.log10(Pl_avg))
-        self.curve_fft_right.setData(f_axis, 10.0 * np.log10(Pr_avg))
+        if frame.spectrum_db is not None:
+            self.curve_fft_left.setData(frame.f_axis, frame.spectrum_db[:, 0])
+            self.curve_fft_right.setData(frame.f_axis, frame.spectrum_db[:, 1])
+
+    def update_stats(self):
+        s = self.stats.snapshot()
+        drops = f"Kernel drops: {s['kernel_drops']}"
+        if self.devices is not None:
+            # Per socket, not per board: shared by every board on the interface
+            iface = self.devices[self.device_index].iface
+            drops = f"Kernel drops ({iface}): {self.devices.kernel_drops(iface)}"
+        self.stats_label.setText(
+            f"{s['fps']:.0f} frames/s, {s['sample_rate'] / 1000:.2f} kS/s ({s['rate_ratio'] * 100:.1f} %)\n"
+            f"Lost: {s['lost_frames']}  {drops}  Bad headers: {s['bad_headers']}\n"
+            f"Jitter p99: {s['jitter_p99_ms']:.2f} ms  Decode: {s['decode_mean'] * 1e6:.0f} us "
+            f"(max {s['decode_max'] * 1e6:.0f} us)\n"
+            f"Batch: {s['queue_depth']} (max {s['queue_depth_max']})  "
+            f"Latency: {s['latency'] * 1000:.2f} ms (max {s['latency_max'] * 1000:.2f} ms)")
+
+    def update_overview(self):
+        # Short min/max envelope of every board straight from its ring, no spectra
+        n = int(OVERVIEW_SECONDS * 48000)
+        scale = 100 / 2 ** 23
+        for device, (item, curves) in zip(self.devices, self.overview_cells):
+            s = device.stats.snapshot()
+            item.setTitle(f"{device.name}: {s['sample_rate'] / 1000:.2f} kS/s, lost {s['lost_frames']}")
+            if device.buf.seq < n:
+                continue
+
+            env = device.buf.read_envelope(n, OVERVIEW_POINTS)
+            if env is None:
+                trace = device.buf.read(n)[::max(n // OVERVIEW_POINTS, 1)] * scale
+            else:
+                env_min, env_max, _ = env
+                trace = np.empty((2 * len(env_min),) + env_min.shape[1:], dtype=np.float32)
+                np.multiply(env_min, scale, out=trace[0::2], casting="unsafe")
+                np.multiply(env_max, scale, out=trace[1::2], casting="unsafe")
+            t = np.linspace(-OVERVIEW_SECONDS, 0.0, len(trace), dtype=np.float32)
+            for ch, curve in enumerate(curves):
+                curve.setData(t, trace[:, ch])
+
+    def update_measurements(self, result: dict):
+        lines = [f"{'':8}{'Left':>10}{'Right':>10}"]
+        for key, name, fmt in (("freq", "Freq Hz", ".1f"), ("rms_dbfs", "RMS dBFS", ".2f"),
+                               ("peak_dbfs", "Peak dBFS", ".2f"), ("crest_db", "Crest dB", ".2f"),
+                               ("thd_pct", "THD %", ".4f"), ("thdn_db", "THD+N dB", ".2f"),
+                               ("snr_db", "SNR dB", ".2f"), ("sinad_db", "SINAD dB", ".2f")):
+            lines.append(f"{name:<10}" + "".join(f"{result[ch][key]:>10{fmt}}" for ch in ("left", "right")))
+        self.measure_label.setText("\n".join(lines))
+
+    def push_plot_settings(self):
+        self.worker.configure(time_step=self.time_step,
+                              width=self.plot_widget_left.width(),
+                              max_hold=self.fft_radio2.isChecked(),
+                              average=self.fft_spinbox.value(),
+                              end=self.history_end,
+                              freq_scale=self.freq_scale,
+                              octave_fraction=self.octave_fraction,
+                              pre_trigger=self.trigger_pre_spinbox.value() / 100,
+                              measure=self.measure_checkbox.isChecked(),
+                              waterfall=self.waterfall_checkbox.isChecked())
+
+    def closeEvent(self, event):
+        self.worker.stop()
+        super().closeEvent(event)
 
     def init_plots(self):
         # Left channel plot
@@ -206,9 +336,64 @@ class Oscilloscope(QtWidgets.QMainWindow):
         fft_group.setLayout(fft_layout)
         fft_group.setMinimumWidth(800)
 
+        # Left/right waterfalls: time on x, log frequency on y
+        lut = pg.colormap.get(WATERFALL_COLORMAP).getLookupTable(nPts=256)
+        edges = self.waterfall.binner.edges
+        rect = QtCore.QRectF(-self.waterfall.seconds, math.log10(edges[0]), self.waterfall.seconds,
+                             math.log10(edges[-1] / edges[0]))
+        waterfall_layout = QtWidgets.QHBoxLayout()
+        for side in ("left", "right"):
+            widget = pg.PlotWidget()
+            item = widget.getPlotItem()
+            item.setLabel('bottom', 'Time', units='s')
+            item.getAxis('left').setLogMode(True)
+            if side == "left":
+                item.setLabel('left', 'Frequency', units='Hz')
+            else:
+                item.getAxis('left').setStyle(showValues=False)
+            item.getViewBox().setMouseEnabled(x=False, y=False)
+
+            image = pg.ImageItem(axisOrder="col-major")
+            image.setLookupTable(lut)
+            image.setLevels((0, 255))
+            image.setImage(self.waterfall.view()[0], autoLevels=False)
+            image.setRect(rect)
+            item.addItem(image)
+            item.setRange(rect, padding=0)
+            setattr(self, f"waterfall_{side}", image)
+            waterfall_layout.addWidget(widget)
+
+        self.waterfall_group = QtWidgets.QGroupBox("Left/Right waterfalls")
+        self.waterfall_group.setLayout(waterfall_layout)
+        self.waterfall_group.setMinimumWidth(800)
+        self.waterfall_group.setVisible(False)
+
         graphs_layout = QtWidgets.QVBoxLayout()
         graphs_layout.addWidget(plots_group)
         graphs_layout.addWidget(fft_group)
+        graphs_layout.addWidget(self.waterfall_group)
+
+        # Every board's left/right traces in a grid, a click selects the board
+        if self.devices is not None:
+            overview_layout = QtWidgets.QGridLayout()
+            self.overview_cells = []
+            for i, device in enumerate(self.devices):
+                widget = pg.PlotWidget()
+                item = widget.getPlotItem()
+                item.setTitle(device.name)
+                item.setYRange(-100, 100)
+                item.getAxis('left').setStyle(showValues=False)
+                item.getViewBox().setMouseEnabled(x=False, y=False)
+                curves = [item.plot(pen=pg.mkPen(color, width=1)) for color in ("y", "c")]
+                widget.scene().sigMouseClicked.connect(lambda _, i=i: self.device_combo.setCurrentIndex(i))
+                self.overview_cells.append((item, curves))
+                overview_layout.addWidget(widget, i // OVERVIEW_COLUMNS, i % OVERVIEW_COLUMNS)
+
+            self.overview_group = QtWidgets.QGroupBox("Boards (left yellow, right cyan)")
+            self.overview_group.setLayout(overview_layout)
+            self.overview_group.setMinimumWidth(800)
+            self.overview_group.setVisible(False)
+            graphs_layout.addWidget(self.overview_group)
 
         return graphs_layout
 
@@ -219,7 +404,7 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.time_step_slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)  # or Horizontal
         self.time_step_slider.setMinimum(0)
         self.time_step_slider.setMaximum(1000)
-        self.time_step_slider.setValue(1000)
+        self.time_step_slider.setValue(self.time_step_position(BUFFER_SECONDS))
         self.time_step_slider.setTickPosition(QtWidgets.QSlider.TickPosition.TicksBelow)
         self.time_step_slider.setTickInterval(
             int((self.time_step_slider.maximum() - self.time_step_slider.minimum()) / 10))
@@ -228,7 +413,7 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.time_step_label = QtWidgets.QLabel("")
         self.time_step_label.setFixedWidth(55)
         self.time_step_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
-        self.on_timescale_changed(1000)
+        self.on_timescale_changed(self.time_step_slider.value())
 
         time_group = QtWidgets.QGroupBox("Time step")
         time_step = QtWidgets.QHBoxLayout()
@@ -237,6 +422,80 @@ class Oscilloscope(QtWidgets.QMainWindow):
         time_group.setLayout(time_step)
         time_group.setFixedHeight(70)
 
+        # Scrollback through the buffer history
+        self.history_slider = QtWidgets.QSlider(QtCore.Qt.Orientation.Horizontal)
+        self.history_slider.setMinimum(0)
+        self.history_slider.setMaximum(1000)
+        self.history_slider.setValue(1000)
+        self.history_slider.valueChanged.connect(self.on_history_changed)
+
+        self.history_label = QtWidgets.QLabel("Live")
+        self.history_label.setFixedWidth(55)
+        self.history_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
+
+        history_live = QtWidgets.QPushButton("Live")
+        history_live.clicked.connect(lambda: self.history_slider.setValue(self.history_slider.maximum()))
+
+        history_group = QtWidgets.QGroupBox("History")
+        history_layout = QtWidgets.QHBoxLayout()
+        history_layout.addWidget(self.history_label)
+        history_layout.addWidget(self.history_slider)
+        history_layout.addWidget(history_live)
+        history_group.setLayout(history_layout)
+        history_group.setFixedHeight(70)
+
+        # Edge trigger for the time plots
+        self.trigger_mode_combo = QtWidgets.QComboBox()
+        self.trigger_mode_combo.addItems(["Off", "Auto", "Normal", "Single"])
+        self.trigger_edge_combo = QtWidgets.QComboBox()
+        self.trigger_edge_combo.addItems(["Rising", "Falling"])
+        self.trigger_channel_combo = QtWidgets.QComboBox()
+        self.trigger_channel_combo.addItems(["Left", "Right"])
+
+        self.trigger_level_spinbox = QtWidgets.QDoubleSpinBox()
+        self.trigger_level_spinbox.setRange(-100, 100)
+        self.trigger_level_spinbox.setSuffix(" %")
+        self.trigger_hysteresis_spinbox = QtWidgets.QDoubleSpinBox()
+        self.trigger_hysteresis_spinbox.setRange(0, 50)
+        self.trigger_hysteresis_spinbox.setSingleStep(0.5)
+        self.trigger_hysteresis_spinbox.setValue(1)
+        self.trigger_hysteresis_spinbox.setSuffix(" %")
+        self.trigger_pre_spinbox = QtWidgets.QSpinBox()
+        self.trigger_pre_spinbox.setRange(0, 100)
+        self.trigger_pre_spinbox.setValue(50)
+        self.trigger_pre_spinbox.setSuffix(" %")
+
+        self.trigger_label = QtWidgets.QLabel("")
+        self.trigger_label.setFixedWidth(40)
+        trigger_arm = QtWidgets.QPushButton("Arm")
+        trigger_arm.clicked.connect(lambda: self.on_trigger_changed(arm=True))
+
+        for combo in (self.trigger_mode_combo, self.trigger_edge_combo, self.trigger_channel_combo):
+            combo.currentIndexChanged.connect(self.on_trigger_changed)
+        for spinbox in (self.trigger_level_spinbox, self.trigger_hysteresis_spinbox):
+            spinbox.valueChanged.connect(self.on_trigger_changed)
+
+        trigger_top = QtWidgets.QHBoxLayout()
+        trigger_top.addWidget(self.trigger_mode_combo)
+        trigger_top.addWidget(self.trigger_edge_combo)
+        trigger_top.addWidget(self.trigger_channel_combo)
+        trigger_top.addWidget(self.trigger_label)
+        trigger_top.addWidget(trigger_arm)
+        trigger_bottom = QtWidgets.QHBoxLayout()
+        trigger_bottom.addWidget(QtWidgets.QLabel("Level:"))
+        trigger_bottom.addWidget(self.trigger_level_spinbox)
+        trigger_bottom.addWidget(QtWidgets.QLabel("Hyst:"))
+        trigger_bottom.addWidget(self.trigger_hysteresis_spinbox)
+        trigger_bottom.addWidget(QtWidgets.QLabel("Pre:"))
+        trigger_bottom.addWidget(self.trigger_pre_spinbox)
+
+        trigger_group = QtWidgets.QGroupBox("Trigger")
+        trigger_layout = QtWidgets.QVBoxLayout()
+        trigger_layout.addLayout(trigger_top)
+        trigger_layout.addLayout(trigger_bottom)
+        trigger_group.setLayout(trigger_layout)
+        trigger_group.setFixedHeight(100)
+
         # Slider for amplitude
         self.amplitude_step_slider.setMinimum(10)
         self.amplitude_step_slider.setMaximum(100)
@@ -297,7 +556,14 @@ class Oscilloscope(QtWidgets.QMainWindow):
         fft_layout.addWidget(self.fft_radio2)
         fft_layout.addWidget(QtWidgets.QLabel("Nr. of samples:"))
         fft_layout.addWidget(self.fft_spinbox)
+        fft_layout.addWidget(self.freq_scale_combo)
+        fft_layout.addWidget(self.waterfall_checkbox)
         fft_group.setLayout(fft_layout)
+
+        self.freq_scale_combo.addItems(FREQ_SCALES)
+        self.freq_scale_combo.currentTextChanged.connect(self.on_freq_scale_changed)
+
+        self.waterfall_checkbox.toggled.connect(self.waterfall_group.setVisible)
         fft_group.setFixedHeight(70)
 
         # FPGA controls
@@ -508,15 +774,66 @@ class Oscilloscope(QtWidgets.QMainWindow):
         fpga_control_layout.addWidget(mixer_group)
         fpga_control_group.setLayout(fpga_control_layout)
 
+        # Board selector, only with several boards
+        if self.devices is not None:
+            self.device_combo.addItems([d.name for d in self.devices])
+            self.device_combo.currentIndexChanged.connect(self.on_device_selected)
+            self.overview_checkbox.toggled.connect(self.overview_group.setVisible)
+
+            device_group = QtWidgets.QGroupBox("Board")
+            device_layout = QtWidgets.QHBoxLayout()
+            device_layout.addWidget(self.device_combo, stretch=1)
+            device_layout.addWidget(self.overview_checkbox)
+            device_group.setLayout(device_layout)
+            device_group.setFixedHeight(70)
+            controls_layout.addWidget(device_group)
+
         controls_layout.addWidget(time_group)
+        controls_layout.addWidget(history_group)
+        controls_layout.addWidget(trigger_group)
         controls_layout.addWidget(amplitude_group)
         controls_layout.addWidget(fft_group)
         controls_layout.addWidget(fpga_control_group)
+
+        # Tone measurements, off unless enabled
+        self.measure_rate_spinbox.setRange(0.5, 30)
+        self.measure_rate_spinbox.setValue(self.measure.rate)
+        self.measure_rate_spinbox.setSuffix(" Hz")
+        self.measure_rate_spinbox.valueChanged.connect(self.on_measure_rate_changed)
+        self.measure_label.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.SystemFont.FixedFont))
+        self.measure_label.setVisible(False)
+        self.measure_checkbox.toggled.connect(self.measure_label.setVisible)
+
+        measure_top = QtWidgets.QHBoxLayout()
+        measure_top.addWidget(self.measure_checkbox)
+        measure_top.addWidget(QtWidgets.QLabel("Rate:"))
+        measure_top.addWidget(self.measure_rate_spinbox)
+
+        measure_group = QtWidgets.QGroupBox("Measurements")
+        measure_layout = QtWidgets.QVBoxLayout()
+        measure_layout.addLayout(measure_top)
+        measure_layout.addWidget(self.measure_label)
+        measure_group.setLayout(measure_layout)
+        controls_layout.addWidget(measure_group)
+
+        # Stream statistics
+        if self.stats is not None:
+            stats_group = QtWidgets.QGroupBox("Stream")
+            stats_layout = QtWidgets.QVBoxLayout()
+            stats_layout.addWidget(self.stats_label)
+            stats_group.setLayout(stats_layout)
+            controls_layout.addWidget(stats_group)
         return controls_layout
 
+    def time_step_position(self, seconds: float) -> int:
+        # Inverse of the logarithmic time step slider mapping
+        min_time, max_time = 0.0001, self.buf.size / 48000
+        fraction = math.log(seconds / min_time) / math.log(max_time / min_time)
+        return int(round(min(max(fraction, 0.0), 1.0) * self.time_step_slider.maximum()))
+
     def on_timescale_changed(self, value):
         min_time = 0.0001  # seconds
-        max_time = BUFFER_SECONDS  # seconds
+        max_time = self.buf.size / 48000  # seconds, the whole history
 
         # linear slider -> logarithmic time_step
         fraction = value / self.time_step_slider.maximum()  # 0 … 1
@@ -530,6 +847,105 @@ class Oscilloscope(QtWidgets.QMainWindow):
         else:
             self.time_step_label.setText(f"{log_value:.2f} s")
 
+    def on_history_changed(self, value):
+        if value == self.history_slider.maximum():
+            self.history_end = None
+            self.history_label.setText("Live")
+            return
+
+        # Pins the window to an absolute position, so it stays put while new samples arrive
+        seq, oldest = self.buf.seq, self.buf.oldest
+        self.history_end = oldest + int((seq - oldest) * value / self.history_slider.maximum())
+        self.history_label.setText(f"-{(seq - self.history_end) / 48000:.1f} s")
+
+    def on_device_selected(self, index):
+        if index == self.device_index:
+            return
+        device = self.devices[index]
+        self.device_controls[self.device_index] = self.control_values()
+
+        # The analysis chain is bound to one ring, the new board gets a fresh one
+        self.worker.stop()
+        self.worker.join()
+        self.buf, self.reg_block, self.stats = device.buf, device.reg_block, device.stats
+        self.device_index = index
+        self.init_analysis()
+        self.measure.rate = self.measure_rate_spinbox.value()
+        self.history_slider.setValue(self.history_slider.maximum())
+        self.start_worker()
+
+        # A board shown for the first time takes over the current settings
+        self.load_controls(self.device_controls.get(index, self.control_values()))
+
+        self.connected = self.buf.seq > 0
+        self.statusBar().showMessage(f"{device.name}" if self.connected else f"Connecting to {device.name}...",
+                                     3000 if self.connected else 0)
+        if self.waterfall_group.isVisible():
+            image = self.waterfall.snapshot()
+            self.waterfall_left.setImage(image[0], autoLevels=False)
+            self.waterfall_right.setImage(image[1], autoLevels=False)
+        self.update_stats()
+
+    def control_values(self) -> dict:
+        values = {name: getattr(self, name).value() for name, _ in self.fpga_controls()}
+        values["mixer"] = self.mixer_group.checkedId()
+        return values
+
+    def load_controls(self, values: dict):
+        # Set without signals, then every handler runs once: registers the board already holds are
+        # not resent, and the labels follow
+        for name, _ in self.fpga_controls():
+            widget = getattr(self, name)
+            widget.blockSignals(True)
+            widget.setValue(values[name])
+            widget.blockSignals(False)
+        self.mixer_group.button(values["mixer"]).setChecked(True)
+
+        for name, handler in self.fpga_controls():
+            handler(getattr(self, name).value())
+        self.on_mixer_selected(self.mixer_group.checkedButton())
+
+    def fpga_controls(self) -> tuple:
+        # Per-board FPGA controls and their handlers
+        return (("volume_left_slider", self.on_volume_left_changed),
+                ("volume_right_slider", self.on_volume_right_changed),
+                ("delay_left_slider", self.on_delay_left_changed),
+                ("delay_right_slider", self.on_delay_right_changed),
+                ("lpf_spinbox", self.on_frequencies_changed),
+                ("hpf_spinbox", self.on_frequencies_changed),
+                ("bpf_low_spinbox", self.on_frequencies_changed),
+                ("bpf_high_spinbox", self.on_frequencies_changed),
+                ("bsf_spinbox", self.on_frequencies_changed),
+                ("distortion_slider", self.on_distortion_changed),
+                ("tremolo_slider", self.on_tremolo_changed))
+
+    def on_measure_rate_changed(self, value):
+        self.measure.rate = value
+
+    def on_trigger_changed(self, _=None, arm: bool = False):
+        # Applied by the plot worker before its next frame
+        self.worker.configure(trigger={"mode": self.trigger_mode_combo.currentText().lower(),
+                                       "edge": self.trigger_edge_combo.currentText().lower(),
+                                       "channel": self.trigger_channel_combo.currentIndex(),
+                                       "level": self.trigger_level_spinbox.value(),
+                                       "hysteresis": self.trigger_hysteresis_spinbox.value(),
+                                       "arm": arm})
+        if self.trigger_mode_combo.currentText() == "Off":
+            self.trigger_label.setText("")
+
+    def on_freq_scale_changed(self, text):
+        self.freq_scale, self.octave_fraction = FREQ_SCALES[text]
+
+        # Log modes get log10(Hz) band centers from the worker, the axes only relabel them
+        log = self.freq_scale != "linear"
+        for item in (self.fft_item_left, self.fft_item_right):
+            item.getAxis('bottom').setLogMode(log)
+            if log:
+                item.setXRange(math.log10(LOG_F_MIN), math.log10(24000), padding=0)
+            else:
+                item.setXRange(0, 25000)
+        self.push_plot_settings()
+
     def on_amplitude_step_changed(self, value):
         self.amplitude = 10 / value
         self.amplitude_step_label.setText(f"{1000 / value:.1f} %")
@@ -543,14 +959,12 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.amplitude_offset_label.setText(f"{real_value:.1f} %")
 
     def on_volume_left_changed(self, value):
-        reg_value = math.floor((value / 200) * (2 ** 31))
-        self.reg_block.set("vol_left", reg_value - 1)
+        self.reg_block.set("vol_left", reg_value("vol_left", value))
 
         self.volume_left_label.setText(f"{value} %")
 
     def on_volume_right_changed(self, value):
-        reg_value = math.floor((value / 200) * (2 ** 31))
-        self.reg_block.set("vol_right", reg_value - 1)
+        self.reg_block.set("vol_right", reg_value("vol_right", value))
 
         self.volume_right_label.setText(f"{value} %")
 
@@ -563,67 +977,22 @@ class Oscilloscope(QtWidgets.QMainWindow):
         self.delay_right_label.setText(f"{value * (1.0 / 48000):.2f} s")
 
     def on_distortion_changed(self, value):
-        log_val = (2 ** 23 - 1) ** (value / 1000)
+        # Log slider: 0..1000 sweeps the threshold from one LSB to full scale
+        threshold = (2 ** 23 - 1) ** (value / 1000) / (2 ** 23 - 1)
 
-        self.reg_block.set("distortion", int(log_val))
-        self.distortion_label.setText(f"{log_val / (2 ** 23 - 1):.6f}")
+        self.reg_block.set("distortion", reg_value("distortion", threshold))
+        self.distortion_label.setText(f"{threshold:.6f}")
 
     def on_tremolo_changed(self, value):
         freq = 24000 ** (value / 24000)
-        reg_freq = math.floor((1024 * int(freq) / 48000) * (2 ** 16))
 
-        self.reg_block.set("tremolo", reg_freq)
+        self.reg_block.set("tremolo", reg_value("tremolo", freq))
         self.tremolo_label.setText(f"{int(freq)} Hz")
 
     def on_frequencies_changed(self, value):
-        lpf_val = math.floor((1 - math.e ** (-2 * math.pi * (self.lpf_spinbox.value() / 48000))) * (2 ** 31))
-        self.reg_block.set("lpf", lpf_val)
-
-        k = math.tan(math.pi * (self.hpf_spinbox.value() / 48000))
-        hpf_val = math.floor(((1 - k) / (1 + k)) * (2 ** 31))
-        self.reg_block.set("hpf", hpf_val)
-
-        bpf_low_val = math.floor((1 - math.e ** (-2 * math.pi * (self.bpf_low_spinbox.value() / 48000))) * (2 ** 31))
-        self.reg_block.set("bpf_low", bpf_low_val)
-
-        k = math.tan(math.pi * (self.bpf_high_spinbox.value() / 48000))
-        bpf_high_val = math.floor(((1 - k) / (1 + k)) * (2 ** 31))
-        self.reg_block.set("bpf_high", bpf_high_val)
-
-        bsf_val = math.floor((2 * math.cos(2 * math.pi * (self.bsf_spinbox.value() / 48000))) * (2 ** 30))
-        self.reg_block.set("bsf", bsf_val)
+        for name in ("lpf", "hpf", "bpf_low", "bpf_high", "bsf"):
+            self.reg_block.set(name, reg_value(name, getattr(self, f"{name}_spinbox").value()))
 
     def on_mixer_selected(self, value):
         id = self.mixer_group.id(value)
         self.reg_block.set("mixer", id)
-
-    # FFT average helpers
-    def _avg_hold_push(self, P_left: np.ndarray, P_right: np.ndarray):
-        avg_frames = self.fft_spinbox.value()
-
-        if (
-                self._avg_buf_left is None
-                or self._avg_buf_left.shape[0] != avg_frames
-                or self._avg_buf_left.shape[1] != P_left.shape[0]
-        ):
-            self._avg_buf_left = np.zeros((avg_frames, P_left.shape[0]), dtype=np.float64)
-            self._avg_buf_right = np.zeros((avg_frames, P_right.shape[0]), dtype=np.float64)
-            self._avg_idx = 0
-            self._avg_count = 0
-
-        self._avg_buf_left[self._avg_idx, :] = P_left
-        self._avg_buf_right[self._avg_idx, :] = P_right
-        self._avg_idx = (self._avg_idx + 1) % avg_frames
-        self._avg_count = min(self._avg_count + 1, avg_frames)
-
-    def _avg_hold_get(self) -> tuple[np.ndarray, np.ndarray]:
-        n = self._avg_count
-
-        if self.fft_radio1.isChecked():
-            Pl = self._avg_buf_left[:n, :].mean(axis=0)
-            Pr = self._avg_buf_right[:n, :].mean(axis=0)
-        else:
-            Pl = self._avg_buf_left[:n, :].max(axis=0)
-            Pr = self._avg_buf_right[:n, :].max(axis=0)
-
-        return Pl, Pr
@@ -1,37 +1,154 @@
+import os
 import sys
+import time
 import threading
-from PyQt6 import QtWidgets
+import subprocess
+import multiprocessing
 
-from buffer import RingBuffer, RegBlock
-from network import producer_thread
-from gui import Oscilloscope, BUFFER_SECONDS
+from buffer import StereoRingBuffer, RegBlock, SharedRingBuffer, SharedRegBlock, MemmapRingBuffer
+from network import StreamStats, SharedStreamStats, SRC_MAC, IFACE
+from devices import DeviceRegistry, devices_thread, devices_process
 
-BUFFER_SAMPLES = int(BUFFER_SECONDS * 48000)
 IS_DEBUG = False
+INGEST_BACKEND = "raw"  # raw, scapy, replay
+REPLAY = {"path": "capture.pcap", "speed": 1.0, "loop": True}  # replay backend: recording, pace (0 = max), loop
+INGEST_PROCESS = False  # run the ethernet side in its own process, sharing buffers through shared memory
+ENVELOPE_LEVELS = 5
+HISTORY_SECONDS = 0  # > 0: keep this much scrollback in memory-mapped files instead of BUFFER_SECONDS in RAM
+HISTORY_PATH = None  # directory for the history files, resumed on the next start; None uses a temporary one
+HISTORY_ENVELOPE_LEVELS = 10  # enough levels that an hour-long window stays a few thousand points
+PROFILE_IMPORTS_TOP = 15
+PROFILE_WAIT_SECONDS = 5.0  # how long the startup profile waits for the first samples
+API_PORT = None  # TCP port of the remote API server (server.py), None to not start it
+API_HOST = "127.0.0.1"
+DEVICES = [(SRC_MAC, IFACE)]  # (source MAC, interface) of every board, each gets its own buffers and registers
+
+
+def import_gui():
+    # PyQt6 and the GUI are most of the import time: loaded from main() rather than at module import,
+    # so the startup profile times them as a phase of their own
+    from PyQt6 import QtWidgets, QtCore
+    import gui
+    return QtWidgets, QtCore, gui
+
+
+def profile_imports():
+    # Heaviest top-level imports of a fresh interpreter loading the dashboard, from -X importtime
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main; main.import_gui()"],
+                         capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stderr
+    rows = []
+    after_main = False
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = len(name) - len(name.lstrip())
+        if name.strip() == "main" and depth == 1:
+            after_main = True
+            continue
+        # Modules imported directly by main.py with everything they pulled in, then the deferred GUI imports
+        if depth == (1 if after_main else 3):
+            rows.append((int(cumulative) / 1e6, name.strip()))
+
+    print("Imports of main.py and import_gui() (cumulative):")
+    for seconds, name in sorted(rows, reverse=True)[:PROFILE_IMPORTS_TOP]:
+        print(f"  {seconds * 1000:9.1f} ms  {name}")
+
+
+def profile_startup(app, buffer, start: float, marks: list):
+    # Reports each startup phase once the first samples arrive (or the wait runs out), then quits
+    from PyQt6 import QtCore
+
+    def poll():
+        if buffer.seq == 0 and time.perf_counter() - start < PROFILE_WAIT_SECONDS:
+            return
+        timer.stop()
+        marks.append(("first samples" if buffer.seq else "no samples yet", time.perf_counter()))
+
+        print("Startup phases:")
+        last = start
+        for name, t in marks:
+            print(f"  {(t - start) * 1000:9.1f} ms  (+{(t - last) * 1000:7.1f} ms)  {name}")
+            last = t
+        profile_imports()
+        app.quit()
+
+    timer = QtCore.QTimer(app)
+    timer.timeout.connect(poll)
+    timer.start(10)
+    QtCore.QTimer.singleShot(0, lambda: marks.append(("window shown", time.perf_counter())))
 
 
 def main():
-    # ring buffer for left channel only
-    buffer_left = RingBuffer(BUFFER_SAMPLES)
-    buffer_right = RingBuffer(BUFFER_SAMPLES)
-    reg_block = RegBlock()
-
-    # Start ethernet thread
-    shutdown_evt = threading.Event()
-    eth_th = threading.Thread(target=producer_thread,
-                              args=(buffer_left, buffer_right, reg_block, IS_DEBUG, shutdown_evt),
-                              daemon=True)
-    eth_th.start()
+    start = time.perf_counter()
+    marks = []
+    QtWidgets, QtCore, gui = import_gui()
+    buffer_samples = int(gui.BUFFER_SECONDS * 48000)
+    marks.append(("PyQt6 and gui imports", time.perf_counter()))
+
+    devices = DeviceRegistry()
+    for mac, iface in DEVICES:
+        if INGEST_PROCESS:
+            # Shared interleaved left/right ring buffer and registers, written by the ingest process
+            buffer = SharedRingBuffer(buffer_samples, channels=2, envelope_levels=ENVELOPE_LEVELS)
+            reg_block = SharedRegBlock()
+            stats = SharedStreamStats()
+        else:
+            # Interleaved left/right ring buffer, lock-free since only the ethernet thread writes to it
+            if HISTORY_SECONDS > 0:
+                path = None if HISTORY_PATH is None else os.path.join(HISTORY_PATH, mac.replace(":", ""))
+                buffer = MemmapRingBuffer(int(HISTORY_SECONDS * 48000), channels=2, spsc=True,
+                                          envelope_levels=HISTORY_ENVELOPE_LEVELS, path=path)
+            else:
+                buffer = StereoRingBuffer(buffer_samples, spsc=True, envelope_levels=ENVELOPE_LEVELS)
+            reg_block = RegBlock()
+            stats = StreamStats()
+        devices.add(mac, buffer, reg_block, stats, iface)
+
+    # One receive loop per interface demultiplexes all of its boards, one register sender per board
+    if INGEST_PROCESS:
+        shutdown_evt = multiprocessing.Event()
+        eth_th = multiprocessing.Process(target=devices_process,
+                                         args=(devices.spec(), IS_DEBUG, shutdown_evt, INGEST_BACKEND, REPLAY),
+                                         daemon=True)
+    else:
+        shutdown_evt = threading.Event()
+        eth_th = threading.Thread(target=devices_thread,
+                                  args=(devices, IS_DEBUG, shutdown_evt, INGEST_BACKEND, REPLAY),
+                                  daemon=True)
+    first = devices[0]
+    marks.append(("buffers", time.perf_counter()))
 
     # Start GUI
     app = QtWidgets.QApplication(sys.argv)
-    osc = Oscilloscope(buffer_left, buffer_right, reg_block)
+    marks.append(("QApplication", time.perf_counter()))
+    osc = gui.Oscilloscope(first.buf, first.reg_block, first.stats, devices)
     osc.show()
+    marks.append(("window built", time.perf_counter()))
+
+    # Ingest starts once the event loop runs, so bringing up the network never delays the first paint
+    QtCore.QTimer.singleShot(0, eth_th.start)
+    if "--profile-startup" in sys.argv:
+        profile_startup(app, first.buf, start, marks)
+
+    server = None
+    if API_PORT is not None:
+        from server import ApiServer
+        server = ApiServer(first.buf, first.reg_block, first.stats, API_HOST, API_PORT, devices)
+        server.start()
 
     # Handles exiting
     app.exec()
+    if server is not None:
+        server.stop()
     shutdown_evt.set()
-    eth_th.join(timeout=0.1)
+    if eth_th.is_alive():
+        eth_th.join(timeout=1.0 if INGEST_PROCESS else 0.1)
+    if INGEST_PROCESS:
+        devices.close(unlink=True)
+    elif HISTORY_SECONDS > 0:
+        for device in devices:
+            device.buf.close()
     sys.exit(0)
 
 
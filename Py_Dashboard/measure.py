@@ -0,0 +1,147 @@
+import math
+import time
+import threading
+import numpy as np
+
+from buffer import RingBuffer
+from spectrum import StftEngine
+
+MEASURE_RATE = 4.0  # results per second
+MEASURE_AVERAGE = 4  # STFT frames averaged per result
+LEVEL_SECONDS = 0.5  # window for RMS / peak / crest factor
+HARMONICS = 9  # highest harmonic counted in THD
+LOBE_BINS = 3  # half width of a tone's main lobe, enough for hann, hamming and blackman
+SKIRT_BINS = 30  # half width kept out of the noise estimate around every tone, past hann / blackman leakage
+FULL_SCALE = 2 ** 23
+CHANNEL_NAMES = ("left", "right")
+
+
+def db(ratio: float) -> float:
+    return 10.0 * math.log10(max(ratio, 1e-30))
+
+
+def tone_bin(p: np.ndarray, first: int) -> float:
+    # Peak bin above `first` with sub-bin precision from a parabola through the log powers around it
+    k = first + int(np.argmax(p[first:-1]))
+    a, b, c = np.log(p[k - 1:k + 2] + 1e-300)
+    denom = a - 2 * b + c
+    return k + (0.5 * (a - c) / denom if denom < 0 else 0.0)
+
+
+def analyze_spectrum(p: np.ndarray, bin_hz: float, harmonics: int = HARMONICS, lobe: int = LOBE_BINS,
+                     skirt: int = SKIRT_BINS) -> dict:
+    # Tone measurements from one channel's averaged power spectrum. The fundamental's lobe is the tone,
+    # the lobes at its multiples are distortion. The noise density comes from the bins away from DC
+    # and every tone, so window leakage is not counted as noise, and is extended over the whole band
+    n = len(p)
+    k0 = tone_bin(p, lobe + 1)
+    # Harmonics of a tone only a few bins up would share its lobe, they are not resolved
+    tones = [k0 * h for h in range(1, harmonics + 1 if k0 > 2 * lobe else 2) if k0 * h + lobe < n]
+
+    quiet = np.ones(n, dtype=bool)
+    quiet[:skirt + 1] = False
+    for k in tones:
+        quiet[max(int(round(k)) - skirt, 0):int(round(k)) + skirt + 1] = False
+    density = float(p[quiet].mean()) if quiet.any() else 0.0
+    noise = max(density * (n - lobe - 1), 1e-30)
+
+    def lobe_power(k):
+        i = int(round(k))
+        band = p[max(i - lobe, 1):min(i + lobe + 1, n)]
+        return max(float(band.sum()) - density * len(band), 0.0)
+
+    fundamental = lobe_power(k0)
+    harmonic = sum(lobe_power(k) for k in tones[1:])
+    rest = harmonic + noise
+    total = fundamental + rest
+
+    return {"freq": k0 * bin_hz,
+            "thd_db": db(harmonic / fundamental) if fundamental > 0 else 0.0,
+            "thd_pct": 100 * math.sqrt(harmonic / fundamental) if fundamental > 0 else 0.0,
+            "thdn_db": db(rest / fundamental) if fundamental > 0 else 0.0,
+            "snr_db": db(fundamental / noise),
+            "sinad_db": db(total / rest)}
+
+
+class MeasurementEngine:
+    # Audio measurements per channel from the spectra the STFT engine already queued, plus levels from
+    # the ring buffer, at most `rate` times per second. Results go to snapshot() and to listeners
+    def __init__(self, buf: RingBuffer, stft: StftEngine, rate: float = MEASURE_RATE,
+                 average: int = MEASURE_AVERAGE):
+        self.buf = buf
+        self.stft = stft
+        self.rate = rate
+        self.average = min(average, stft.depth)
+        self.bin_hz = float(stft.freqs[1])
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self._latest = None
+        self._next = 0.0
+        self._frames_seen = 0
+
+    def add_listener(self, fn):
+        # fn(result) is called from the thread that runs update(), keep it short
+        self.listeners.append(fn)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return self._latest
+
+    def update(self) -> dict:
+        # New result when one is due and the STFT has moved on since the last, else None
+        now = time.monotonic()
+        if now < self._next or self.stft.count == self._frames_seen:
+            return None
+        self._next = now + 1.0 / self.rate
+        self._frames_seen = self.stft.count
+
+        # Averaged periodogram of the newest frames, no transform of its own
+        X, ends = self.stft.get(self.stft.count - self.average)
+        if not len(X):
+            return None
+        p = (X.real.astype(np.float64) ** 2 + X.imag.astype(np.float64) ** 2).mean(axis=0)
+        p = p.reshape(len(p), -1)
+
+        n = int(LEVEL_SECONDS * 48000)
+        x = self.buf.view(n, int(ends[-1]))
+        if x is None:
+            x = self.buf.read(n, int(ends[-1]))
+            if not len(x):
+                # Already overwritten, the next result takes newer frames
+                return None
+        x = x.reshape(len(x), -1).astype(np.float64) / FULL_SCALE
+        rms = np.sqrt(np.mean(x * x, axis=0))
+        peak = np.abs(x).max(axis=0)
+
+        result = {"time": time.time(), "sample": int(ends[-1])}
+        for ch, name in enumerate(CHANNEL_NAMES if p.shape[1] == 2 else ("mono",)):
+            m = analyze_spectrum(p[:, ch], self.bin_hz)
+            m["rms_dbfs"] = db(rms[ch] ** 2)
+            m["peak_dbfs"] = db(peak[ch] ** 2)
+            m["crest_db"] = m["peak_dbfs"] - m["rms_dbfs"]
+            result[name] = m
+
+        with self._lock:
+            self._latest = result
+        for fn in self.listeners:
+            fn(result)
+        return result
+
+
+class MeasurementLog:
+    # Listener that appends every result to a CSV file, one row per result
+    FIELDS = ("freq", "rms_dbfs", "peak_dbfs", "crest_db", "thd_db", "thd_pct", "thdn_db", "snr_db", "sinad_db")
+
+    def __init__(self, path: str, channels=CHANNEL_NAMES):
+        self.channels = channels
+        self.file = open(path, "w")
+        self.file.write("time,sample," + ",".join(f"{c}_{f}" for c in channels for f in self.FIELDS) + "\n")
+
+    def __call__(self, result: dict):
+        values = (result[c][f] for c in self.channels for f in self.FIELDS)
+        self.file.write(f"{result['time']:.3f},{result['sample']}," + ",".join(f"{v:.4f}" for v in values) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
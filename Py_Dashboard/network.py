@@ -1,75 +1,506 @@
+import sys
+import math
 import time
+import ctypes
+import select
+import socket
+import struct
 import threading
 import numpy as np
-from scapy.all import sniff
-from scapy.layers.l2 import Ether
-from scapy.sendrecv import sendp, AsyncSniffer
 
-from buffer import RingBuffer, RegBlock
+from buffer import StereoRingBuffer, RegBlock, open_shared_memory
 
 DBG_FREQ = 10
-SEND_INTERVAL_MS = 50
+COALESCE_MS = 5  # latency budget for merging a burst of register changes into one frame
+KEEPALIVE_MS = 1000  # registers are re-sent this often even if nothing changed
 ETHERTYPE = 0x88B5
 SRC_MAC = "80:1F:12:CA:83:63"
 DST_MAC = "FF:FF:FF:FF:FF:FF"
+IFACE = "Ethernet"
 
+# Raw socket ingest (Linux only)
+ETH_HEADER_LEN = 14
+FRAME_HEAD = bytes.fromhex("48656C6C6F20")  # payload slot 0, never written by top.v: eth_bram_init.coe's "Hello "
+RAW_BATCH = 64
+RAW_FRAME_SIZE = 2048
+RAW_RCVBUF = 4 * 1024 * 1024
+RAW_POLL_MS = 100
+SO_ATTACH_FILTER = 26
+SO_TIMESTAMPNS = 35
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
 
-def producer_thread(buf_left: RingBuffer, buf_right: RingBuffer, reg_block: RegBlock, en_debug: bool,
-                    shutdown_evt: threading.Event):
-    # Generate 1 kHz sin wave
-    if en_debug:
-        t = 0.0
-        pkt_time = np.arange(250) * (1 / 48000)
+# Stream instrumentation
+SAMPLE_RATE = 48000
+STATS_HISTORY = 1024  # arrival timestamps kept for rate estimates
+STATS_RATE_WINDOW = 1.0  # seconds
+JITTER_RANGE_MS = 5.0
+JITTER_BIN_MS = 0.25
+LOSS_FACTOR = 1.5  # an inter-arrival gap this many nominal periods long means lost frames
+RECORD_SCALAR_MAX = 8  # batches up to this many frames are recorded frame by frame, larger ones vectorized
+STATS_DTYPE = np.dtype([
+    ("frames", np.int64),
+    ("samples", np.int64),
+    ("batches", np.int64),
+    ("last_batch", np.int64),
+    ("max_batch", np.int64),
+    ("kernel_drops", np.int64),
+    ("lost_frames", np.int64),
+    ("bad_headers", np.int64),
+    ("samples_per_frame", np.int64),
+    ("decode_total", np.float64),
+    ("decode_max", np.float64),
+    ("latency_last", np.float64),
+    ("latency_max", np.float64),
+    ("first_arrival", np.float64),
+    ("last_arrival", np.float64),
+    ("arrivals", np.float64, (STATS_HISTORY,)),
+    ("jitter_hist", np.int64, (int(2 * JITTER_RANGE_MS / JITTER_BIN_MS) + 1,)),
+])
+
+
+class StreamStats:
+    def __init__(self):
+        # All counters live in one structured record, written only by the ingest thread
+        self.c = self._alloc()
+        # Views of its fields, looked up once so the per-batch path does no field indexing
+        self._v = {name: self.c[name] for name in STATS_DTYPE.names}
+
+    def _alloc(self) -> np.ndarray:
+        return np.zeros((), dtype=STATS_DTYPE)
+
+    def record(self, frames: np.ndarray, lengths: np.ndarray, count: int, offset: int, arrivals: np.ndarray,
+               decode_time: float, samples: int):
+        v = self._v
+        done = int(v["frames"])
+        if done == 0:
+            v["first_arrival"][()] = arrivals[0]
+
+        # A few frames per batch is the normal case: plain Python per frame beats the numpy setup
+        if count <= RECORD_SCALAR_MAX:
+            per_frame = self._record_frames(frames, lengths, count, offset, arrivals, done)
+        else:
+            per_frame = self._record_batch(frames, lengths, count, offset, arrivals, done)
+
+        first_time = float(arrivals[0])
+        latency = time.time() - first_time
+        v["frames"][()] = done + count
+        v["samples"][()] += samples
+        v["batches"][()] += 1
+        v["last_batch"][()] = count
+        if count > v["max_batch"]:
+            v["max_batch"][()] = count
+        v["samples_per_frame"][()] = per_frame
+        v["decode_total"][()] += decode_time
+        if decode_time / count > v["decode_max"]:
+            v["decode_max"][()] = decode_time / count
+        v["latency_last"][()] = latency
+        if latency > v["latency_max"]:
+            v["latency_max"][()] = latency
+        v["last_arrival"][()] = arrivals[count - 1]
+
+    def _record_frames(self, frames: np.ndarray, lengths: np.ndarray, count: int, offset: int, arrivals: np.ndarray,
+                       done: int) -> int:
+        v = self._v
+        hist, history = v["jitter_hist"], v["arrivals"]
+        last = float(v["last_arrival"])
+        lost = bad = 0
+
+        for i in range(count):
+            size = int(lengths[i]) - offset
+            samples = size // 6 - 1
+            t = float(arrivals[i])
+            history[(done + i) % STATS_HISTORY] = t
+            if size < 6 or frames[i, offset:offset + 6].tobytes() != FRAME_HEAD:
+                bad += 1
+
+            # Same arithmetic as _record_batch, frame by frame
+            if done + i > 0 and samples > 0:
+                period = samples / SAMPLE_RATE
+                interval = t - last
+                b = round(((interval - period) * 1000 + JITTER_RANGE_MS) / JITTER_BIN_MS)
+                hist[min(max(b, 0), len(hist) - 1)] += 1
+                if interval > LOSS_FACTOR * period:
+                    lost += round(interval / period) - 1
+            last = t
+
+        v["lost_frames"][()] += lost
+        v["bad_headers"][()] += bad
+        return max(samples, 0)
+
+    def _record_batch(self, frames: np.ndarray, lengths: np.ndarray, count: int, offset: int, arrivals: np.ndarray,
+                      done: int) -> int:
+        v = self._v
+        hist = v["jitter_hist"]
+        sizes = lengths[:count] - offset
+        samples = sizes // 6 - 1
+        times = arrivals[:count]
+
+        # Inter-arrival times against the nominal frame period, the samples the frame carries
+        period = samples / SAMPLE_RATE
+        if done == 0:
+            intervals, period = np.diff(times), period[1:]
+        else:
+            intervals = np.diff(times, prepend=v["last_arrival"])
+        timed = period > 0
+        if not timed.all():
+            intervals, period = intervals[timed], period[timed]
+        deviation_ms = (intervals - period) * 1000
+        bins = np.clip(np.rint((deviation_ms + JITTER_RANGE_MS) / JITTER_BIN_MS), 0, len(hist) - 1)
+        hist += np.bincount(bins.astype(np.int64), minlength=len(hist))
+
+        gaps = intervals > LOSS_FACTOR * period
+        if gaps.any():
+            v["lost_frames"][()] += int(np.rint(intervals[gaps] / period[gaps]).sum() - gaps.sum())
+
+        # Slot 0 is the constant FRAME_HEAD in every frame the board sends, anything else is corrupt
+        head = frames[:count, offset:offset + 6]
+        intact = 0
+        if head.shape[1] == 6:
+            intact = int(((head == np.frombuffer(FRAME_HEAD, dtype=np.uint8)).all(axis=1) & (sizes >= 6)).sum())
+        v["bad_headers"][()] += count - intact
+
+        # Arrival history (circular, indexed by frame count)
+        v["arrivals"][(done + np.arange(count)) % STATS_HISTORY] = times
+        return max(int(samples[-1]), 0)
+
+    def add_kernel_drops(self, drops: int):
+        self.c["kernel_drops"] += drops
+
+    def snapshot(self) -> dict:
+        c = self.c.copy()
+        frames = int(c["frames"])
+
+        # Rates over the most recent STATS_RATE_WINDOW seconds of arrivals
+        n = min(frames, STATS_HISTORY)
+        arrivals = c["arrivals"][(frames - n + np.arange(n)) % STATS_HISTORY]
+        recent = arrivals[arrivals >= c["last_arrival"] - STATS_RATE_WINDOW]
+        span = recent[-1] - recent[0] if len(recent) > 1 else 0.0
+        fps = (len(recent) - 1) / span if span > 0 else 0.0
+
+        # Half-width of the jitter histogram that holds 99% of the inter-arrival deviations
+        hist = c["jitter_hist"]
+        centre = len(hist) // 2
+        folded = hist[centre:].copy()
+        folded[1:] += hist[centre - 1::-1]
+        cum = np.cumsum(folded)
+        total = hist.sum()
+        jitter_p99 = float(np.argmax(cum >= 0.99 * total) * JITTER_BIN_MS) if total else 0.0
+
+        return {
+            "frames": frames,
+            "samples": int(c["samples"]),
+            "fps": fps,
+            "sample_rate": fps * int(c["samples_per_frame"]),
+            "rate_ratio": fps * int(c["samples_per_frame"]) / SAMPLE_RATE,
+            "lost_frames": int(c["lost_frames"]),
+            "bad_headers": int(c["bad_headers"]),
+            "kernel_drops": int(c["kernel_drops"]),
+            "jitter_hist": hist,
+            "jitter_bin_ms": JITTER_BIN_MS,
+            "jitter_p99_ms": jitter_p99,
+            "decode_mean": float(c["decode_total"]) / frames if frames else 0.0,
+            "decode_max": float(c["decode_max"]),
+            "queue_depth": int(c["last_batch"]),
+            "queue_depth_max": int(c["max_batch"]),
+            "latency": float(c["latency_last"]),
+            "latency_max": float(c["latency_max"]),
+            "uptime": float(c["last_arrival"] - c["first_arrival"]) if frames else 0.0,
+        }
+
+
+class SharedStreamStats(StreamStats):
+    # Same record in shared memory, so the GUI can read the stats of a separate ingest process
+    def __init__(self, name: str = None, create: bool = True):
+        self._shm = open_shared_memory(name, STATS_DTYPE.itemsize, create)
+        self.name = self._shm.name
+        super().__init__()
+
+    def _alloc(self) -> np.ndarray:
+        return np.ndarray((), dtype=STATS_DTYPE, buffer=self._shm.buf)
+
+    def spec(self) -> dict:
+        return {"name": self.name, "create": False}
+
+    def close(self, unlink: bool = False):
+        self.c = self._v = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class FrameDecoder:
+    def __init__(self, max_frames: int = RAW_BATCH, frame_size: int = RAW_FRAME_SIZE):
+        max_samples = max_frames * (frame_size // 6)
+
+        # Each 24-bit big-endian sample is byte-reversed into the top 3 bytes of a little-endian
+        # int32, so an arithmetic shift right by 8 gives the sign-extended value in one pass
+        self._pad = np.zeros((max_samples, 2, 4), dtype=np.uint8)
+        self._words = self._pad.view("<i4")[..., 0]
+
+    def decode(self, frames: np.ndarray, lengths: np.ndarray, count: int, offset: int,
+               buf: StereoRingBuffer) -> int:
+        # The first 6 bytes of each payload are skipped
+        start = offset + 6
+        counts = (lengths[:count] - start) // 6
+
+        n = int(counts[0]) if count else 0
+        if count and n > 0 and (counts == n).all():
+            # Equal-length frames (the normal case): the whole batch in one strided copy
+            total = count * n
+            src = frames[:count, start:start + n * 6].reshape(count, n, 2, 3)
+            self._pad[:total].reshape(count, n, 2, 4)[..., 1:] = src[..., ::-1]
+        else:
+            total = 0
+            for i in range(count):
+                n = int(counts[i])
+                if n <= 0:
+                    continue
+                src = frames[i, start:start + n * 6].reshape(n, 2, 3)
+                self._pad[total:total + n, :, 1:] = src[..., ::-1]
+                total += n
+
+        buf.write_with(total, lambda dst, off: np.right_shift(self._words[off:off + len(dst)], 8, out=dst))
+        return total
+
+
+def bpf_program(src_mac) -> list[tuple[int, int, int, int]]:
+    # One MAC or a list of them, one socket can take the frames of several boards
+    macs = [bytes.fromhex(m.replace(":", "")) for m in ([src_mac] if isinstance(src_mac, str) else src_mac)]
+    drop = 2 + 4 * len(macs)
 
+    # Classic BPF: accept ETHERTYPE frames coming from one of the MACs, drop everything else
+    prog = [
+        (0x28, 0, 0, 12),  # ldh [12]
+        (0x15, 0, drop - 2, ETHERTYPE),  # jeq #ETHERTYPE
+    ]
+    for mac in macs:
+        i = len(prog)
+        prog += [
+            (0x20, 0, 0, 6),  # ld [6]
+            (0x15, 0, 2, int.from_bytes(mac[:4], "big")),  # jeq #mac[0:4], else the next MAC
+            (0x28, 0, 0, 10),  # ldh [10]
+            (0x15, drop - i - 3, 0, int.from_bytes(mac[4:], "big")),  # jeq #mac[4:6]
+        ]
+    prog += [
+        (0x06, 0, 0, 0),  # ret #0
+        (0x06, 0, 0, 0xFFFF),  # ret #0xFFFF
+    ]
+    return prog
+
+
+def open_raw_socket(iface: str, src_mac) -> socket.socket:
+    # Protocol 0 receives nothing until bind, so no frame slips in before the filter is attached
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+    try:
+        prog = b"".join(struct.pack("HBBI", *ins) for ins in bpf_program(src_mac))
+        filt = ctypes.create_string_buffer(prog, len(prog))
+        fprog = struct.pack("HP", len(prog) // 8, ctypes.addressof(filt))
+        sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RAW_RCVBUF)
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        sock.bind((iface, ETHERTYPE))
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class RawReceiver:
+    def __init__(self, iface: str, src_mac, batch: int = RAW_BATCH):
+        self.sock = open_raw_socket(iface, src_mac)
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN)
+
+        # Preallocated frame slots, reused for every batch, with kernel arrival timestamps
+        self.frames = np.zeros((batch, RAW_FRAME_SIZE), dtype=np.uint8)
+        self.lengths = np.zeros(batch, dtype=np.int64)
+        self.arrivals = np.zeros(batch, dtype=np.float64)
+        self._views = [[memoryview(self.frames[i])] for i in range(batch)]
+        self._anc_size = socket.CMSG_SPACE(16)
+
+    def recv_batch(self, timeout_ms: int = RAW_POLL_MS) -> int:
+        if not self.poller.poll(timeout_ms):
+            return 0
+
+        # Drain whatever the kernel has queued, up to one batch
+        count = 0
+        for view in self._views:
+            try:
+                nbytes, ancdata, _, _ = self.sock.recvmsg_into(view, self._anc_size)
+            except BlockingIOError:
+                break
+            self.lengths[count] = nbytes
+            self.arrivals[count] = time.time()
+            for level, kind, data in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+                    sec, nsec = struct.unpack("qq", data)
+                    self.arrivals[count] = sec + nsec * 1e-9
+            count += 1
+        return count
+
+    def kernel_drops(self) -> int:
+        # Frames the kernel dropped since the last call (reading resets the counter)
+        _, drops = struct.unpack("II", self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+        return drops
+
+    def close(self):
+        self.sock.close()
+
+
+def raw_ingest_thread(receiver: RawReceiver, buf: StereoRingBuffer, shutdown_evt: threading.Event,
+                      stats: StreamStats = None):
+    decoder = FrameDecoder(len(receiver.lengths), receiver.frames.shape[1])
+    last_drops_check = time.monotonic()
+    try:
         while not shutdown_evt.is_set():
-            phase = (2 * np.pi * DBG_FREQ) * (t + pkt_time)
-            left = np.round(np.sin(phase) * (2 ** 22 - 1)).astype(np.int32)
-            right = -left
+            count = receiver.recv_batch()
+            if count:
+                start = time.perf_counter()
+                samples = decoder.decode(receiver.frames, receiver.lengths, count, ETH_HEADER_LEN, buf)
+                if stats is not None:
+                    stats.record(receiver.frames, receiver.lengths, count, ETH_HEADER_LEN, receiver.arrivals,
+                                 time.perf_counter() - start, samples)
 
-            buf_left.write(left)
-            buf_right.write(right)
+            if stats is not None and time.monotonic() - last_drops_check > 0.5:
+                stats.add_kernel_drops(receiver.kernel_drops())
+                last_drops_check = time.monotonic()
+    finally:
+        receiver.close()
+
+
+class RegSender:
+    def __init__(self, iface: str, dst_mac: str, src_mac: str, backend: str = "raw"):
+        self.header = (bytes.fromhex(dst_mac.replace(":", "")) + bytes.fromhex(src_mac.replace(":", ""))
+                       + ETHERTYPE.to_bytes(2, "big"))
+        self.pack = struct.Struct(">12I").pack
+
+        # One persistent socket for the whole session
+        self.sock = None
+        self.l2 = None
+        if backend == "raw":
+            try:
+                self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+                self.sock.bind((iface, 0))
+            except (AttributeError, OSError):
+                self.sock = None
+        if self.sock is None:
+            # scapy is only imported when it is actually used
+            from scapy.config import conf
+            from scapy.layers.l2 import Ether
+            self.l2 = conf.L2socket(iface=iface)
+            self.ether = Ether
+
+    def send(self, regs: list):
+        frame = self.header + self.pack(*regs)
+        if self.sock is not None:
+            self.sock.send(frame)
+        else:
+            self.l2.send(self.ether(frame))
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        else:
+            self.l2.close()
 
-            # advance time and sleep until next packet
-            t += 250 / 48000
-            time.sleep(250 / 48000)
-        return
 
-    # Handle ethernet transactions
+def scapy_handler(targets: dict):
+    # Fallback ingest: one decoded frame per call, routed by source MAC bytes to a (buf, stats) pair
+    decoder = FrameDecoder(1)
+
     def handle_packet(pkt):
-        if pkt.haslayer("Ethernet") and pkt.type == ETHERTYPE:
-            if pkt.src.lower() != SRC_MAC.lower():
-                return
-
-            payload = bytes(pkt.payload)
-            n = len(payload) // 6
-            data = np.frombuffer(payload[6:n * 6], dtype=np.uint8).reshape(-1, 6)
-
-            left = (data[:, 0].astype(np.int32) << 16) | (data[:, 1].astype(np.int32) << 8) | data[:, 2].astype(
-                np.int32)
-            left = (left ^ (1 << 23)) - (1 << 23)
-
-            right = (data[:, 3].astype(np.int32) << 16) | (data[:, 4].astype(np.int32) << 8) | data[:, 5].astype(
-                np.int32)
-            right = (right ^ (1 << 23)) - (1 << 23)
-
-            buf_left.write(left)
-            buf_right.write(right)
-
-    # sniff(iface="Ethernet", prn=handle_packet, store=False)
-    # Start sniffer in the background so it doesn't block the sender
-    sniffer = AsyncSniffer(
-        iface="Ethernet",
-        prn=handle_packet,
-        store=False,
-        lfilter=lambda p: p.haslayer(Ether) and p[Ether].type == ETHERTYPE
-    )
-    sniffer.start()
-
-    # Main loop for sending reg_block updates
-    while not shutdown_evt.is_set():
-        payload = b"".join(x.to_bytes(4, "big") for x in reg_block.dump())
-
-        eth = Ether(src=DST_MAC, dst=SRC_MAC, type=ETHERTYPE)
-        sendp(eth / payload, iface="Ethernet", verbose=False)
-
-        time.sleep(SEND_INTERVAL_MS / 1000.0)  # slight yield for CPU
+        target = targets.get(bytes.fromhex(pkt.src.replace(":", "")))
+        if target is None:
+            return
+
+        buf, stats = target
+        start = time.perf_counter()
+        payload = np.frombuffer(bytes(pkt.payload), dtype=np.uint8).reshape(1, -1)
+        lengths = np.array([payload.shape[1]])
+        samples = decoder.decode(payload, lengths, 1, 0, buf)
+        if stats is not None:
+            stats.record(payload, lengths, 1, 0, np.array([float(pkt.time)]), time.perf_counter() - start,
+                         samples)
+    return handle_packet
+
+
+def producer_thread(buf: StereoRingBuffer, reg_block: RegBlock, en_debug: bool, shutdown_evt: threading.Event,
+                    backend: str = "raw", stats: StreamStats = None, replay: dict = None):
+    # Generate a DBG_FREQ sine wave
+    if en_debug:
+        # One table covering a whole number of both sine periods and packets, computed once
+        period = 48000 // math.gcd(48000, DBG_FREQ)
+        table_len = period * 250 // math.gcd(period, 250)
+        phase = (2 * np.pi * DBG_FREQ / 48000) * np.arange(table_len)
+        left = np.round(np.sin(phase) * (2 ** 22 - 1)).astype(np.int32)
+        table = np.column_stack((left, -left))
+
+        # Paced against the start time, so sleep overshoot does not accumulate into drift
+        start = time.monotonic()
+        sent = 0
+        while not shutdown_evt.is_set():
+            pos = sent % table_len
+            buf.write(table[pos:pos + 250])
+            sent += 250
+            time.sleep(max(start + sent / 48000 - time.monotonic(), 0.0))
+        return
+
+    # Prefer the raw socket backend, fall back to scapy where it is not available
+    receiver = None
+    if backend == "replay":
+        # Recorded frames through the same decode path as the raw socket
+        from replay import ReplayReceiver
+        receiver = ReplayReceiver(**replay)
+    elif backend == "raw":
+        try:
+            receiver = RawReceiver(IFACE, SRC_MAC)
+        except (AttributeError, OSError) as e:
+            print(f"Raw socket ingest unavailable ({e}), falling back to scapy", file=sys.stderr)
+
+    if receiver is not None:
+        ingest_th = threading.Thread(target=raw_ingest_thread,
+                                     args=(receiver, buf, shutdown_evt, stats),
+                                     daemon=True)
+        ingest_th.start()
+        if backend == "replay":
+            # No board to send registers to
+            shutdown_evt.wait()
+            return
+    else:
+        from scapy.layers.l2 import Ether
+        from scapy.sendrecv import AsyncSniffer
+
+        # Start sniffer in the background so it doesn't block the sender
+        sniffer = AsyncSniffer(
+            iface=IFACE,
+            prn=scapy_handler({bytes.fromhex(SRC_MAC.replace(":", "")): (buf, stats)}),
+            store=False,
+            lfilter=lambda p: p.haslayer(Ether) and p[Ether].type == ETHERTYPE
+        )
+        sniffer.start()
+
+    sender = RegSender(IFACE, SRC_MAC, DST_MAC, backend)
+    register_sender_loop(sender, reg_block, shutdown_evt)
+
+
+def register_sender_loop(sender: RegSender, reg_block: RegBlock, shutdown_evt: threading.Event):
+    # Sends reg_block updates: right after a change, otherwise as a keepalive
+    sent_gen = None
+    last_sent = 0.0
+    try:
+        while not shutdown_evt.is_set():
+            gen = reg_block.wait_changed(sent_gen, timeout=0.1)
+            if gen != sent_gen:
+                # Let a burst of slider events settle into one frame
+                time.sleep(COALESCE_MS / 1000.0)
+            elif time.monotonic() - last_sent < KEEPALIVE_MS / 1000.0:
+                continue
+
+            sent_gen, regs = reg_block.snapshot()
+            sender.send(regs)
+            last_sent = time.monotonic()
+    finally:
+        sender.close()
+
@@ -0,0 +1,196 @@
+import time
+import threading
+import numpy as np
+
+from buffer import RingBuffer
+from spectrum import StftEngine, WelchEstimator, LogBinner, Waterfall
+from trigger import EdgeTrigger
+from measure import MeasurementEngine
+
+MAX_FRAME_AGE_MS = 100
+LOG_F_MIN = 20.0  # lowest frequency of the log and octave displays
+
+
+class PlotFrame:
+    def __init__(self, stamp: float, t_axis: np.ndarray, trace: np.ndarray, f_axis: np.ndarray,
+                 spectrum_db: np.ndarray, triggered: bool = False, waterfall: np.ndarray = None):
+        self.stamp = stamp
+        self.triggered = triggered  # trace is aligned on a trigger, t = 0 at the trigger point
+        self.t_axis = t_axis
+        self.trace = trace  # (points, channels), % of full scale
+        self.f_axis = f_axis  # Hz, log10(Hz) band centers in the log and octave modes
+        self.spectrum_db = spectrum_db  # (bins, channels), dBFS, None until the first segment
+        self.waterfall = waterfall  # (channels, columns, bands) colormap indices, None without new columns
+
+
+class PlotWorker(threading.Thread):
+    def __init__(self, buf: RingBuffer, stft: StftEngine, welch: WelchEstimator, fps: float,
+                 trigger: EdgeTrigger = None, measure: MeasurementEngine = None, waterfall: Waterfall = None):
+        super().__init__(daemon=True)
+        self.buf = buf
+        self.stft = stft
+        self.welch = welch
+        self.trigger = trigger
+        self.measure = measure
+        self.waterfall = waterfall
+        self.period = 1.0 / fps
+
+        # Settings written by the GUI thread, applied by the worker at the start of each frame
+        self._settings_lock = threading.Lock()
+        self._settings = {"time_step": 0.0, "width": 1, "max_hold": False, "average": welch.k,
+                          "end": None, "freq_scale": "linear", "octave_fraction": 3, "trigger": None,
+                          "pre_trigger": 0.5, "measure": False,
+                          "waterfall": False}
+
+        # Latest finished frame, the GUI takes it or it gets replaced by a newer one
+        self._frame_lock = threading.Lock()
+        self._frame = None
+        self.dropped = 0
+
+        self._wake = threading.Event()
+        self._shutdown = threading.Event()
+
+        # Cached time axis: (time_step, points, paired, t_end) -> ndarray
+        self._t_axis_key = None
+        self._t_axis = None
+
+        # Cached band index map: (freq_scale, bins, width or fraction) -> LogBinner
+        self._binner_key = None
+        self._binner = None
+
+    def configure(self, **settings):
+        with self._settings_lock:
+            self._settings.update(settings)
+
+    def take(self) -> PlotFrame:
+        with self._frame_lock:
+            frame, self._frame = self._frame, None
+
+        # Frames that waited too long are dropped so the display never lags behind
+        if frame is not None and (time.perf_counter() - frame.stamp) * 1000 > MAX_FRAME_AGE_MS:
+            self.dropped += 1
+            return None
+        return frame
+
+    def stop(self):
+        self._shutdown.set()
+        self._wake.set()
+
+    def run(self):
+        while not self._shutdown.is_set():
+            start = time.perf_counter()
+            frame = self.compute()
+
+            if frame is not None:
+                with self._frame_lock:
+                    if self._frame is not None:
+                        self.dropped += 1
+                        # The waterfall image is cumulative, an unshown one still replaces the GUI's
+                        if frame.waterfall is None:
+                            frame.waterfall = self._frame.waterfall
+                    self._frame = frame
+
+            # No backlog: if a frame took longer than the period, start the next one right away
+            self._wake.wait(max(self.period - (time.perf_counter() - start), 0.0))
+            self._wake.clear()
+
+    def compute(self) -> PlotFrame:
+        with self._settings_lock:
+            settings = dict(self._settings)
+            trigger_settings, self._settings["trigger"] = self._settings["trigger"], None
+
+        stamp = time.perf_counter()
+        if settings["average"] != self.welch.k:
+            self.welch.set_average(settings["average"])
+
+        # Time traces
+        window_samples = int(settings["time_step"] * 48000)
+        scale = 100 / 2 ** 23
+
+        # Scrolled back into history: keep the window inside what the ring still holds
+        end = settings["end"]
+        if end is not None:
+            end = min(max(end, self.buf.oldest + window_samples), self.buf.seq)
+
+        # Live view with a trigger: the window is placed around the latest trigger instead of the newest sample
+        t_end = 0.0
+        triggered = False
+        if self.trigger is not None:
+            if trigger_settings is not None:
+                self.trigger.configure(**trigger_settings)
+            if end is None:
+                end = self.trigger.window_end(window_samples, settings["pre_trigger"])
+                triggered = end is not None
+                if triggered:
+                    t_end = (window_samples - int(window_samples * settings["pre_trigger"])) / 48000
+
+        # Long windows are drawn as a min/max envelope about one pair per pixel wide,
+        # so the cost does not depend on the time step
+        env = self.buf.read_envelope(window_samples, max(settings["width"], 1), end=end)
+
+        # Both channels come from the same snapshot
+        if env is None:
+            src = self.buf.view(window_samples, end)
+            if src is None:
+                src = self.buf.read(window_samples, end)
+                if not len(src) and window_samples:
+                    # Lapped by the producer while reading, nothing to show this frame
+                    return None
+            trace = src.astype(np.float32)
+            trace *= scale
+        else:
+            env_min, env_max, _ = env
+            trace = np.empty((2 * len(env_min),) + env_min.shape[1:], dtype=np.float32)
+            np.multiply(env_min, scale, out=trace[0::2], casting="unsafe")
+            np.multiply(env_max, scale, out=trace[1::2], casting="unsafe")
+        t_axis = self._get_t_axis(settings["time_step"], len(trace), env is not None, t_end)
+
+        # Average / max hold of the power spectrum over the last K segments, converted to dBFS
+        self.welch.update()
+        P = self.welch.max() if settings["max_hold"] else self.welch.mean()
+
+        # Rate limited by the engine, results are read through its snapshot()
+        if self.measure is not None and settings["measure"]:
+            self.measure.update()
+
+        # Only the STFT frames since the last frame are colormapped, the GUI gets a copy when there are any
+        waterfall = None
+        if self.waterfall is not None and settings["waterfall"] and self.waterfall.update():
+            waterfall = self.waterfall.snapshot()
+
+        # Log modes draw a few hundred peak-held bands instead of every bin, and take the log of those only
+        f_axis = self.stft.freqs
+        binner = self._get_binner(settings["freq_scale"], settings["width"], settings["octave_fraction"])
+        if binner is not None:
+            f_axis = binner.log_freqs
+            if P is not None:
+                P = binner.reduce(P)
+        spectrum_db = None if P is None else (10.0 * np.log10(P + 1e-30)).astype(np.float32)
+
+        return PlotFrame(stamp, t_axis, trace, f_axis, spectrum_db, triggered, waterfall)
+
+    def _get_binner(self, freq_scale: str, width: int, fraction: int) -> LogBinner:
+        if freq_scale == "linear":
+            return None
+        freqs = self.stft.freqs
+        key = (freq_scale, len(freqs), width if freq_scale == "log" else fraction)
+        if key != self._binner_key:
+            if freq_scale == "log":
+                # About one band per pixel of plot width
+                self._binner = LogBinner(freqs, max(width, 16), LOG_F_MIN, freqs[-1])
+            else:
+                self._binner = LogBinner.octaves(freqs, fraction, LOG_F_MIN, freqs[-1])
+            self._binner_key = key
+        return self._binner
+
+    def _get_t_axis(self, time_step: float, points: int, paired: bool, t_end: float = 0.0) -> np.ndarray:
+        key = (time_step, points, paired, t_end)
+        if key != self._t_axis_key:
+            if paired:
+                # Envelope min/max pairs share one time stamp
+                t = np.linspace(t_end - time_step, t_end, points // 2, dtype=np.float32)
+                self._t_axis = np.repeat(t, 2)
+            else:
+                self._t_axis = np.linspace(t_end - time_step, t_end, points, dtype=np.float32)
+            self._t_axis_key = key
+        return self._t_axis
@@ -0,0 +1,255 @@
+import sys
+import time
+import wave
+import struct
+import argparse
+import threading
+import numpy as np
+
+from buffer import StereoRingBuffer
+from network import raw_ingest_thread, StreamStats, ETHERTYPE, SRC_MAC, DST_MAC, ETH_HEADER_LEN, FRAME_HEAD, \
+    RAW_BATCH, RAW_FRAME_SIZE, RAW_POLL_MS, SAMPLE_RATE
+
+REPLAY_SLOTS = 250  # 6-byte slots per synthesized frame, a full 1514-byte frame like the FPGA sends
+REPLAY_SAMPLES = REPLAY_SLOTS - 1  # slot 0 is FRAME_HEAD
+REPLAY_READ_FRAMES = 256  # frames synthesized per read from a sample capture
+
+PCAP_LINKTYPE_ETHERNET = 1
+
+
+def read_pcap(f) -> iter:
+    # Classic libpcap, either byte order, micro- or nanosecond timestamps
+    magic = f.read(4)
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        endian = "<"
+    elif magic in (b"\xa1\xb2\xc3\xd4", b"\xa1\xb2\x3c\x4d"):
+        endian = ">"
+    else:
+        raise ValueError("not a pcap file")
+    scale = 1e-9 if magic in (b"\x4d\x3c\xb2\xa1", b"\xa1\xb2\x3c\x4d") else 1e-6
+
+    _, _, _, _, _, linktype = struct.unpack(endian + "HHiIII", f.read(20))
+    if linktype != PCAP_LINKTYPE_ETHERNET:
+        raise ValueError(f"unsupported pcap link type {linktype}")
+
+    header = struct.Struct(endian + "IIII")
+    while True:
+        raw = f.read(header.size)
+        if len(raw) < header.size:
+            return
+        sec, frac, incl_len, _ = header.unpack(raw)
+        data = f.read(incl_len)
+        if len(data) < incl_len:
+            return
+        yield sec + frac * scale, data
+
+
+def read_pcapng(f) -> iter:
+    # Section header, interface description and enhanced packet blocks, everything else is skipped
+    endian = "<"
+    resolutions = []
+    while True:
+        head = f.read(8)
+        if len(head) < 8:
+            return
+        if head[:4] == b"\x0a\x0d\x0d\x0a":
+            bom = f.read(4)
+            endian = "<" if bom == b"\x4d\x3c\x2b\x1a" else ">"
+            block_type, length = 0x0A0D0D0A, struct.unpack(endian + "I", head[4:])[0]
+            body = bom + f.read(length - 12)
+            resolutions = []
+        else:
+            block_type, length = struct.unpack(endian + "II", head)
+            body = f.read(length - 8)
+        body = body[:-4]  # trailing length copy
+
+        if block_type == 1:
+            linktype = struct.unpack(endian + "H", body[:2])[0]
+            resolutions.append(_pcapng_resolution(body[8:], endian) if linktype == PCAP_LINKTYPE_ETHERNET else None)
+        elif block_type == 6:
+            iface, ts_high, ts_low, cap_len, _ = struct.unpack(endian + "IIIII", body[:20])
+            if iface < len(resolutions) and resolutions[iface] is not None:
+                yield ((ts_high << 32) | ts_low) * resolutions[iface], body[20:20 + cap_len]
+
+
+def _pcapng_resolution(options: bytes, endian: str) -> float:
+    # if_tsresol option, microseconds when absent
+    pos = 0
+    while pos + 4 <= len(options):
+        code, length = struct.unpack(endian + "HH", options[pos:pos + 4])
+        if code == 0:
+            break
+        if code == 9 and length == 1:
+            v = options[pos + 4]
+            return 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0 ** -v
+        pos += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def read_samples(path: str) -> iter:
+    # Capture files from capture.py: 24 bit WAV or interleaved int32 raw, as (n, 2) int32 blocks
+    n = REPLAY_READ_FRAMES * REPLAY_SAMPLES
+    if path.endswith(".wav"):
+        with wave.open(path, "rb") as w:
+            if w.getsampwidth() != 3 or w.getnchannels() != 2:
+                raise ValueError("expected a 24 bit stereo WAV")
+            while True:
+                data = np.frombuffer(w.readframes(n), dtype=np.uint8).reshape(-1, 2, 3)
+                if not len(data):
+                    return
+                v = data[..., 0].astype(np.int32) | (data[..., 1].astype(np.int32) << 8) | \
+                    (data[..., 2].astype(np.int32) << 16)
+                yield (v ^ (1 << 23)) - (1 << 23)
+    else:
+        with open(path, "rb") as f:
+            while True:
+                data = np.frombuffer(f.read(n * 8), dtype="<i4")
+                if not len(data):
+                    return
+                yield data[:len(data) // 2 * 2].reshape(-1, 2)
+
+
+def frames_from_samples(path: str) -> iter:
+    # Rebuilds the FPGA's frames from decoded samples: slot 0 holds the constant FRAME_HEAD like on
+    # the board, the decoder skips it, so every recorded sample comes back on replay
+    header = bytes.fromhex(DST_MAC.replace(":", "")) + bytes.fromhex(SRC_MAC.replace(":", "")) + \
+        struct.pack(">H", ETHERTYPE) + FRAME_HEAD
+    t = 0.0
+    for block in read_samples(path):
+        for i in range(0, len(block), REPLAY_SAMPLES):
+            s = block[i:i + REPLAY_SAMPLES]
+            yield t, header + s.astype(">i4").view(np.uint8).reshape(-1, 2, 4)[..., 1:].tobytes()
+            t += len(s) / SAMPLE_RATE
+
+
+def open_frames(path: str) -> iter:
+    # (timestamp, frame bytes) from a pcap / pcapng recording or a capture.py sample file
+    if path.endswith((".wav", ".raw")):
+        yield from frames_from_samples(path)
+        return
+
+    with open(path, "rb") as f:
+        magic = f.read(4)
+        f.seek(0)
+        yield from (read_pcapng(f) if magic == b"\x0a\x0d\x0d\x0a" else read_pcap(f))
+
+
+class ReplayReceiver:
+    # Drop-in for RawReceiver: recorded frames come out of recv_batch() at their recorded pace
+    # scaled by speed, or as fast as the consumer takes them with speed 0
+    def __init__(self, path: str, speed: float = 1.0, loop: bool = False, src_mac=SRC_MAC,
+                 batch: int = RAW_BATCH):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.done = False
+
+        self.frames = np.zeros((batch, RAW_FRAME_SIZE), dtype=np.uint8)
+        self.lengths = np.zeros(batch, dtype=np.int64)
+        self.arrivals = np.zeros(batch, dtype=np.float64)
+
+        # Same match the socket filter does, one MAC or a list of them
+        macs = [src_mac] if isinstance(src_mac, str) else src_mac
+        self._match = {bytes.fromhex(m.replace(":", "")) for m in macs}, struct.pack(">H", ETHERTYPE)
+        self._source = open_frames(path)
+        self._pending = None
+
+        # Recording time -> wall clock, shifted forward on every loop
+        self._ts0 = None
+        self._wall0 = None
+        self._ts_shift = 0.0
+        self._last_ts = 0.0
+        self._first_ts = None
+
+    def _peek(self):
+        while self._pending is None:
+            item = next(self._source, None)
+            if item is None:
+                if not self.loop or self._first_ts is None:
+                    return None
+                # Next pass continues one nominal frame period after the last frame
+                self._ts_shift += self._last_ts - self._first_ts + REPLAY_SAMPLES / SAMPLE_RATE
+                self._source = open_frames(self.path)
+                continue
+
+            ts, data = item
+            if len(data) <= ETH_HEADER_LEN or data[6:12] not in self._match[0] or data[12:14] != self._match[1]:
+                continue
+            if self._first_ts is None:
+                self._first_ts = ts
+            self._last_ts = ts
+            self._pending = ts + self._ts_shift, data[:RAW_FRAME_SIZE]
+        return self._pending
+
+    def recv_batch(self, timeout_ms: int = RAW_POLL_MS) -> int:
+        count = 0
+        while count < len(self.lengths):
+            item = self._peek()
+            if item is None:
+                if count == 0:
+                    self.done = True
+                    time.sleep(timeout_ms / 1000)
+                break
+
+            ts, data = item
+            now = time.time()
+            arrival = now
+            if self.speed > 0:
+                if self._ts0 is None:
+                    self._ts0, self._wall0 = ts, now
+                arrival = self._wall0 + (ts - self._ts0) / self.speed
+
+                # Frames that are due go out together, like a socket drained after a wakeup
+                wait = arrival - now
+                if wait > 0:
+                    if count:
+                        break
+                    if wait > timeout_ms / 1000:
+                        time.sleep(timeout_ms / 1000)
+                        return 0
+                    time.sleep(wait)
+
+            self.frames[count, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+            self.lengths[count] = len(data)
+            self.arrivals[count] = arrival
+            self._pending = None
+            count += 1
+        return count
+
+    def kernel_drops(self) -> int:
+        return 0
+
+    def close(self):
+        self._source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the ingest path and report throughput")
+    parser.add_argument("path", help="pcap / pcapng recording, or a .wav / .raw file from capture.py")
+    parser.add_argument("--speed", type=float, default=0, help="1 for real time, N for N times faster, 0 for max")
+    parser.add_argument("--loop", type=float, default=0, metavar="SECONDS", help="loop the file for this long")
+    args = parser.parse_args()
+
+    buf = StereoRingBuffer(5 * SAMPLE_RATE, spsc=True, envelope_levels=5)
+    stats = StreamStats()
+    receiver = ReplayReceiver(args.path, args.speed, loop=args.loop > 0)
+
+    shutdown_evt = threading.Event()
+    ingest_th = threading.Thread(target=raw_ingest_thread, args=(receiver, buf, shutdown_evt, stats), daemon=True)
+    start = time.perf_counter()
+    ingest_th.start()
+    while not receiver.done and not (args.loop and time.perf_counter() - start > args.loop):
+        time.sleep(0.05)
+    shutdown_evt.set()
+    ingest_th.join()
+    elapsed = time.perf_counter() - start
+
+    s = stats.snapshot()
+    print(f"{s['frames']} frames, {s['samples']} samples in {elapsed:.2f} s: "
+          f"{s['frames'] / elapsed:.0f} frames/s, {s['samples'] / elapsed / SAMPLE_RATE:.1f}x real time, "
+          f"decode {s['decode_mean'] * 1e6:.1f} us/frame (max {s['decode_max'] * 1e6:.1f} us)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
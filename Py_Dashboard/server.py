@@ -0,0 +1,364 @@
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import itertools
+import threading
+import collections
+import numpy as np
+
+from buffer import RingBuffer, RegBlock
+from spectrum import StftEngine, LogBinner
+from network import StreamStats, IFACE
+from devices import DeviceRegistry
+
+API_HOST = "127.0.0.1"
+API_PORT = 5025
+CLIENT_QUEUE = 8  # messages buffered per client, the oldest is dropped when a client falls behind
+MAX_REQUEST = 1 << 16
+MAX_RATE = 60.0
+LOG_F_MIN = 20.0
+
+# Framing: every message is a little-endian (type u8, length u32) header and `length` payload bytes
+HEADER = struct.Struct("<BI")
+MSG_JSON = 1  # requests, replies, stats and errors, UTF-8 JSON
+MSG_TRACE = 2  # TRACE_HEADER, then int32 (points, 2, channels): min and max of every point
+MSG_SPECTRUM = 3  # SPECTRUM_HEADER, then float32 (bins, channels) in dBFS
+
+# Subscription id, end sample position, points / bins, channels
+TRACE_HEADER = struct.Struct("<Hqii")
+SPECTRUM_HEADER = struct.Struct("<Hqii")
+
+
+def pack(kind: int, payload: bytes) -> bytes:
+    return HEADER.pack(kind, len(payload)) + payload
+
+
+def pack_json(obj) -> bytes:
+    # numpy arrays and scalars (the jitter histogram, register values) go out as plain lists / numbers
+    return pack(MSG_JSON, json.dumps(obj, separators=(",", ":"), default=lambda o: o.tolist()).encode())
+
+
+def decimate(lo: np.ndarray, hi: np.ndarray, points: int) -> tuple[np.ndarray, np.ndarray]:
+    # Min/max of `points` near-equal groups, peaks survive any decimation
+    if len(lo) <= points:
+        return lo, hi
+    idx = (np.arange(points) * len(lo)) // points
+    return np.minimum.reduceat(lo, idx), np.maximum.reduceat(hi, idx)
+
+
+class ClientQueue:
+    # Bounded outbox: put() never blocks the publishers, a full queue drops its oldest message
+    def __init__(self, size: int = CLIENT_QUEUE):
+        self._items = collections.deque(maxlen=size)
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def put(self, item: bytes):
+        if len(self._items) == self._items.maxlen:
+            self.dropped += 1
+        self._items.append(item)
+        self._ready.set()
+
+    async def get(self) -> bytes:
+        while not self._items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._items.popleft()
+
+
+class ApiServer:
+    # Register access and decimated trace / spectrum / stats subscriptions for remote clients, on an
+    # asyncio loop in its own thread. It only reads the ring buffer, so clients can never stall ingest.
+    # With a registry, requests pick a board by "mac" (and "iface"), the one given here is the default
+    def __init__(self, buf: RingBuffer, reg_block: RegBlock, stats: StreamStats = None, host: str = API_HOST,
+                 port: int = API_PORT, devices: DeviceRegistry = None):
+        self.buf = buf
+        self.reg_block = reg_block
+        self.stats = stats
+        self.devices = devices
+        self.host = host
+        self.port = port
+        self.clients = 0
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._started = threading.Event()
+
+        # Shared between clients: one STFT per (board, FFT size), one band map per (FFT size, bands)
+        self._stft = {}
+        self._binners = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=1.0)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._serve, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        queue = ClientQueue()
+        subscriptions = {}
+        ids = itertools.count(1)
+        sender = asyncio.ensure_future(self._send(queue, writer))
+        try:
+            while True:
+                kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+                if length > MAX_REQUEST:
+                    break
+                payload = await reader.readexactly(length)
+                if kind != MSG_JSON:
+                    continue
+                request = {}
+                try:
+                    request = json.loads(payload)
+                    reply = self._handle(request, queue, subscriptions, ids)
+                except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                reply["id"] = request.get("id") if isinstance(request, dict) else None
+                queue.put(pack_json(reply))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Cancelled on shutdown: finishing normally keeps asyncio's stream callback quiet
+            pass
+        finally:
+            for task in subscriptions.values():
+                task.cancel()
+            sender.cancel()
+            writer.close()
+            self.clients -= 1
+
+    async def _send(self, queue: ClientQueue, writer: asyncio.StreamWriter):
+        # One writer per client: a slow socket only backs up its own queue
+        try:
+            while True:
+                writer.write(await queue.get())
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    def _board(self, request: dict) -> tuple:
+        # (buf, reg_block, stats) of the board the request names, the default board if it names none
+        if "mac" not in request:
+            return self.buf, self.reg_block, self.stats
+        device = self.devices.get(request["mac"], request.get("iface", IFACE)) if self.devices else None
+        if device is None:
+            raise ValueError(f"unknown board {request['mac']}")
+        return device.buf, device.reg_block, device.stats
+
+    def _handle(self, request: dict, queue: ClientQueue, subscriptions: dict, ids) -> dict:
+        op = request["op"]
+        if op == "devices":
+            boards = self.devices if self.devices is not None else []
+            return {"devices": [{"mac": d.mac, "iface": d.iface, "name": d.name} for d in boards]}
+        buf, reg_block, stats = self._board(request)
+        if op == "get":
+            return {"value": reg_block.get(request["name"])}
+        if op == "set":
+            reg_block.set(request["name"], int(request["value"]))
+            return {"value": reg_block.get(request["name"])}
+        if op == "dump":
+            names = sorted(reg_block.names, key=reg_block.names.get)
+            return {"regs": dict(zip(names, reg_block.dump()))}
+        if op == "unsubscribe":
+            task = subscriptions.pop(request["sub"], None)
+            if task is not None:
+                task.cancel()
+            return {"sub": request["sub"]}
+        if op == "subscribe":
+            sub = next(ids)
+            rate = min(max(float(request.get("rate", 10)), 0.1), MAX_RATE)
+            topic = request["topic"]
+            if topic == "trace":
+                seconds = float(request.get("seconds", 0.1))
+                points = max(int(request.get("points", 500)), 1)
+                publisher = self._publish_trace(queue, sub, rate, buf, seconds, points)
+                reply = {"sub": sub}
+            elif topic == "spectrum":
+                n_fft = int(request.get("n_fft", 4096))
+                bands = int(request.get("bands", 0))
+                stft = self._get_stft(buf, n_fft)
+                binner = self._get_binner(stft, bands) if bands else None
+                freqs = stft.freqs if binner is None else binner.freqs
+                publisher = self._publish_spectrum(queue, sub, rate, stft, binner)
+                reply = {"sub": sub, "freqs": freqs.tolist()}
+            elif topic == "stats":
+                if stats is None:
+                    raise ValueError("no stream statistics on this server")
+                publisher = self._publish_stats(queue, sub, rate, stats)
+                reply = {"sub": sub}
+            else:
+                raise ValueError(f"unknown topic {topic}")
+            subscriptions[sub] = asyncio.ensure_future(publisher)
+            return reply
+        raise ValueError(f"unknown op {op}")
+
+    def _get_stft(self, buf: RingBuffer, n_fft: int) -> StftEngine:
+        key = (buf, n_fft)
+        if key not in self._stft:
+            if n_fft < 16 or n_fft > buf.size or n_fft & (n_fft - 1):
+                raise ValueError("n_fft must be a power of two that fits the ring buffer")
+            self._stft[key] = StftEngine(buf, n_fft, overlap=0.5, depth=4)
+        return self._stft[key]
+
+    def _get_binner(self, stft: StftEngine, bands: int) -> LogBinner:
+        key = (stft.n_fft, bands)
+        if key not in self._binners:
+            self._binners[key] = LogBinner(stft.freqs, bands, LOG_F_MIN, stft.freqs[-1])
+        return self._binners[key]
+
+    async def _publish_trace(self, queue: ClientQueue, sub: int, rate: float, buf: RingBuffer, seconds: float,
+                             points: int):
+        n = min(int(seconds * 48000), buf.size)
+        while True:
+            end = buf.seq
+            env = buf.read_envelope(n, points, end=end)
+            if env is None:
+                raw = buf.read(n, end)
+                lo, hi = decimate(raw, raw, points)
+            else:
+                lo, hi = decimate(env[0], env[1], points)
+            data = np.stack((lo, hi), axis=1).astype("<i4")
+            channels = data.shape[2] if data.ndim == 3 else 1
+            queue.put(pack(MSG_TRACE, TRACE_HEADER.pack(sub, end, len(data), channels) + data.tobytes()))
+            await asyncio.sleep(1.0 / rate)
+
+    async def _publish_spectrum(self, queue: ClientQueue, sub: int, rate: float, stft: StftEngine,
+                                binner: LogBinner):
+        # The FFTs run on the loop's executor, the loop itself only moves bytes
+        loop = asyncio.get_running_loop()
+        last = 0
+        while True:
+            msg, last = await loop.run_in_executor(None, self._spectrum_frame, sub, stft, binner, last)
+            if msg is not None:
+                queue.put(msg)
+            await asyncio.sleep(1.0 / rate)
+
+    def _spectrum_frame(self, sub: int, stft: StftEngine, binner: LogBinner, last: int) -> tuple:
+        # Newest frame as a MSG_SPECTRUM message, or None if nothing new since frame count `last`
+        stft.update()
+        X, ends, count = stft.poll(last)
+        if not len(X):
+            return None, last
+        p = X[-1].real.astype(np.float32) ** 2 + X[-1].imag.astype(np.float32) ** 2
+        if binner is not None:
+            p = binner.reduce(p)
+        db = (10.0 * np.log10(p / (2 ** 23 * stft.n_fft) ** 2 + 1e-30)).astype("<f4")
+        channels = db.shape[1] if db.ndim == 2 else 1
+        return pack(MSG_SPECTRUM, SPECTRUM_HEADER.pack(sub, int(ends[-1]), len(db), channels) + db.tobytes()), count
+
+    async def _publish_stats(self, queue: ClientQueue, sub: int, rate: float, stats: StreamStats):
+        while True:
+            queue.put(pack_json({"sub": sub, "stats": stats.snapshot(), "dropped": queue.dropped}))
+            await asyncio.sleep(1.0 / rate)
+
+
+class ApiClient:
+    # Blocking client for scripts: call() for requests, recv() for everything the server pushes
+    def __init__(self, host: str = API_HOST, port: int = API_PORT, timeout: float = 5.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self._next_id = 0
+        self._pending = collections.deque()
+
+    def close(self):
+        self.sock.close()
+
+    def call(self, op: str, **params) -> dict:
+        # Pushed messages that arrive before the reply are kept for recv()
+        self._next_id += 1
+        payload = json.dumps(dict(params, op=op, id=self._next_id)).encode()
+        self.sock.sendall(pack(MSG_JSON, payload))
+        while True:
+            message = self._read()
+            if message[0] == MSG_JSON and message[1].get("id") == self._next_id:
+                if "error" in message[1]:
+                    raise RuntimeError(message[1]["error"])
+                return message[1]
+            self._pending.append(message)
+
+    def recv(self) -> tuple:
+        # (MSG_JSON, dict) or (MSG_TRACE / MSG_SPECTRUM, sub, end, array)
+        return self._pending.popleft() if self._pending else self._read()
+
+    def _read(self) -> tuple:
+        kind, length = HEADER.unpack(self._exact(HEADER.size))
+        payload = self._exact(length)
+        if kind == MSG_JSON:
+            return kind, json.loads(payload)
+        if kind == MSG_TRACE:
+            sub, end, points, channels = TRACE_HEADER.unpack_from(payload)
+            data = np.frombuffer(payload, dtype="<i4", offset=TRACE_HEADER.size).reshape(points, 2, channels)
+            return kind, sub, end, data
+        sub, end, bins, channels = SPECTRUM_HEADER.unpack_from(payload)
+        data = np.frombuffer(payload, dtype="<f4", offset=SPECTRUM_HEADER.size).reshape(bins, channels)
+        return kind, sub, end, data
+
+    def _exact(self, n: int) -> bytes:
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            data += chunk
+        return bytes(data)
+
+
+def main():
+    # Headless: ingest and the API server without the dashboard
+    from buffer import StereoRingBuffer
+    from network import producer_thread
+
+    parser = argparse.ArgumentParser(description="Serve the FPGA stream and registers to remote clients")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--backend", choices=("raw", "scapy"), default="raw")
+    parser.add_argument("--debug", action="store_true", help="serve the generated test sine instead")
+    args = parser.parse_args()
+
+    buf = StereoRingBuffer(5 * 48000, spsc=True, envelope_levels=5)
+    reg_block = RegBlock()
+    stats = StreamStats()
+    shutdown_evt = threading.Event()
+    eth_th = threading.Thread(target=producer_thread,
+                              args=(buf, reg_block, args.debug, shutdown_evt, args.backend, stats), daemon=True)
+    eth_th.start()
+
+    server = ApiServer(buf, reg_block, stats, args.host, args.port)
+    server.start()
+    print(f"Serving on {args.host}:{server.port}", flush=True)
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    shutdown_evt.set()
+    eth_th.join(timeout=1.0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import math
+import threading
+import numpy as np
+
+from buffer import RingBuffer
+
+SAMPLE_RATE = 48000
+STFT_DEPTH = 128
+
+
+class StftEngine:
+    def __init__(self, buf: RingBuffer, n_fft: int, overlap: float = 0.75, window: str = "hann",
+                 depth: int = STFT_DEPTH, dtype=np.float32):
+        self.buf = buf
+        self.n_fft = int(n_fft)
+        self.hop = max(int(round(self.n_fft * (1 - overlap))), 1)
+        self.depth = depth
+        self.lock = threading.Lock()
+
+        dtype = np.dtype(dtype)
+        channels = buf.buf.shape[1:]
+        self.freqs = np.fft.rfftfreq(self.n_fft, d=1.0 / SAMPLE_RATE)
+
+        # Window shaped to broadcast over (frames, n_fft, channels)
+        w = buf._get_window(self.n_fft, window).astype(dtype)
+        self._window = w.reshape((self.n_fft,) + (1,) * len(channels))
+
+        # Staging for the frames of one update, then one batched rfft over all of them
+        self._raw = np.zeros((depth, self.n_fft) + channels, dtype=buf.buf.dtype)
+        self._frames = np.zeros((depth, self.n_fft) + channels, dtype=dtype)
+
+        # Circular spectrum queue: frame i lives in slot i % depth and ends at sample ends[slot]
+        cdtype = np.complex64 if dtype == np.float32 else np.complex128
+        self.spectra = np.zeros((depth, len(self.freqs)) + channels, dtype=cdtype)
+        self.ends = np.zeros(depth, dtype=np.int64)
+        self.count = 0
+        self._first = 0  # oldest frame with a spectrum: the frames before a skip never got one
+        self._next_end = self.n_fft
+
+    def update(self) -> int:
+        # Computes one spectrum for every hop written since the last call, returns how many
+        with self.lock:
+            seq = self.buf.seq
+            if seq < self._next_end:
+                return 0
+
+            pending = (seq - self._next_end) // self.hop + 1
+
+            # Frames that no longer fit the queue or the ring are skipped, not computed
+            keep = min(pending, self.depth, (self.buf.size - self.n_fft) // self.hop + 1)
+            first_end = self._next_end + (pending - keep) * self.hop
+            self.count += pending - keep
+            if keep < pending:
+                self._first = self.count
+            self._next_end += pending * self.hop
+
+            for i in range(keep):
+                end = first_end + i * self.hop
+                self.ends[(self.count + i) % self.depth] = end
+                if self.buf.read_into(self._raw[i], self.n_fft, end=end) != self.n_fft:
+                    # Overwritten while we were catching up
+                    self._raw[i] = 0
+
+            np.multiply(self._raw[:keep], self._window, out=self._frames[:keep], casting="unsafe")
+            slots = (self.count + np.arange(keep)) % self.depth
+            self.spectra[slots] = np.fft.rfft(self._frames[:keep], axis=1)
+            self.count += keep
+            return keep
+
+    def get(self, start: int, stop: int = None) -> tuple[np.ndarray, np.ndarray]:
+        # Spectra and end positions of frames [start, stop), clipped to what is still queued
+        X, ends, _ = self.poll(start, stop)
+        return X, ends
+
+    def poll(self, start: int, stop: int = None) -> tuple[np.ndarray, np.ndarray, int]:
+        # Same as get(), plus the frame count it stopped at under the lock: consumers resume from
+        # there, so frames queued in between are neither lost nor taken twice
+        with self.lock:
+            stop = self.count if stop is None else min(stop, self.count)
+            start = max(start, stop - self.depth, self._first)
+            slots = np.arange(start, stop) % self.depth
+            return self.spectra[slots], self.ends[slots], stop
+
+    def latest(self, n: int = 1) -> np.ndarray:
+        self.update()
+        return self.get(self.count - n)[0]
+
+
+class WelchEstimator:
+    def __init__(self, stft: StftEngine, average: int, scale: float = 1.0):
+        self.stft = stft
+        self.scale = scale
+        self.set_average(average)
+
+    def set_average(self, average: int):
+        # Restarts from the most recent `average` segments already held by the STFT queue
+        self.k = max(1, min(int(average), self.stft.depth))
+        shape = (self.k,) + self.stft.spectra.shape[1:]
+
+        # Segment periodograms, running sum, and a block-wise sliding max:
+        # prefix max of the current block of k segments + suffix maxima of the previous one
+        self._P = np.zeros(shape, dtype=np.float64)
+        self._sum = np.zeros(shape[1:], dtype=np.float64)
+        self._prefix = np.zeros(shape[1:], dtype=np.float64)
+        self._suffix = np.zeros(shape, dtype=np.float64)
+        self._n = 0
+        self._consumed = self.stft.count - self.k
+
+    def update(self) -> int:
+        self.stft.update()
+        X, _, self._consumed = self.stft.poll(self._consumed)
+
+        if len(X) > self.k:
+            X = X[-self.k:]
+        P = (X.real.astype(np.float64) ** 2 + X.imag.astype(np.float64) ** 2) * self.scale
+
+        for p in P:
+            self._push(p)
+        return len(P)
+
+    def _push(self, p: np.ndarray):
+        j = self._n % self.k
+
+        if self._n >= self.k:
+            self._sum -= self._P[j]
+        self._P[j] = p
+        self._sum += p
+
+        if j == 0:
+            self._prefix[...] = p
+        else:
+            np.maximum(self._prefix, p, out=self._prefix)
+        self._n += 1
+
+        # Once per k segments: suffix maxima for the next block, and resync the sum against drift
+        if j == self.k - 1:
+            np.maximum.accumulate(self._P[::-1], axis=0, out=self._suffix[::-1])
+            np.sum(self._P, axis=0, out=self._sum)
+
+    def mean(self) -> np.ndarray:
+        if self._n == 0:
+            return None
+        return self._sum / min(self._n, self.k)
+
+    def max(self) -> np.ndarray:
+        if self._n == 0:
+            return None
+
+        # Window = tail of the previous block (suffix) + head of the current one (prefix)
+        j = (self._n - 1) % self.k
+        if j == self.k - 1:
+            return self._prefix.copy()
+        return np.maximum(self._prefix, self._suffix[j + 1])
+
+
+class LogBinner:
+    def __init__(self, freqs: np.ndarray, bands: int, f_min: float, f_max: float):
+        # Log-spaced bands over the linear FFT bins as a precomputed index map. Every band is the max
+        # of its bins so narrow peaks survive; bands narrower than a bin repeat the bin above them
+        edges = np.geomspace(f_min, f_max, bands + 1)
+        self.freqs = np.sqrt(edges[:-1] * edges[1:])
+        self.log_freqs = np.log10(self.freqs).astype(np.float32)
+        self.edges = edges
+        self._starts = np.minimum(np.searchsorted(freqs, edges[:-1]), len(freqs) - 1)
+        self._stop = max(int(np.searchsorted(freqs, edges[-1], side="right")), self._starts[-1] + 1)
+
+    @classmethod
+    def octaves(cls, freqs: np.ndarray, fraction: int, f_min: float, f_max: float):
+        # 1/fraction octave bands, f_max rounded down to a whole band
+        bands = max(int(math.log2(f_max / f_min) * fraction), 1)
+        return cls(freqs, bands, f_min, f_min * 2 ** (bands / fraction))
+
+    def reduce(self, p: np.ndarray, axis: int = 0) -> np.ndarray:
+        p = p[(slice(None),) * axis + (slice(self._stop),)]
+        return np.maximum.reduceat(p, self._starts, axis=axis)
+
+
+class Waterfall:
+    def __init__(self, stft: StftEngine, columns: int, bands: int, f_min: float = 20.0, db_range=(-150.0, 0.0),
+                 scale: float = 1.0):
+        self.stft = stft
+        self.columns = columns
+        self.scale = scale
+        self.db_min, self.db_max = db_range
+        self.binner = LogBinner(stft.freqs, bands, f_min, SAMPLE_RATE / 2)
+        self.seconds = columns * stft.hop / SAMPLE_RATE
+
+        # Colormap indices, every column written twice so the newest `columns` are always one
+        # contiguous slice starting at the oldest one: (channels, 2 * columns, bands)
+        channels = stft.spectra.shape[2:]
+        self.image = np.zeros(channels + (2 * columns, bands), dtype=np.uint8)
+        self.head = 0
+        self._consumed = stft.count
+
+    def update(self) -> int:
+        # Writes one column per STFT frame since the last call, the spectra themselves come from the
+        # engine's queue so nothing is transformed twice
+        X, _, self._consumed = self.stft.poll(self._consumed)
+        X = X[-self.columns:]
+        n = len(X)
+        if n == 0:
+            return 0
+
+        p = X.real.astype(np.float32) ** 2 + X.imag.astype(np.float32) ** 2
+        db = 10.0 * np.log10(self.binner.reduce(p, axis=1) * self.scale + 1e-30)
+        q = np.clip((db - self.db_min) * (255.0 / (self.db_max - self.db_min)), 0, 255).astype(np.uint8)
+
+        # (frames, bands, channels) -> (channels, frames, bands)
+        q = np.moveaxis(q, -1, 0) if q.ndim == 3 else q
+        slots = (self.head + np.arange(n)) % self.columns
+        self.image[..., slots, :] = q
+        self.image[..., slots + self.columns, :] = q
+        self.head = (self.head + n) % self.columns
+        return n
+
+    def view(self) -> np.ndarray:
+        # Oldest to newest along axis -2, a view into the image, no copy. Only stable on the thread
+        # that runs update(), others take a snapshot()
+        return self.image[..., self.head:self.head + self.columns, :]
+
+    def snapshot(self) -> np.ndarray:
+        return self.view().copy()
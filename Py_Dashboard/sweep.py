@@ -0,0 +1,252 @@
+import sys
+import csv
+import time
+import wave
+import argparse
+import threading
+import numpy as np
+
+from buffer import StereoRingBuffer, RegBlock
+from fpga_model import FpgaModel, to_signed, NOTCH_R, SAMPLE_RATE
+
+SWEEP_PERIOD = 16384  # stimulus period in samples, every tone sits exactly on a bin of it
+SWEEP_TONES = 64  # log-spaced tones, fewer at the bottom where bins are sparse
+SWEEP_F_MIN = 20.0
+SWEEP_F_MAX = 20000.0
+SWEEP_PERIODS = 8  # periods averaged per mode
+SETTLE_PERIODS = 2  # periods dropped after every register change, for the filter transients
+SETTLE_SECONDS = 0.2  # extra wait on the board for the register write to land
+STIMULUS_PEAK = 0.5  # of full scale
+FULL_SCALE = 2 ** 23
+
+# Linear mixer paths; distortion and tremolo have no transfer function
+MODES = {0: "pass-through", 1: "low-pass", 2: "high-pass", 3: "band-pass", 4: "notch"}
+
+
+def multitone(period: int = SWEEP_PERIOD, tones: int = SWEEP_TONES, f_min: float = SWEEP_F_MIN,
+              f_max: float = SWEEP_F_MAX) -> tuple[np.ndarray, np.ndarray]:
+    # One period of a multitone with Schroeder phases (low crest factor), as (period, 2) int32 24-bit
+    # samples, and the FFT bins of its tones
+    bins = np.unique(np.round(np.geomspace(f_min, f_max, tones) * period / SAMPLE_RATE).astype(np.int64))
+    k = np.arange(len(bins))
+    spectrum = np.zeros(period // 2 + 1, dtype=np.complex128)
+    spectrum[bins] = np.exp(-1j * np.pi * k * (k - 1) / len(bins))
+    x = np.fft.irfft(spectrum, n=period)
+    x *= STIMULUS_PEAK * (FULL_SCALE - 1) / np.abs(x).max()
+    x = np.round(x).astype(np.int32)
+    return np.stack((x, x), axis=1), bins
+
+
+def transfer(y: np.ndarray, ref: np.ndarray, bins: np.ndarray) -> np.ndarray:
+    # Cross-spectral average over periods: H = sum(Y conj(R)) / sum(|R|^2) at the tone bins.
+    # y and ref are (..., periods, period, channels), all modes go through one batched FFT
+    Y = np.fft.rfft(y, axis=-2)[..., bins, :]
+    R = np.fft.rfft(ref, axis=-2)[..., bins, :]
+    return (Y * R.conj()).sum(axis=-3) / (np.abs(R) ** 2).sum(axis=-3)
+
+
+def theoretical_response(regs: list, mode: int, freqs: np.ndarray) -> np.ndarray:
+    # Transfer function of a mixer path from the same register values the FPGA uses, relative to
+    # pass-through (volume and delay cancel out)
+    r = [to_signed(v) for v in regs]
+    z1 = np.exp(-2j * np.pi * np.asarray(freqs) / SAMPLE_RATE)
+
+    def lpf(a):
+        return (a / 2 ** 31) / (1 - (0x7FFF_FFFF - a) / 2 ** 31 * z1)
+
+    def hpf(a):
+        return ((0x7FFF_FFFF + a) >> 1) / 2 ** 31 * (1 - z1) / (1 - a / 2 ** 31 * z1)
+
+    if mode == 1:
+        return lpf(r[3]) ** 2
+    if mode == 2:
+        return hpf(r[4]) ** 2
+    if mode == 3:
+        return lpf(r[5]) * hpf(r[6])
+    if mode == 4:
+        a = r[7]
+        c = ((a * NOTCH_R) >> 30) / 2 ** 30
+        r2 = ((NOTCH_R * NOTCH_R) >> 30) / 2 ** 30
+        return (1 - a / 2 ** 30 * z1 + z1 ** 2) / (1 - c * z1 + r2 * z1 ** 2)
+    return np.ones_like(z1)
+
+
+def sweep_model(regs: list, modes=MODES, periods: int = SWEEP_PERIODS) -> tuple[np.ndarray, dict]:
+    # Runs the stimulus through the software model for every mode, returns (freqs, {mode: H (tones, 2)})
+    stimulus, bins = multitone()
+    n = SWEEP_PERIOD
+    x = np.tile(stimulus, (SETTLE_PERIODS + periods, 1))
+
+    captures = []
+    for mode in modes:
+        model = FpgaModel(regs)
+        model.regs[0] = mode
+        captures.append(model.process(x)[SETTLE_PERIODS * n:].reshape(periods, n, 2))
+    ref = x[SETTLE_PERIODS * n:].reshape(periods, n, 2)
+
+    H = transfer(np.stack(captures).astype(np.float64), ref.astype(np.float64), bins)
+    return bins * SAMPLE_RATE / n, _relative(modes, H)
+
+
+def sweep_board(buf: StereoRingBuffer, reg_block: RegBlock, modes=MODES, periods: int = SWEEP_PERIODS,
+                timeout: float = 30.0) -> tuple[np.ndarray, dict]:
+    # Steps the board through the modes while the stimulus loops into its input. The pass-through
+    # capture is the reference, and every capture starts a whole number of periods after it, so
+    # all of them see the stimulus at the same phase without knowing the playback path's delay
+    _, bins = multitone()
+    n = SWEEP_PERIOD
+    length = periods * n
+    if length > buf.size:
+        raise ValueError(f"{periods} periods do not fit the {buf.size} sample ring")
+
+    modes = [0] + [m for m in modes if m != 0]
+    old_mixer = reg_block.get("mixer")
+    first = None
+    captures = []
+    try:
+        for mode in modes:
+            reg_block.set("mixer", mode)
+            start = buf.seq + int(SETTLE_SECONDS * SAMPLE_RATE) + SETTLE_PERIODS * n
+            if first is None:
+                first = start
+            start += -(start - first) % n
+
+            deadline = time.monotonic() + timeout
+            while buf.seq < start + length:
+                if time.monotonic() > deadline:
+                    raise TimeoutError("no audio from the board")
+                time.sleep(0.05)
+            capture = buf.read(length, end=start + length)
+            if len(capture) != length:
+                raise RuntimeError("capture overwritten before it was read, use a larger ring")
+            captures.append(capture.reshape(periods, n, 2))
+    finally:
+        reg_block.set("mixer", old_mixer)
+
+    y = np.stack(captures).astype(np.float64)
+    H = transfer(y, y[0], bins)
+    return bins * SAMPLE_RATE / n, dict(zip(modes, H))
+
+
+def _relative(modes, H: np.ndarray) -> dict:
+    responses = dict(zip(modes, H))
+    if 0 in responses:
+        reference = responses[0]
+        responses = {m: h / reference for m, h in responses.items()}
+    return responses
+
+
+def write_stimulus(path: str, seconds: float):
+    # Loopable WAV of the stimulus for playing into the board's line input
+    stimulus, _ = multitone()
+    reps = max(int(seconds * SAMPLE_RATE) // SWEEP_PERIOD, 1)
+    data = np.tile(stimulus, (reps, 1))
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(3)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(np.ascontiguousarray(data.view(np.uint8).reshape(-1, 2, 4)[:, :, :3]))
+
+
+def report(freqs: np.ndarray, responses: dict, regs: list, path: str = None, floor_db: float = -60.0) -> dict:
+    # Measured vs theoretical magnitude; the worst error is taken where the theory is above floor_db,
+    # deeper stopbands are down at the noise and quantization floor
+    rows, worst = [], {}
+    for mode, H in responses.items():
+        theory = theoretical_response(regs, mode, freqs)
+        theory_db = 20 * np.log10(np.abs(theory) + 1e-15)
+        for ch in range(H.shape[1]):
+            measured_db = 20 * np.log10(np.abs(H[:, ch]) + 1e-15)
+            error = measured_db - theory_db
+            valid = theory_db > floor_db
+            worst[(mode, ch)] = float(np.abs(error[valid]).max()) if valid.any() else 0.0
+            rows += [(MODES[mode], ch, f, m, t, e, np.angle(H[i, ch], deg=True), np.angle(theory[i], deg=True))
+                     for i, (f, m, t, e) in enumerate(zip(freqs, measured_db, theory_db, error))]
+
+    if path:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["mode", "channel", "freq", "measured_db", "theory_db", "error_db", "measured_deg",
+                             "theory_deg"])
+            writer.writerows((m, ch, f"{fr:.2f}", f"{a:.3f}", f"{b:.3f}", f"{e:.3f}", f"{p:.2f}", f"{q:.2f}")
+                             for m, ch, fr, a, b, e, p, q in rows)
+    return worst
+
+
+def plot(freqs: np.ndarray, responses: dict, regs: list):
+    import pyqtgraph as pg
+    from PyQt6 import QtWidgets
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+    widget = pg.PlotWidget(title="Frequency response: measured (dots) vs theoretical (lines)")
+    item = widget.getPlotItem()
+    item.setLogMode(x=True)
+    item.setLabel('left', 'Gain', units='dB')
+    item.setLabel('bottom', 'Frequency', units='Hz')
+    item.setYRange(-80, 5)
+    item.addLegend()
+    item.showGrid(x=True, y=True, alpha=0.5)
+
+    dense = np.geomspace(SWEEP_F_MIN, SAMPLE_RATE / 2, 1000)
+    for i, (mode, H) in enumerate(responses.items()):
+        color = pg.intColor(i, len(responses))
+        theory = 20 * np.log10(np.abs(theoretical_response(regs, mode, dense)) + 1e-15)
+        item.plot(dense, theory, pen=pg.mkPen(color, width=1), name=MODES[mode])
+        item.plot(freqs, 20 * np.log10(np.abs(H[:, 0]) + 1e-15), pen=None, symbol="o", symbolSize=5,
+                  symbolBrush=color, symbolPen=None)
+    widget.resize(1000, 600)
+    widget.show()
+    app.exec()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frequency response of the mixer paths vs their register settings")
+    parser.add_argument("--board", action="store_true", help="measure the board instead of the software model, "
+                                                             "with the stimulus playing into its input")
+    parser.add_argument("--reg", action="append", default=[], metavar="NAME=VALUE",
+                        help="register to set before sweeping, may be repeated")
+    parser.add_argument("--periods", type=int, default=SWEEP_PERIODS, help="stimulus periods averaged per mode")
+    parser.add_argument("-o", "--output", help="write measured and theoretical responses as CSV")
+    parser.add_argument("--plot", action="store_true", help="show measured vs theoretical responses")
+    parser.add_argument("--write-stimulus", metavar="WAV", help="write the stimulus as a loopable WAV and exit")
+    parser.add_argument("--stimulus-seconds", type=float, default=60.0)
+    args = parser.parse_args()
+
+    if args.write_stimulus:
+        write_stimulus(args.write_stimulus, args.stimulus_seconds)
+        return 0
+
+    reg_block = RegBlock()
+    for text in args.reg:
+        name, _, value = text.partition("=")
+        reg_block.set(name, int(value, 0))
+    regs = reg_block.dump()
+
+    start = time.perf_counter()
+    if args.board:
+        from network import producer_thread
+        buf = StereoRingBuffer(max(int(5 * SAMPLE_RATE), args.periods * SWEEP_PERIOD), spsc=True)
+        shutdown_evt = threading.Event()
+        eth_th = threading.Thread(target=producer_thread, args=(buf, reg_block, False, shutdown_evt), daemon=True)
+        eth_th.start()
+        try:
+            freqs, responses = sweep_board(buf, reg_block, periods=args.periods)
+        finally:
+            shutdown_evt.set()
+            eth_th.join(timeout=1.0)
+    else:
+        freqs, responses = sweep_model(regs, periods=args.periods)
+    elapsed = time.perf_counter() - start
+
+    worst = report(freqs, responses, regs, args.output)
+    for (mode, ch), err in worst.items():
+        print(f"{MODES[mode]:<13} {'LR'[ch]}  max error {err:.3f} dB")
+    print(f"{len(responses)} modes x {len(freqs)} tones in {elapsed:.2f} s")
+
+    if args.plot:
+        plot(freqs, responses, regs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The dashboard modules import each other by name, as when run from Py_Dashboard
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
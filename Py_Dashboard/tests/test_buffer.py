@@ -0,0 +1,170 @@
+import os
+
+import numpy as np
+import pytest
+
+from buffer import RingBuffer, StereoRingBuffer, MemmapRingBuffer
+
+
+def ramp(start: int, n: int, channels: int = 2) -> np.ndarray:
+    x = np.arange(start, start + n, dtype=np.int32)
+    return np.stack((x, -x), axis=1) if channels == 2 else x
+
+
+@pytest.mark.parametrize("spsc", [False, True])
+def test_read_returns_the_window_ending_at_end(spsc):
+    buf = StereoRingBuffer(1000, spsc=spsc)
+    for start in range(0, 2500, 250):
+        buf.write(ramp(start, 250))
+
+    assert np.array_equal(buf.read(300), ramp(2200, 300))
+    assert np.array_equal(buf.read(300, end=2000), ramp(1700, 300))
+    # Wrapping around the end of the storage
+    assert np.array_equal(buf.read(1000, end=2500), ramp(1500, 1000))
+
+
+@pytest.mark.parametrize("spsc", [False, True])
+def test_read_of_an_overwritten_range_is_empty(spsc):
+    buf = StereoRingBuffer(1000, spsc=spsc)
+    buf.write(ramp(0, 500))
+    stale = buf.seq
+    buf.write(ramp(500, 1200))
+
+    out = buf.read(400, end=stale)
+    assert out.shape == (0, 2)
+    assert buf.read_into(np.empty((400, 2), np.int32), 400, end=stale) == 0
+
+
+@pytest.mark.parametrize("spsc", [False, True])
+def test_envelope_of_an_overwritten_range_is_empty(spsc):
+    buf = StereoRingBuffer(1000, spsc=spsc, envelope_levels=2)
+    buf.write(ramp(0, 500))
+    stale = buf.seq
+    buf.write(ramp(500, 1200))
+
+    lo, hi, factor = buf.read_envelope(400, 5, end=stale)
+    assert lo.shape == hi.shape == (0, 2)
+
+
+def test_envelope_read_during_a_write_detects_the_lap():
+    buf = StereoRingBuffer(1000, spsc=True, envelope_levels=2)
+    buf.write(ramp(0, 1000))
+    seen = {}
+
+    def fill(dst, offset):
+        # The producer has claimed the 200 oldest slots and is overwriting them: a reader in between
+        # must not take their envelope blocks, the newer part of the ring is still intact
+        seen["full"] = buf.read_envelope(1000, 10)
+        seen["recent"] = buf.read_envelope(640, 10)
+        dst[:] = ramp(1000 + offset, len(dst))
+
+    buf.write_with(200, fill)
+    assert len(seen["full"][0]) == 0
+    lo, hi, factor = seen["recent"]
+    assert len(lo) and lo[:, 0].min() >= 360 and hi[:, 0].max() < 1000
+
+
+@pytest.mark.parametrize("spsc", [False, True])
+def test_read_past_the_newest_sample_is_rejected(spsc):
+    buf = RingBuffer(1000, spsc=spsc)
+    buf.write(ramp(0, 100, channels=1))
+    with pytest.raises(ValueError):
+        buf.read(10, end=101)
+    with pytest.raises(ValueError):
+        buf.read_into(np.empty(10, np.int32), 10, end=200)
+
+
+def test_read_is_clipped_to_the_ring():
+    buf = RingBuffer(100)
+    buf.write(ramp(0, 300, channels=1))
+    assert np.array_equal(buf.read(500), ramp(200, 100, channels=1))
+
+
+def test_view_matches_read():
+    buf = StereoRingBuffer(1000, spsc=True)
+    buf.write(ramp(0, 900))
+    buf.write(ramp(900, 800))
+    assert np.array_equal(buf.view(500), buf.read(500))
+    # Wraps around the storage end: no view
+    assert buf.view(800) is None
+
+
+@pytest.mark.parametrize("spsc", [False, True])
+@pytest.mark.parametrize("with_fill", [False, True])
+def test_write_longer_than_the_ring_advances_seq_by_the_full_length(spsc, with_fill):
+    buf = StereoRingBuffer(1000, spsc=spsc, envelope_levels=2)
+    buf.write(ramp(0, 300))
+    data = ramp(300, 3000)
+    if with_fill:
+        buf.write_with(len(data), lambda dst, off: dst.__setitem__(slice(None), data[off:off + len(dst)]))
+    else:
+        buf.write(data)
+
+    assert buf.seq == 3300
+    assert buf.write_ptr == 3300 % 1000
+    assert buf.oldest == 2300
+    assert np.array_equal(buf.read(1000), ramp(2300, 1000))
+
+    # Later writes continue at the right absolute position
+    buf.write(ramp(3300, 100))
+    assert np.array_equal(buf.read(500, end=3400), ramp(2900, 500))
+    lo, hi, factor = buf.read_envelope(1000, 10)
+    assert lo[:, 0].min() >= 2400 and hi[:, 0].max() < 3400
+
+
+def write_pieces(buf: RingBuffer, start: int, n: int, piece: int = 333):
+    for i in range(start, start + n, piece):
+        buf.write(ramp(i, min(piece, start + n - i)))
+
+
+def test_memmap_ring_wraps_around_in_its_files(tmp_path):
+    buf = MemmapRingBuffer(1000, channels=2, spsc=True, envelope_levels=2, path=str(tmp_path / "history"))
+    write_pieces(buf, 0, 3500)
+
+    assert buf.seq == 3500 and buf.write_ptr == 500
+    assert np.array_equal(buf.read(1000), ramp(2500, 1000))
+    # Straddles the end of the file and its start
+    assert np.array_equal(buf.read(600, end=3200), ramp(2600, 600))
+    assert len(buf.read(10, end=2400)) == 0
+    lo, hi, factor = buf.read_envelope(1000, 10)
+    assert lo[:, 0].min() >= 2500 and hi[:, 0].max() < 3500
+    # The ring itself is file 0, the samples land there in ring order
+    stored = np.fromfile(tmp_path / "history" / "0.dat", dtype=np.int32).reshape(1000, 2)
+    assert np.array_equal(stored, np.roll(ramp(2500, 1000), 500, axis=0))
+    buf.close()
+
+
+def test_memmap_ring_resumes_its_history_on_reopen(tmp_path):
+    path = str(tmp_path / "history")
+    buf = MemmapRingBuffer(1000, channels=2, spsc=True, envelope_levels=2, path=path)
+    write_pieces(buf, 0, 2300)
+    buf.close()
+    assert os.listdir(path)
+
+    buf = MemmapRingBuffer(1000, channels=2, spsc=True, envelope_levels=2, path=path)
+    assert buf.resumed and buf.seq == 2300
+    assert np.array_equal(buf.read(1000), ramp(1300, 1000))
+    write_pieces(buf, 2300, 400)
+    assert np.array_equal(buf.read(1000), ramp(1700, 1000))
+    lo, hi, factor = buf.read_envelope(1000, 10)
+    assert lo[:, 0].min() >= 1700 and hi[:, 0].max() < 2700
+
+    # A write the restart cut short is published as it stands, never read as the samples it replaced
+    buf._claim = buf.seq + 100
+    buf.close()
+    buf = MemmapRingBuffer(1000, channels=2, spsc=True, envelope_levels=2, path=path)
+    assert buf.seq == buf._claim == 2800 and buf.write_ptr == 800
+    buf.close()
+
+    # Another layout does not match the files: a fresh, empty ring
+    buf = MemmapRingBuffer(2000, channels=2, spsc=True, envelope_levels=2, path=path)
+    assert not buf.resumed and buf.seq == 0 and buf.write_ptr == 0
+    buf.close()
+
+
+def test_memmap_ring_removes_its_temporary_directory():
+    buf = MemmapRingBuffer(1000, channels=2)
+    buf.write(ramp(0, 1500))
+    assert not buf.resumed and os.path.isdir(buf.path)
+    buf.close()
+    assert not os.path.exists(buf.path)
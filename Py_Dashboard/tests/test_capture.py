@@ -0,0 +1,102 @@
+import os
+import csv
+import time
+
+import numpy as np
+import pytest
+
+from batch import read_wav
+from buffer import StereoRingBuffer, RegBlock
+from capture import CaptureWriter, RegLogger, SAMPLE_RATE
+
+
+def signal(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).integers(-2 ** 23, 2 ** 23, size=(n, 2), dtype=np.int32)
+
+
+def capture(x: np.ndarray, tmp_path, fmt: str, piece: int = 3000, **kwargs) -> CaptureWriter:
+    # Streams x through a ring into a writer, then stops it: everything written must reach the files
+    buf = StereoRingBuffer(2 * SAMPLE_RATE)
+    writer = CaptureWriter(buf, str(tmp_path), fmt, **kwargs)
+    writer.start()
+    while writer.pos != buf.seq:
+        time.sleep(0.01)
+    for i in range(0, len(x), piece):
+        # Never more than the writer can fall behind, so nothing is overrun
+        while buf.seq - writer.pos > buf.size // 2:
+            time.sleep(0.01)
+        buf.write(x[i:i + piece])
+    writer.stop()
+    writer.join()
+    assert writer.written == len(x) and writer.overruns == 0
+    return writer
+
+
+def read_raw(path: str) -> np.ndarray:
+    return np.fromfile(path, dtype="<i4").reshape(-1, 2)
+
+
+def test_wav_files_rotate_on_seconds(tmp_path):
+    x = signal(int(2.5 * SAMPLE_RATE) + 77)
+    writer = capture(x, tmp_path, "wav", rotate_seconds=1.0)
+
+    parts = [np.concatenate(list(read_wav(path))) for path in writer.files]
+    assert [len(p) for p in parts] == [SAMPLE_RATE, SAMPLE_RATE, len(x) - 2 * SAMPLE_RATE]
+    assert np.array_equal(np.concatenate(parts), x)
+    # Named by the ring position of their first sample
+    assert [int(os.path.basename(p)[-16:-4]) for p in writer.files] == [0, SAMPLE_RATE, 2 * SAMPLE_RATE]
+
+
+def test_raw_files_rotate_on_size(tmp_path):
+    x = signal(100_000, seed=1)
+    writer = capture(x, tmp_path, "raw", rotate_mb=0.25)
+
+    per_file = (1 << 18) // 8
+    assert [os.path.getsize(p) for p in writer.files] == [per_file * 8] * 3 + [(len(x) - 3 * per_file) * 8]
+    assert np.array_equal(np.concatenate([read_raw(p) for p in writer.files]), x)
+
+
+@pytest.mark.parametrize("fmt", ["wav", "raw"])
+def test_stop_flushes_a_partial_chunk(tmp_path, fmt):
+    # Far less than one chunk: only the stop makes the writer take it, and the WAV header is patched
+    x = signal(1234, seed=2)
+    writer = capture(x, tmp_path, fmt, piece=500)
+    assert len(writer.files) == 1
+    out = np.concatenate(list(read_wav(writer.files[0]))) if fmt == "wav" else read_raw(writer.files[0])
+    assert np.array_equal(out, x)
+
+
+def test_reg_logger_stamps_every_change_with_the_ring_position(tmp_path):
+    buf = StereoRingBuffer(SAMPLE_RATE)
+    reg_block = RegBlock()
+    path = tmp_path / "regs.csv"
+    logger = RegLogger(buf, reg_block, str(path))
+    logger.start()
+
+    def rows() -> list:
+        if not path.exists():
+            return []
+        with open(path) as f:
+            return list(csv.DictReader(f))
+
+    def wait_rows(n: int):
+        deadline = time.monotonic() + 5.0
+        while len(rows()) < n and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    wait_rows(1)
+    expected = [(0, reg_block.dump())]
+    for i, (name, value) in enumerate((("mixer", 1), ("lpf", 0x1234_5678), ("delay_left", 4800))):
+        buf.write(signal(1000 * (i + 1), seed=i))
+        reg_block.set(name, value)
+        expected.append((buf.seq, reg_block.dump()))
+        wait_rows(len(expected))
+    logger.stop()
+    logger.join()
+
+    names = sorted(reg_block.names, key=reg_block.names.get)
+    logged = rows()
+    assert list(logged[0]) == ["sample", "time"] + names
+    assert [(int(r["sample"]), [int(r[n], 16) for n in names]) for r in logged] == expected
+    times = [float(r["time"]) for r in logged]
+    assert times == sorted(times)
@@ -0,0 +1,40 @@
+import time
+import threading
+
+import numpy as np
+
+from buffer import StereoRingBuffer, RegBlock
+from devices import DeviceRegistry, demux_ingest_thread
+
+
+class DroppingReceiver:
+    # No frames, a fixed count of socket drops, stops the loop after one drops check
+    def __init__(self, shutdown_evt: threading.Event, drops: int):
+        self.lengths = np.zeros(4, dtype=np.int64)
+        self.frames = np.zeros((4, 64), dtype=np.uint8)
+        self.shutdown_evt = shutdown_evt
+        self.drops = drops
+
+    def recv_batch(self) -> int:
+        time.sleep(0.6)
+        return 0
+
+    def kernel_drops(self) -> int:
+        self.shutdown_evt.set()
+        return self.drops
+
+    def close(self):
+        pass
+
+
+def test_kernel_drops_counted_once_per_interface():
+    registry = DeviceRegistry()
+    for mac, iface in (("02:00:00:00:00:01", "eth0"), ("02:00:00:00:00:02", "eth0"), ("02:00:00:00:00:03", "eth1")):
+        registry.add(mac, StereoRingBuffer(4800), RegBlock(), iface=iface)
+
+    shutdown_evt = threading.Event()
+    demux_ingest_thread(DroppingReceiver(shutdown_evt, 7), registry.by_iface()["eth0"], shutdown_evt)
+
+    assert sum(d.stats.snapshot()["kernel_drops"] for d in registry) == 7
+    assert registry.kernel_drops("eth0") == 7
+    assert registry.kernel_drops("eth1") == 0
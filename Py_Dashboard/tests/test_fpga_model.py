@@ -0,0 +1,129 @@
+import numpy as np
+import pytest
+
+from buffer import RegBlock
+from fpga_model import FpgaModel, solve_recurrence, load_sin_rom, to_signed, NOTCH_R, DELAY_DEPTH, \
+    PIPELINE_LATENCY, RECURRENCE_CHUNK
+
+FULL_SCALE = 2 ** 23 - 1
+
+
+def w32(v: int) -> int:
+    return ((v + 2 ** 31) & 0xFFFF_FFFF) - 2 ** 31
+
+
+def naive_recurrence(u: np.ndarray, coefs: list, shift: int, state: np.ndarray) -> np.ndarray:
+    # The documented equation, one sample at a time on Python ints, state updated in place
+    y = np.zeros_like(u)
+    for ch in range(u.shape[0]):
+        hist = [int(v) for v in state[ch]]
+        for i, acc in enumerate(u[ch].tolist()):
+            for k, (c, sign) in enumerate(coefs):
+                acc += sign * ((c * hist[k]) >> shift)
+            hist = [w32(acc)] + hist[:-1]
+            y[ch, i] = hist[0]
+        state[ch] = hist
+    return y
+
+
+def naive_model(x: np.ndarray, regs: list) -> np.ndarray:
+    # audio_i2s.v transcribed sample by sample, following the Verilog rather than the vectorised model.
+    # There are no simulation vectors in the tree, so these tests check the model against this
+    # reference, not against the RTL itself
+    r = [to_signed(v) for v in regs]
+    rom = load_sin_rom().tolist()
+    out = np.zeros(x.shape, dtype=np.int64)
+    for ch in range(2):
+        lpf1 = lpf2 = hpf1 = hpf2 = hpf1_in = hpf2_in = 0
+        notch1 = notch2 = x1 = x2 = phase = 0
+        bpf_lp = bpf_hp = bpf_hp_in = 0
+        mixed = []
+        for xi in x[:, ch].tolist():
+            xs = xi << 8
+            lpf1 = w32(((r[3] * xs) >> 31) + (((0x7FFF_FFFF - r[3]) * lpf1) >> 31))
+            lpf2 = w32(((r[3] * lpf1) >> 31) + (((0x7FFF_FFFF - r[3]) * lpf2) >> 31))
+            new1 = w32(((((0x7FFF_FFFF + r[4]) >> 1) * (xs - hpf1_in)) >> 31) + ((r[4] * hpf1) >> 31))
+            new2 = w32(((((0x7FFF_FFFF + r[4]) >> 1) * (new1 - hpf2_in)) >> 31) + ((r[4] * hpf2) >> 31))
+            hpf1_in, hpf2_in, hpf1, hpf2 = xs, new1, new1, new2
+            y = w32(xs + x2 - ((r[7] * x1) >> 30) + ((((r[7] * NOTCH_R) >> 30) * notch1) >> 30)
+                    - ((((NOTCH_R * NOTCH_R) >> 30) * notch2) >> 30))
+            notch1, notch2, x1, x2 = y, notch1, xs, x1
+            # band_pass_filter: one low pass stage on reg 5 into one high pass stage on reg 6
+            bpf_lp = w32(((r[5] * xs) >> 31) + (((0x7FFF_FFFF - r[5]) * bpf_lp) >> 31))
+            bpf = w32(((((0x7FFF_FFFF + r[6]) >> 1) * (bpf_lp - bpf_hp_in)) >> 31) + ((r[6] * bpf_hp) >> 31))
+            bpf_hp_in, bpf_hp = bpf_lp, bpf
+            threshold = to_signed(regs[8] & 0xFF_FFFF, 24)
+            negative = to_signed(-threshold & 0xFF_FFFF, 24)
+            clipped = threshold if xi > threshold else negative if xi < negative else xi
+            phase = (phase + regs[9]) & 0xFFFF_FFFF
+            tremolo = w32((xs * rom[(phase >> 16) & 0x3FF]) >> 31)
+            m = {1: lpf2 >> 8, 2: hpf2 >> 8, 3: bpf >> 8, 4: y >> 8, 5: clipped, 6: tremolo >> 8}.get(regs[0], xi)
+            mixed.append(w32(((m << 8) * r[1 + ch]) >> 30) >> 8)
+        delay = regs[10 + ch] % DELAY_DEPTH + PIPELINE_LATENCY
+        out[:, ch] = ([0] * delay + mixed)[:len(mixed)]
+    return out
+
+
+def drive_signal(n: int, seed: int = 0) -> np.ndarray:
+    # Tones, noise and full-scale square bursts, so the filters see both small signals and overflow
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    tone = 0.4 * np.sin(2 * np.pi * 997 * t / 48000)[:, None] * FULL_SCALE
+    x = tone + rng.normal(0, 0.05 * FULL_SCALE, (n, 2))
+    square = np.where((t // 37) % 2, FULL_SCALE, -FULL_SCALE - 1)[:, None]
+    burst = (t // 700) % 3 == 2
+    x[burst] = square[burst]
+    return np.clip(np.round(x), -FULL_SCALE - 1, FULL_SCALE).astype(np.int32)
+
+
+def run_chunked(model: FpgaModel, x: np.ndarray, splits: list) -> np.ndarray:
+    bounds = [0] + splits + [len(x)]
+    return np.concatenate([model.process(x[a:b]) for a, b in zip(bounds, bounds[1:])])
+
+
+CASES = {
+    "lpf": {0: 1},
+    "lpf_low_cutoff": {0: 1, 3: 1 << 22},
+    "hpf": {0: 2},
+    "bpf": {0: 3},
+    "bpf_narrow": {0: 3, 5: 0x0400_0000, 6: 0x7C00_0000},
+    "notch": {0: 4},
+    "notch_hot": {0: 4, 1: 0x7FFF_FFFF, 2: 0x5000_0000},
+    "distortion": {0: 5},
+    "distortion_hard": {0: 5, 8: 0x10_0000},
+    "distortion_negative": {0: 5, 8: 0xFFF0_0000},
+    "tremolo": {0: 6},
+    "delay": {0: 1, 10: 700, 11: DELAY_DEPTH + 1300},
+}
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_model_matches_reference_transcription(case):
+    regs = RegBlock().dump()
+    for index, value in CASES[case].items():
+        regs[index] = value
+    n = 3 * RECURRENCE_CHUNK + 2 * 700 + 91
+    x = drive_signal(n)
+    expected = naive_model(x, regs)
+
+    # Whole signal at once, then fed in pieces that straddle the solver's chunk boundaries
+    assert np.array_equal(FpgaModel(regs).process(x), expected)
+    splits = [1, RECURRENCE_CHUNK - 1, RECURRENCE_CHUNK + 3, 2 * RECURRENCE_CHUNK, 1500, 1501, n - 2]
+    assert np.array_equal(run_chunked(FpgaModel(regs), x, splits), expected)
+
+
+@pytest.mark.parametrize("coefs, shift", [
+    ([(0x7FFF_FFFF - 0x1d7b_9a90, 1)], 31),
+    ([(0x7FFF_FFFF - (1 << 20), 1)], 31),
+    ([((0x7ba3_751d * NOTCH_R) >> 30, 1), ((NOTCH_R * NOTCH_R) >> 30, -1)], 30),
+])
+def test_solve_recurrence_matches_naive_loop(coefs, shift):
+    rng = np.random.default_rng(len(coefs) + shift)
+    for n in (1, RECURRENCE_CHUNK - 1, RECURRENCE_CHUNK, RECURRENCE_CHUNK + 1, 4 * RECURRENCE_CHUNK + 17):
+        # Large drive and a state near the rails, so outputs wrap at 32 bits
+        u = rng.integers(-2 ** 31, 2 ** 31, size=(2, n))
+        state = rng.integers(-2 ** 31, 2 ** 31, size=(2, len(coefs)))
+        expected_state = state.copy()
+        expected = naive_recurrence(u, coefs, shift, expected_state)
+        assert np.array_equal(solve_recurrence(u, coefs, shift, state), expected), n
+        assert np.array_equal(state, expected_state), n
@@ -0,0 +1,89 @@
+import csv
+
+import numpy as np
+import pytest
+
+from buffer import StereoRingBuffer
+from measure import MeasurementEngine, MeasurementLog, analyze_spectrum, db, FULL_SCALE
+from spectrum import StftEngine, SAMPLE_RATE
+
+N_FFT = 8192
+
+
+def tone_signal(n: int, harmonic: float = 0.0, noise: float = 0.0, seed: int = 0) -> np.ndarray:
+    # 1 kHz at half scale, an optional 2nd harmonic relative to it and white noise, as floats
+    t = np.arange(n)
+    x = 0.5 * np.sin(2 * np.pi * 1000 * t / SAMPLE_RATE)
+    x += 0.5 * harmonic * np.sin(2 * np.pi * 2000 * t / SAMPLE_RATE + 0.3)
+    return x + np.random.default_rng(seed).normal(0, noise, n)
+
+
+def periodogram(x: np.ndarray, frames: int = 16) -> np.ndarray:
+    # Hann periodogram averaged over `frames` half-overlapped frames, like the STFT queue gives
+    w = np.hanning(N_FFT)
+    hop = N_FFT // 2
+    X = np.fft.rfft([x[i * hop:i * hop + N_FFT] * w for i in range(frames)], axis=1)
+    return (np.abs(X) ** 2).mean(axis=0)
+
+
+def tone_db(amplitude: float, noise: float) -> float:
+    # Sine power over white noise power, in the analyzer's full band
+    return db(amplitude ** 2 / 2 / noise ** 2)
+
+
+def test_thd_of_one_percent_second_harmonic():
+    m = analyze_spectrum(periodogram(tone_signal(9 * N_FFT, harmonic=0.01)), SAMPLE_RATE / N_FFT)
+    assert m["freq"] == pytest.approx(1000, abs=0.5)
+    assert m["thd_db"] == pytest.approx(-40, abs=0.2)
+    assert m["thd_pct"] == pytest.approx(1.0, rel=0.03)
+    # Without noise the rest is the harmonic
+    assert m["thdn_db"] == pytest.approx(m["thd_db"], abs=0.5)
+
+
+@pytest.mark.parametrize("noise", [1e-3, 1e-4])
+def test_snr_and_sinad_against_a_known_noise_floor(noise):
+    m = analyze_spectrum(periodogram(tone_signal(9 * N_FFT, harmonic=0.003, noise=noise)), SAMPLE_RATE / N_FFT)
+    snr = tone_db(0.5, noise)
+    # Noise plus the harmonic relative to the fundamental, SINAD is the same seen from the total
+    rest = noise ** 2 + (0.5 * 0.003) ** 2 / 2
+    assert m["snr_db"] == pytest.approx(snr, abs=0.5)
+    assert m["thdn_db"] == pytest.approx(db(rest / (0.5 ** 2 / 2)), abs=0.5)
+    assert m["sinad_db"] == pytest.approx(db(1 + 0.5 ** 2 / 2 / rest), abs=0.5)
+    assert m["thd_db"] == pytest.approx(db(0.003 ** 2), abs=1.0)
+
+
+def test_engine_measures_each_channel_and_logs_every_result(tmp_path):
+    n = 10 * N_FFT
+    x = np.column_stack((tone_signal(n, harmonic=0.01), tone_signal(n, noise=1e-3, seed=1)))
+    buf = StereoRingBuffer(n)
+    buf.write(np.round(x * FULL_SCALE).astype(np.int32))
+    stft = StftEngine(buf, N_FFT, overlap=0.5, depth=32)
+    stft.update()
+
+    engine = MeasurementEngine(buf, stft, average=16)
+    log = MeasurementLog(str(tmp_path / "measure.csv"))
+    engine.add_listener(log)
+    result = engine.update()
+    # Nothing new from the STFT, nothing measured
+    assert engine.update() is None
+    log.close()
+
+    assert result is engine.snapshot() and result["sample"] == stft.ends[(stft.count - 1) % 32]
+    left, right = result["left"], result["right"]
+    assert left["thd_db"] == pytest.approx(-40, abs=0.2)
+    assert right["snr_db"] == pytest.approx(tone_db(0.5, 1e-3), abs=0.5)
+    for m in (left, right):
+        assert m["freq"] == pytest.approx(1000, abs=0.5)
+        assert m["rms_dbfs"] == pytest.approx(db(0.5 ** 2 / 2), abs=0.05)
+        assert m["peak_dbfs"] == pytest.approx(db(0.5 ** 2), abs=0.05)
+        assert m["crest_db"] == pytest.approx(3.01, abs=0.05)
+
+    with open(tmp_path / "measure.csv") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 1
+    assert list(rows[0]) == ["time", "sample"] + [f"{c}_{f}" for c in ("left", "right")
+                                                  for f in MeasurementLog.FIELDS]
+    assert int(rows[0]["sample"]) == result["sample"]
+    for c in ("left", "right"):
+        for f in MeasurementLog.FIELDS:
+            assert float(rows[0][f"{c}_{f}"]) == pytest.approx(result[c][f], abs=1e-4)
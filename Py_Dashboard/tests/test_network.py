@@ -0,0 +1,239 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import network
+from buffer import StereoRingBuffer, RegBlock
+from network import StreamStats, ETH_HEADER_LEN, FRAME_HEAD, SAMPLE_RATE
+
+SLOTS = 250
+PER_FRAME = SLOTS - 1  # slot 0 holds FRAME_HEAD
+
+
+def sine_frames(count: int, start: int = 0, freq: float = 440.0) -> tuple[np.ndarray, np.ndarray]:
+    # Frames as top.v sends them: 14-byte header, the constant slot 0, then 249 24-bit big-endian
+    # left/right samples, 1514 bytes in all
+    n = np.arange(start * PER_FRAME, (start + count) * PER_FRAME)
+    left = np.round(np.sin(2 * np.pi * freq * n / SAMPLE_RATE) * (2 ** 22)).astype(">i4")
+    pairs = np.stack((left, -left), axis=1).view(np.uint8).reshape(count, PER_FRAME, 2, 4)[..., 1:]
+    frames = np.zeros((count, network.RAW_FRAME_SIZE), dtype=np.uint8)
+    frames[:, ETH_HEADER_LEN:ETH_HEADER_LEN + 6] = np.frombuffer(FRAME_HEAD, dtype=np.uint8)
+    frames[:, ETH_HEADER_LEN + 6:ETH_HEADER_LEN + SLOTS * 6] = pairs.reshape(count, -1)
+    return frames, np.full(count, ETH_HEADER_LEN + SLOTS * 6, dtype=np.int64)
+
+
+def disturbed_stream(batches: int, rng) -> list:
+    # Batches of random size with jittered arrivals, a few lost frames and a few corrupted heads
+    out, frame, t = [], 0, 100.0
+    for _ in range(batches):
+        count = int(rng.integers(1, 20))
+        frames, lengths = sine_frames(count, frame)
+        arrivals = np.empty(count)
+        for i in range(count):
+            gap = 3 if rng.random() < 0.05 else 1
+            t += gap * PER_FRAME / SAMPLE_RATE + rng.normal(0, 2e-4)
+            arrivals[i] = t
+            if rng.random() < 0.05:
+                frames[i, ETH_HEADER_LEN:ETH_HEADER_LEN + 3] ^= 0x40
+        out.append((frames, lengths, count, arrivals))
+        frame += count
+    return out
+
+
+def comparable(stats: StreamStats) -> dict:
+    return {k: stats.c[k].copy() for k in stats.c.dtype.names if not k.startswith("latency")
+            and not k.startswith("decode")}
+
+
+def test_frame_by_frame_and_vectorized_records_agree(monkeypatch):
+    batches = disturbed_stream(200, np.random.default_rng(0))
+    results = []
+    for scalar_max in (0, 1000):
+        monkeypatch.setattr(network, "RECORD_SCALAR_MAX", scalar_max)
+        stats = StreamStats()
+        for frames, lengths, count, arrivals in batches:
+            stats.record(frames, lengths, count, ETH_HEADER_LEN, arrivals, 1e-5, count * PER_FRAME)
+        results.append(comparable(stats))
+
+    vector, scalar = results
+    assert vector["lost_frames"] > 0 and vector["bad_headers"] > 0
+    for key in vector:
+        assert np.array_equal(vector[key], scalar[key]), key
+
+
+@pytest.mark.parametrize("scalar_max", [0, 1000])
+def test_clean_stream_has_no_loss_or_gaps(monkeypatch, scalar_max):
+    monkeypatch.setattr(network, "RECORD_SCALAR_MAX", scalar_max)
+    stats = StreamStats()
+    frames, lengths = sine_frames(400)
+    arrivals = 10.0 + np.arange(400) * PER_FRAME / SAMPLE_RATE
+    for i in range(0, 400, 4):
+        stats.record(frames[i:i + 4], lengths[i:i + 4], 4, ETH_HEADER_LEN, arrivals[i:i + 4], 1e-5, 4 * PER_FRAME)
+
+    s = stats.snapshot()
+    assert s["frames"] == 400 and s["lost_frames"] == 0 and s["bad_headers"] == 0
+    assert s["fps"] == pytest.approx(SAMPLE_RATE / PER_FRAME)
+    assert s["sample_rate"] == pytest.approx(SAMPLE_RATE) and s["rate_ratio"] == pytest.approx(1.0)
+    assert s["jitter_p99_ms"] == 0.0
+
+
+@pytest.mark.parametrize("scalar_max", [0, 1000])
+def test_short_frames_count_as_bad_headers(monkeypatch, scalar_max):
+    monkeypatch.setattr(network, "RECORD_SCALAR_MAX", scalar_max)
+    stats = StreamStats()
+    frames, lengths = sine_frames(4)
+    lengths[1:] = ETH_HEADER_LEN + np.array([0, 3, 6])
+    # Only as wide as the longest frame, like a demultiplexed batch
+    stats.record(frames[:, :ETH_HEADER_LEN + 6], lengths, 4, ETH_HEADER_LEN, 10.0 + np.arange(4) / 200, 1e-5, 0)
+    s = stats.snapshot()
+    assert s["bad_headers"] == 2 and s["lost_frames"] == 0
+
+
+def test_snapshot_jitter_percentile():
+    stats = StreamStats()
+    hist = stats.c["jitter_hist"]
+    centre = len(hist) // 2
+    hist[centre] = 90
+    hist[centre + 3] = 9
+    hist[centre - 6] = 1
+    assert stats.snapshot()["jitter_p99_ms"] == 3 * network.JITTER_BIN_MS
+
+
+def test_scapy_handler_routes_by_source_mac():
+    bufs = [StereoRingBuffer(SAMPLE_RATE) for _ in range(2)]
+    stats = StreamStats()
+    handle = network.scapy_handler({bytes.fromhex("020000000001"): (bufs[0], stats),
+                                    bytes.fromhex("020000000002"): (bufs[1], None)})
+    frames, lengths = sine_frames(3)
+    for i, src in enumerate(("02:00:00:00:00:01", "02:00:00:00:00:02", "02:00:00:00:00:03")):
+        payload = frames[i, ETH_HEADER_LEN:lengths[i]].tobytes()
+        handle(SimpleNamespace(src=src, payload=payload, time=10.0 + i))
+
+    assert bufs[0].seq == PER_FRAME and bufs[1].seq == PER_FRAME
+    assert stats.snapshot()["frames"] == 1
+
+
+def run_bpf(prog: list, packet: bytes) -> int:
+    # Interpreter for the few classic BPF instructions bpf_program emits
+    a = pc = 0
+    while True:
+        code, jt, jf, k = prog[pc]
+        if code == 0x28:
+            a = int.from_bytes(packet[k:k + 2], "big")
+        elif code == 0x20:
+            a = int.from_bytes(packet[k:k + 4], "big")
+        elif code == 0x15:
+            pc += jt if a == k else jf
+        elif code == 0x06:
+            return k
+        else:
+            raise ValueError(f"unexpected opcode {code:#x}")
+        pc += 1
+
+
+BOARDS = ["80:1F:12:CA:83:60", "80:1F:12:CA:83:61", "02:00:00:00:83:60", "80:1f:12:ca:83:63"]
+STRANGERS = ["80:1F:12:CA:83:62", "80:1F:12:CA:00:00", "00:1F:12:CA:83:60", "FF:FF:FF:FF:FF:FF"]
+
+
+@pytest.mark.parametrize("selected", [BOARDS[0], BOARDS[3], BOARDS])
+def test_bpf_program_matches_mac_and_ethertype(selected):
+    prog = network.bpf_program(selected)
+    wanted = {m.upper() for m in ([selected] if isinstance(selected, str) else selected)}
+    for mac in BOARDS + STRANGERS:
+        for ethertype in (network.ETHERTYPE, 0x0800, network.ETHERTYPE ^ 0x0100):
+            packet = bytes(6) + bytes.fromhex(mac.replace(":", "")) + ethertype.to_bytes(2, "big") + bytes(46)
+            accepted = run_bpf(prog, packet) != 0
+            assert accepted == (ethertype == network.ETHERTYPE and mac.upper() in wanted), (mac, ethertype)
+
+
+class FakeSender:
+    # Stands in for RegSender: keeps every frame's registers with the time it went out
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, regs: list):
+        self.sent.append((time.monotonic(), list(regs)))
+
+    def close(self):
+        self.closed = True
+
+
+def run_sender(reg_block: RegBlock, sender: FakeSender) -> tuple[threading.Event, threading.Thread]:
+    shutdown_evt = threading.Event()
+    th = threading.Thread(target=network.register_sender_loop, args=(sender, reg_block, shutdown_evt))
+    th.start()
+    return shutdown_evt, th
+
+
+def wait_sent(sender: FakeSender, n: int, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while len(sender.sent) < n and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_register_burst_goes_out_as_one_frame(monkeypatch):
+    # A wide coalescing window, so the whole burst surely lands inside it, slider events spread over 50 ms
+    monkeypatch.setattr(network, "COALESCE_MS", 200)
+    reg_block = RegBlock()
+    sender = FakeSender()
+    shutdown_evt, th = run_sender(reg_block, sender)
+    wait_sent(sender, 1)
+
+    for i in range(50):
+        reg_block.set("lpf", 1000 + i)
+        reg_block.set("vol_left", 2000 + i)
+        time.sleep(0.001)
+    wait_sent(sender, 2)
+    time.sleep(0.3)
+    shutdown_evt.set()
+    th.join()
+
+    expected = RegBlock()
+    expected.set("lpf", 1049)
+    expected.set("vol_left", 2049)
+    assert [regs for _, regs in sender.sent] == [RegBlock().dump(), expected.dump()]
+    assert sender.closed
+
+
+def test_idle_registers_are_resent_as_keepalive(monkeypatch):
+    monkeypatch.setattr(network, "KEEPALIVE_MS", 150)
+    reg_block = RegBlock()
+    reg_block.set("mixer", 3)
+    sender = FakeSender()
+    shutdown_evt, th = run_sender(reg_block, sender)
+    wait_sent(sender, 4)
+    shutdown_evt.set()
+    th.join()
+
+    times = [t for t, _ in sender.sent]
+    assert all(regs == reg_block.dump() for _, regs in sender.sent)
+    # Never before the keepalive is due, and not much later either: the wait wakes every 0.1 s
+    assert len(times) >= 4 and all(0.15 <= dt < 0.35 for dt in np.diff(times[:4]))
+
+
+def test_reg_sender_frame_layout(monkeypatch):
+    class FakeSocket:
+        def __init__(self, *args):
+            self.frames = []
+
+        def bind(self, address):
+            self.address = address
+
+        def send(self, frame):
+            self.frames.append(frame)
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(network.socket, "socket", FakeSocket)
+    sender = network.RegSender("eth0", network.DST_MAC, "02:00:00:00:00:01")
+    regs = RegBlock().dump()
+    sender.send(regs)
+    assert sender.sock.address == ("eth0", 0)
+    # Broadcast destination, the host's MAC, the stream's ethertype, then 12 big-endian registers
+    assert sender.sock.frames == [b"\xff" * 6 + bytes.fromhex("020000000001") + b"\x88\xb5"
+                                  + b"".join(r.to_bytes(4, "big") for r in regs)]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from buffer import StereoRingBuffer, RegBlock
+from devices import DeviceRegistry
+from server import ApiServer, ApiClient, MSG_SPECTRUM
+
+MACS = ("02:00:00:00:00:01", "02:00:00:00:00:02")
+
+
+@pytest.fixture
+def board_server():
+    registry = DeviceRegistry()
+    t = np.arange(48000)
+    for mac, freq in zip(MACS, (1000, 6000)):
+        buf = StereoRingBuffer(48000, spsc=True)
+        left = np.round(np.sin(2 * np.pi * freq * t / 48000) * 2 ** 22).astype(np.int32)
+        buf.write(np.column_stack((left, -left)))
+        registry.add(mac, buf, RegBlock(), iface="eth0")
+    first = registry[0]
+    server = ApiServer(first.buf, first.reg_block, first.stats, port=0, devices=registry)
+    server.start()
+    client = ApiClient(port=server.port)
+    yield registry, client
+    client.close()
+    server.stop()
+
+
+def test_requests_pick_the_board_by_mac(board_server):
+    registry, client = board_server
+    assert [d["mac"] for d in client.call("devices")["devices"]] == list(MACS)
+
+    name = next(iter(registry[1].reg_block.names))
+    client.call("set", name=name, value=3, mac=MACS[1], iface="eth0")
+    assert registry[1].reg_block.get(name) == 3
+    assert registry[0].reg_block.get(name) != 3
+    with pytest.raises(RuntimeError):
+        client.call("get", name=name, mac="02:00:00:00:00:09", iface="eth0")
+
+    peaks = []
+    for mac in MACS:
+        sub = client.call("subscribe", topic="spectrum", n_fft=1024, rate=50, mac=mac, iface="eth0")["sub"]
+        while True:
+            message = client.recv()
+            if message[0] == MSG_SPECTRUM and message[1] == sub:
+                break
+        client.call("unsubscribe", sub=sub)
+        peaks.append(int(message[3][:, 0].argmax()))
+    assert peaks == [round(1000 / 48000 * 1024), round(6000 / 48000 * 1024)]
@@ -0,0 +1,77 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+from buffer import SharedRingBuffer, SharedRegBlock
+from network import SharedStreamStats, FRAME_HEAD, SAMPLE_RATE
+
+PER_FRAME = 249
+FRAMES = 40
+
+
+def samples(n: int) -> np.ndarray:
+    return np.random.default_rng(0).integers(-2 ** 23, 2 ** 23, size=(n, 2), dtype=np.int32)
+
+
+def ingest(buf_spec: dict, reg_spec: dict, stats_spec: dict):
+    # The ingest process side: attach by spec, check what the parent set, write samples, registers, stats
+    buf = SharedRingBuffer(**buf_spec)
+    reg_block = SharedRegBlock(**reg_spec)
+    stats = SharedStreamStats(**stats_spec)
+    if reg_block.get("lpf") != 0x1234_5678:
+        raise SystemExit(2)
+
+    x = samples(FRAMES * PER_FRAME)
+    frames = np.zeros((FRAMES, 6 + 6 * PER_FRAME), dtype=np.uint8)
+    frames[:, :6] = np.frombuffer(FRAME_HEAD, dtype=np.uint8)
+    lengths = np.full(FRAMES, frames.shape[1])
+    arrivals = 100.0 + np.arange(FRAMES) * PER_FRAME / SAMPLE_RATE
+    for i in range(0, FRAMES, 8):
+        buf.write(x[i * PER_FRAME:(i + 8) * PER_FRAME])
+        stats.record(frames[i:i + 8], lengths[i:i + 8], 8, 0, arrivals[i:i + 8], 1e-5, 8 * PER_FRAME)
+    reg_block.set("mixer", 4)
+    reg_block.set("delay_left", 4800)
+
+    # Detach only: the segments belong to the parent
+    buf.close()
+    reg_block.close()
+    stats.close()
+
+
+def test_child_process_writes_what_the_parent_reads():
+    buf = SharedRingBuffer(4 * SAMPLE_RATE, channels=2, envelope_levels=2)
+    reg_block = SharedRegBlock()
+    stats = SharedStreamStats()
+    reg_block.set("lpf", 0x1234_5678)
+    generation = reg_block.generation
+
+    child = multiprocessing.Process(target=ingest, args=(buf.spec(), reg_block.spec(), stats.spec()))
+    child.start()
+    child.join(timeout=60)
+    assert child.exitcode == 0
+
+    x = samples(FRAMES * PER_FRAME)
+    assert buf.seq == len(x) and np.array_equal(buf.read(len(x)), x)
+    # The envelope pyramid is shared too
+    env_min, env_max, factor = buf.read_envelope(len(x), 1)
+    blocks = x[:len(env_min) * factor].reshape(len(env_min), factor, 2)
+    assert len(env_min) and np.array_equal(env_min, blocks.min(axis=1))
+    assert np.array_equal(env_max, blocks.max(axis=1))
+
+    assert reg_block.get("mixer") == 4 and reg_block.get("delay_left") == 4800 and reg_block.get("lpf") == 0x1234_5678
+    assert reg_block.generation == generation + 2
+
+    s = stats.snapshot()
+    assert s["frames"] == FRAMES and s["samples"] == len(x) and s["queue_depth_max"] == 8
+    assert s["lost_frames"] == 0 and s["bad_headers"] == 0
+    assert s["fps"] == pytest.approx(SAMPLE_RATE / PER_FRAME) and s["sample_rate"] == pytest.approx(SAMPLE_RATE)
+
+    names = [shm.name for shm in buf._shms] + [reg_block.name, stats.name]
+    buf.close(unlink=True)
+    reg_block.close(unlink=True)
+    stats.close(unlink=True)
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
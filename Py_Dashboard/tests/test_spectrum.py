@@ -0,0 +1,131 @@
+import threading
+import numpy as np
+
+from buffer import StereoRingBuffer
+from spectrum import StftEngine, WelchEstimator, Waterfall, LogBinner
+
+
+def noise_buffer(seconds: float = 2.0, size: int = 5 * 48000) -> StereoRingBuffer:
+    buf = StereoRingBuffer(size, spsc=True)
+    rng = np.random.default_rng(0)
+    buf.write(rng.integers(-2 ** 20, 2 ** 20, size=(int(seconds * 48000), 2), dtype=np.int32))
+    return buf
+
+
+def test_poll_returns_the_count_it_stopped_at():
+    buf = noise_buffer()
+    stft = StftEngine(buf, 1024, overlap=0.5, depth=16)
+    stft.update()
+    X, ends, stop = stft.poll(0)
+    assert stop == stft.count
+    assert len(X) == 16 and ends[-1] == stft.ends[(stop - 1) % 16]
+
+
+def test_waterfall_draws_every_frame_once_while_the_stft_runs_on_another_thread():
+    buf = StereoRingBuffer(48000, spsc=True)
+    # Queue and image deep enough that nothing is skipped for falling behind
+    stft = StftEngine(buf, 256, overlap=0.5, depth=1024)
+    waterfall = Waterfall(stft, 1024, 32)
+    done = threading.Event()
+
+    def producer():
+        rng = np.random.default_rng(1)
+        for _ in range(400):
+            buf.write(rng.integers(-2 ** 20, 2 ** 20, size=(256, 2), dtype=np.int32))
+            stft.update()
+        done.set()
+
+    th = threading.Thread(target=producer)
+    th.start()
+    drawn = 0
+    while not done.is_set():
+        drawn += waterfall.update()
+    th.join()
+    drawn += waterfall.update()
+    assert drawn == stft.count
+
+
+def test_log_binner_keeps_peaks():
+    freqs = np.fft.rfftfreq(16384, 1 / 48000)
+    binner = LogBinner(freqs, 200, 20.0, 24000.0)
+    p = np.full(len(freqs), 1e-6)
+    k = np.searchsorted(freqs, 1000.0)
+    p[k] = 1.0
+    bands = binner.reduce(p)
+    assert bands.max() == 1.0
+    band = int(np.argmax(bands))
+    assert binner.edges[band] <= freqs[k] <= binner.edges[band + 1]
+
+
+def periodograms(buf: StereoRingBuffer, stft: StftEngine, ends) -> np.ndarray:
+    # Naive reference: window and transform every frame on its own
+    w = np.hanning(stft.n_fft)[:, None]
+    X = np.array([np.fft.rfft(buf.read(stft.n_fft, end=int(e)) * w, axis=0) for e in ends])
+    return X.real ** 2 + X.imag ** 2
+
+
+def test_stft_frames_match_a_direct_fft_at_every_hop():
+    buf = StereoRingBuffer(48000, spsc=True)
+    stft = StftEngine(buf, 1024, overlap=0.75, depth=64, dtype=np.float64)
+    rng = np.random.default_rng(2)
+    for _ in range(10):
+        buf.write(rng.integers(-2 ** 22, 2 ** 22, size=(700, 2), dtype=np.int32))
+        stft.update()
+
+    X, ends = stft.get(0)
+    assert stft.count == (buf.seq - 1024) // 256 + 1
+    assert np.array_equal(ends, 1024 + 256 * np.arange(stft.count))
+    expected = periodograms(buf, stft, ends)
+    assert np.allclose(X.real ** 2 + X.imag ** 2, expected, rtol=1e-9, atol=1e-3)
+
+
+def test_stft_skips_frames_it_fell_behind_on():
+    buf = noise_buffer(seconds=3.0)
+    stft = StftEngine(buf, 1024, overlap=0.5, depth=8)
+    computed = stft.update()
+    assert computed == 8
+    assert stft.count == (buf.seq - 1024) // 512 + 1
+    _, ends = stft.get(0)
+    assert ends[-1] == 1024 + 512 * (stft.count - 1)
+
+
+def test_welch_mean_and_max_follow_the_last_k_segments():
+    buf = StereoRingBuffer(48000, spsc=True)
+    stft = StftEngine(buf, 512, overlap=0.5, depth=64, dtype=np.float64)
+    welch = WelchEstimator(stft, 5)
+    rng = np.random.default_rng(3)
+    for i in range(40):
+        # Level changes every round so the sliding max has to let old peaks go
+        level = 2 ** (10 + (i * 7) % 12)
+        buf.write(rng.integers(-level, level, size=(256 * (1 + i % 3), 2), dtype=np.int32))
+        welch.update()
+        if stft.count == 0:
+            assert welch.mean() is None
+            continue
+
+        _, ends = stft.get(stft.count - 5)
+        P = periodograms(buf, stft, ends)
+        assert np.allclose(welch.mean(), P.mean(axis=0), rtol=1e-6)
+        assert np.allclose(welch.max(), P.max(axis=0), rtol=1e-6)
+
+
+def test_poll_after_a_stall_returns_only_frames_computed_since():
+    # The ring holds 7 frames, the queue 16: a stall skips frames the queue would still show
+    buf = StereoRingBuffer(4096, spsc=True)
+    stft = StftEngine(buf, 1024, overlap=0.5, depth=16, dtype=np.float64)
+    rng = np.random.default_rng(3)
+    buf.write(rng.integers(-2 ** 22, 2 ** 22, size=(3072, 2), dtype=np.int32))
+    assert stft.update() == 5
+    buf.write(rng.integers(-2 ** 22, 2 ** 22, size=(8192, 2), dtype=np.int32))
+    assert stft.update() == 7
+
+    X, ends, stop = stft.poll(0)
+    assert stop == stft.count == 21 and len(X) == 7
+    assert np.array_equal(ends, buf.seq - 512 * np.arange(6, -1, -1))
+    assert np.allclose(X.real ** 2 + X.imag ** 2, periodograms(buf, stft, ends), rtol=1e-9, atol=1e-3)
+
+    # Frames after the stall are queued as usual
+    buf.write(rng.integers(-2 ** 22, 2 ** 22, size=(1024, 2), dtype=np.int32))
+    stft.update()
+    X, ends, stop = stft.poll(stop - 3)
+    assert len(X) == 5 and ends[-1] == buf.seq
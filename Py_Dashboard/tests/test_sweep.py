@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from buffer import RegBlock, reg_value
+from sweep import multitone, sweep_model, theoretical_response, report, SWEEP_PERIOD, SAMPLE_RATE
+
+
+def test_multitone_tones_sit_on_fft_bins():
+    x, bins = multitone()
+    assert x.shape == (SWEEP_PERIOD, 2) and np.array_equal(x[:, 0], x[:, 1])
+    assert np.all(np.diff(bins) > 0) and bins[0] >= 1 and bins[-1] < SWEEP_PERIOD // 2
+
+    # One period holds whole cycles of every tone: all the power is in the tone bins, none leaks
+    p = np.abs(np.fft.rfft(x[:, 0].astype(np.float64))) ** 2
+    off = np.ones(len(p), dtype=bool)
+    off[bins] = False
+    assert p[off].sum() < 1e-9 * p[bins].sum()
+    assert np.ptp(10 * np.log10(p[bins])) < 0.1
+
+
+@pytest.mark.parametrize("settings", [{}, {"lpf": 500, "bsf": 3000}, {"lpf": 8000, "bsf": 200}])
+def test_model_sweep_follows_the_theory(settings):
+    reg_block = RegBlock()
+    for name, value in settings.items():
+        reg_block.set(name, reg_value(name, value))
+    regs = reg_block.dump()
+
+    freqs, responses = sweep_model(regs, modes=(0, 1, 4), periods=2)
+    assert np.array_equal(freqs, multitone()[1] * SAMPLE_RATE / SWEEP_PERIOD)
+    for mode in (1, 4):
+        theory = theoretical_response(regs, mode, freqs)
+        # Complex error, so phase counts too, down to the -60 dB floor the report uses
+        valid = np.abs(theory) > 1e-3
+        for ch in range(2):
+            error = np.abs(responses[mode][:, ch] - theory)[valid] / np.abs(theory[valid])
+            assert error.max() < 1e-3, (mode, ch)
+    worst = report(freqs, responses, regs)
+    assert max(worst.values()) < 0.01
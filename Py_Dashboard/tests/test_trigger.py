@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from buffer import StereoRingBuffer
+from trigger import EdgeTrigger, FULL_SCALE
+
+
+def naive_triggers(x: np.ndarray, edge: str, level: float, hysteresis: float) -> list:
+    # Schmitt trigger one sample at a time: fire past the level once armed, re-arm beyond the band
+    level = int(level / 100 * FULL_SCALE)
+    band = int(hysteresis / 100 * FULL_SCALE)
+    armed = False
+    found = []
+    for i, v in enumerate(x.tolist()):
+        past = v >= level if edge == "rising" else v <= level
+        beyond = v < level - band if edge == "rising" else v > level + band
+        if past:
+            if armed:
+                found.append(i)
+            armed = False
+        elif beyond:
+            armed = True
+    return found
+
+
+def noisy_sine(n: int, freq: float = 440.0, noise: float = 0.02, seed: int = 0) -> np.ndarray:
+    # Left: sine with noise that chatters around every crossing, right: its inverse
+    rng = np.random.default_rng(seed)
+    t = np.arange(n)
+    left = 0.5 * np.sin(2 * np.pi * freq * t / 48000) + rng.normal(0, noise, n)
+    left = np.round(left * FULL_SCALE).astype(np.int32)
+    return np.column_stack((left, -left))
+
+
+def feed(buf: StereoRingBuffer, trigger: EdgeTrigger, x: np.ndarray, rng) -> None:
+    # Writes in random-sized pieces with a scan after each, like the plot worker between ticks
+    i = 0
+    while i < len(x):
+        n = int(rng.integers(1, 2000))
+        buf.write(x[i:i + n])
+        trigger.scan()
+        i += n
+
+
+@pytest.mark.parametrize("edge, channel, level, hysteresis", [
+    ("rising", 0, 0.0, 1.0),
+    ("falling", 0, 10.0, 2.0),
+    ("rising", 1, -20.0, 5.0),
+    ("rising", 0, 0.0, 0.0),
+])
+def test_scans_match_per_sample_reference(edge, channel, level, hysteresis):
+    x = noisy_sine(48000)
+    buf = StereoRingBuffer(len(x))
+    trigger = EdgeTrigger(buf)
+    trigger.configure(mode="normal", edge=edge, channel=channel, level=level, hysteresis=hysteresis)
+    feed(buf, trigger, x, np.random.default_rng(1))
+
+    assert trigger.recent().tolist() == naive_triggers(x[:, channel], edge, level, hysteresis)
+
+
+def test_hysteresis_swallows_noise():
+    x = noisy_sine(48000)
+    counts = []
+    for hysteresis in (0.0, 8.0):
+        buf = StereoRingBuffer(len(x))
+        trigger = EdgeTrigger(buf)
+        trigger.configure(mode="normal", hysteresis=hysteresis)
+        feed(buf, trigger, x, np.random.default_rng(3))
+        counts.append(trigger.count)
+    # One trigger per period of the 440 Hz sine once the band is wider than the noise
+    assert counts[0] > 450 and counts[1] == 439
+
+
+def test_reconfigure_rescans_what_the_ring_holds():
+    x = noisy_sine(30000)
+    buf = StereoRingBuffer(20000)
+    trigger = EdgeTrigger(buf)
+    trigger.configure(mode="normal")
+    feed(buf, trigger, x, np.random.default_rng(2))
+
+    trigger.configure(edge="falling", level=5.0)
+    trigger.scan()
+    expected = [i + 10000 for i in naive_triggers(x[10000:, 0], "falling", 5.0, 1.0)]
+    assert trigger.recent().tolist() == expected
+
+
+def test_window_is_placed_around_the_trigger():
+    x = noisy_sine(48000, noise=0.0)
+    buf = StereoRingBuffer(len(x))
+    trigger = EdgeTrigger(buf)
+    trigger.configure(mode="normal")
+    buf.write(x)
+
+    window, pre = 2000, 0.25
+    end = trigger.window_end(window, pre)
+    t = trigger.recent()
+    latest = t[t <= buf.seq - (window - int(window * pre))][-1]
+    assert end == latest + window - int(window * pre)
+    trace = buf.read(window, end)[:, 0]
+    assert trace[int(window * pre) - 1] < 0 <= trace[int(window * pre)]
+
+
+def test_single_holds_until_rearmed_and_auto_runs_free():
+    x = noisy_sine(9600, noise=0.0)
+    buf = StereoRingBuffer(48000)
+    trigger = EdgeTrigger(buf)
+    trigger.configure(mode="single")
+    buf.write(x)
+    held = trigger.window_end(1000, 0.5)
+    assert held is not None
+
+    buf.write(x)
+    assert trigger.window_end(1000, 0.5) == held
+    trigger.arm()
+    assert trigger.window_end(1000, 0.5) is None
+    buf.write(x)
+    assert trigger.window_end(1000, 0.5) > held
+
+    # A flat signal never triggers: auto shows the newest samples, normal keeps the last window
+    buf.write(np.zeros((48000, 2), dtype=np.int32))
+    trigger.configure(mode="auto")
+    assert trigger.window_end(1000, 0.5) is None
+    trigger.configure(mode="normal")
+    assert trigger.window_end(1000, 0.5) is None
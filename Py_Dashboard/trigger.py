@@ -0,0 +1,125 @@
+import numpy as np
+
+from buffer import RingBuffer
+
+TRIGGER_HISTORY = 4096  # most recent trigger positions kept
+AUTO_SECONDS = 0.1  # auto mode free-runs when the last trigger is older than this (or the window)
+FULL_SCALE = 2 ** 23
+
+
+class EdgeTrigger:
+    # Schmitt-trigger edge detector over one channel of the ring buffer. Every scan only looks at the
+    # samples written since the previous one and appends the trigger positions it finds to a
+    # circular index of absolute sample positions
+    def __init__(self, buf: RingBuffer):
+        self.buf = buf
+        self.mode = "off"  # off, auto, normal, single
+        self.edge = "rising"
+        self.channel = 0
+        self.level = 0.0  # % of full scale
+        self.hysteresis = 1.0  # % of full scale below (rising) / above (falling) the level to re-arm
+
+        self.positions = np.zeros(TRIGGER_HISTORY, dtype=np.int64)
+        self.count = 0
+        self.held = None  # window end of the last shown trigger, for normal / single
+        self.armed_at = 0  # single mode only takes triggers from this position on
+        self._pos = buf.seq
+        self._armed = False
+
+    def configure(self, mode: str = None, edge: str = None, channel: int = None, level: float = None,
+                  hysteresis: float = None, arm: bool = False):
+        params = (self.edge, self.channel, self.level, self.hysteresis)
+        if arm or (mode is not None and mode != self.mode):
+            self.mode = self.mode if mode is None else mode
+            self.arm()
+        self.edge = self.edge if edge is None else edge
+        self.channel = self.channel if channel is None else channel
+        self.level = self.level if level is None else level
+        self.hysteresis = self.hysteresis if hysteresis is None else hysteresis
+
+        # Positions found with the old condition are stale: rescan what the ring still holds, once
+        if params != (self.edge, self.channel, self.level, self.hysteresis):
+            self.count = 0
+            self.held = None
+            self._pos = self.buf.oldest
+            self._armed = False
+
+    def arm(self):
+        # Single mode: wait for the next trigger after now
+        self.held = None
+        self.armed_at = self.buf.seq
+
+    def scan(self) -> int:
+        # Finds the triggers among the samples written since the last scan, returns how many
+        seq = self.buf.seq
+        start = max(self._pos, self.buf.oldest)
+        n = seq - start
+        if n <= 0:
+            return 0
+
+        x = self.buf.view(n, seq)
+        if x is None:
+            x = self.buf.read(n, seq)
+        x = x[:, self.channel] if x.ndim == 2 else x
+        self._pos = seq
+
+        # Samples past the level fire, samples beyond the hysteresis band re-arm, everything in
+        # between keeps the state. A trigger is a firing sample whose previous event was an arm
+        level = int(self.level / 100 * FULL_SCALE)
+        band = int(self.hysteresis / 100 * FULL_SCALE)
+        if self.edge == "rising":
+            fire, rearm = x >= level, x < level - band
+        else:
+            fire, rearm = x <= level, x > level + band
+
+        events = np.flatnonzero(fire | rearm)
+        if not len(events):
+            return 0
+        kinds = fire[events]
+        prev = np.empty_like(kinds)
+        prev[0] = not self._armed
+        prev[1:] = kinds[:-1]
+        self._armed = not kinds[-1]
+
+        found = events[kinds & ~prev] + start
+        self._push(found)
+        return len(found)
+
+    def _push(self, found: np.ndarray):
+        found = found[-TRIGGER_HISTORY:]
+        slots = (self.count + np.arange(len(found))) % TRIGGER_HISTORY
+        self.positions[slots] = found
+        self.count += len(found)
+
+    def recent(self) -> np.ndarray:
+        # Trigger positions still in the index, oldest first
+        n = min(self.count, TRIGGER_HISTORY)
+        return self.positions[(self.count - n + np.arange(n)) % TRIGGER_HISTORY]
+
+    def window_end(self, window: int, pre: float) -> int:
+        # End of the window to show, pre * window samples before the trigger and the rest after it.
+        # None when the display should run free (off, auto without a recent trigger)
+        if self.mode == "off":
+            return None
+        if self.mode == "single" and self.held is not None:
+            return self.held
+
+        self.scan()
+        pre_samples = int(window * pre)
+        post_samples = window - pre_samples
+        seq, oldest = self.buf.seq, self.buf.oldest
+
+        # Latest trigger whose whole window is written and still held by the ring
+        t = self.recent()
+        i = np.searchsorted(t, seq - post_samples, side="right") - 1
+        if i >= 0 and t[i] - pre_samples >= oldest and (self.mode != "single" or t[i] >= self.armed_at):
+            if self.mode != "auto" or seq - t[i] <= max(window, AUTO_SECONDS * 48000):
+                self.held = int(t[i]) + post_samples
+                return self.held
+
+        if self.mode == "auto":
+            return None
+        # Normal / single keep the last triggered window, while it is still in the ring
+        if self.held is not None and self.held - window < oldest:
+            self.held = None
+        return self.held